@@ -0,0 +1,75 @@
+"""
+Сравнивает время извлечения полей квартир из ответа api:
+get_value_from_json для каждого поля каждой квартиры
+и функцией, скомпилированной compile_json_extractor (pik_scrapper.FLAT_PATHS).
+
+Синтетические квартиры генерируются в памяти, у части квартир
+нет вложенных объектов (bulk, mainBenefit), как и в реальном ответе api.
+Запуск из корня проекта:
+    python -m benchmarks.bench_json_extract --flats 50000
+"""
+
+import argparse
+from random import Random
+from time import perf_counter
+
+from pik.pik_scrapper import FLAT_PATHS, _extract_flats
+from services import get_value_from_json
+
+
+def make_flats(flats: int, seed: int = 1) -> list[dict]:
+    """ Возвращает список описаний квартир в формате api. """
+    rnd = Random(seed)
+    result = []
+    for i in range(flats):
+        flat = {
+            'id': i,
+            'address': f'Москва, ЖК {i % 200}, корпус {i % 7}',
+            'floor': rnd.randint(1, 30),
+            'rooms': rnd.randint(0, 4),
+            'area': round(rnd.uniform(20, 120), 1),
+            'finish': rnd.randint(0, 1),
+            'price': rnd.randint(5_000_000, 30_000_000),
+            'meterPrice': rnd.randint(150_000, 400_000),
+            'bookingStatus': 'active' if i % 7 else 'reserve',
+        }
+        if i % 10:
+            flat['bulk'] = {'name': f'Корпус {i % 7}', 'settlementDate': f'{rnd.randint(2023, 2026)}-06-30'}
+        if i % 3:
+            flat['mainBenefit'] = {'name': 'Ипотека', 'description': 'Ставка от 0,1%'}
+        result.append(flat)
+    return result
+
+
+def measure(function, repeat: int) -> float:
+    """ Возвращает лучшее время выполнения функции в миллисекундах. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best * 1000
+
+
+def extract_old(flats: list[dict]) -> list[tuple]:
+    """ Извлекает поля квартир так же, как до compile_json_extractor. """
+    return [tuple(get_value_from_json(flat, list(keys)) for keys in FLAT_PATHS.values()) for flat in flats]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flats', type=int, default=50000, help='количество квартир')
+    parser.add_argument('--repeat', type=int, default=5, help='количество повторов')
+    args = parser.parse_args()
+
+    flats = make_flats(args.flats)
+    assert extract_old(flats) == _extract_flats(flats), "Результаты извлечения не совпадают!"
+
+    old = measure(lambda: extract_old(flats), args.repeat)
+    new = measure(lambda: _extract_flats(flats), args.repeat)
+    print(f"get_value_from_json:    {old:7.1f} мс на {args.flats} квартир.")
+    print(f"compile_json_extractor: {new:7.1f} мс, быстрее в {old / new:.1f} раза.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Сравнивает время выполнения запроса актуальных цен по фильтру:
+прежний запрос по всей истории цен (GROUP BY flat_id с max(data_created))
+и database.get_flats_by_filter_last_price по таблице latest_prices.
+
+База данных с синтетической историей цен создается во временном файле,
+модуль database импортируется после того, как путь к нему задан в R2D2_DATABASE.
+Запуск из корня проекта:
+    python -m benchmarks.bench_last_price_query --flats 20000 --snapshots 100
+"""
+
+import argparse
+import os
+import tempfile
+from datetime import date, timedelta
+from random import Random
+from time import perf_counter
+
+OLD_SQL = 'SELECT * FROM ' \
+          '(SELECT flat_id, name, city, flats.address, bulk, rooms, area, floor, finishing, settlement_date,\
+                    price, meter_price, booking_status, max(prices.data_created), benefit_name, ' \
+                    'benefit_description, url || url_suffix AS url_address \
+              FROM flats \
+              JOIN projects ON flats.project_id = projects.project_id \
+              JOIN prices ON flats.flat_id = prices.price_id ' \
+          'WHERE city LIKE "{city}" AND name LIKE "{name}" AND rooms = {rooms} AND price <= {max_price} ' \
+          'AND settlement_date <= "{max_settlement_date}" AND finishing = {finishing} ' \
+          'GROUP BY flat_id ORDER BY price) ' \
+          'WHERE booking_status LIKE "{booking_status}"'
+
+PROJECTS = 200
+
+
+def fill_database(flats: int, snapshots: int, seed: int = 1) -> None:
+    """
+    Заполняет базу данных синтетическими ЖК, квартирами и историей цен:
+    на каждую дату сбора записывается цена каждой квартиры.
+    """
+    from database import db_sqlite
+
+    rnd = Random(seed)
+    start = date(2022, 11, 1)
+    cities = ('Москва', 'Московская область', 'Одинцово')
+
+    with db_sqlite.connect:
+        db_sqlite.cursor.executemany(
+            "INSERT INTO projects (project_id, city, name, url, address, data_created) VALUES (?, ?, ?, ?, ?, ?)",
+            ((i, cities[i % 3], f'ЖК {i}', f'https://www.pik.ru/p{i}', f'адрес {i}', start.isoformat())
+             for i in range(PROJECTS)))
+        db_sqlite.cursor.executemany(
+            "INSERT INTO flats (flat_id, project_id, address, floor, rooms, area, finishing, bulk, "
+            "settlement_date, url_suffix, data_created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((i, i % PROJECTS, f'адрес {i}', rnd.randint(1, 30), rnd.randint(0, 4), rnd.uniform(20, 120),
+              rnd.randint(0, 1), 'Корпус 1', f'{rnd.randint(2022, 2026)}-0{rnd.randint(1, 9)}-01',
+              f'/flats/{i}', start.isoformat()) for i in range(flats)))
+
+    base_prices = [rnd.randint(5_000_000, 30_000_000) for _ in range(flats)]
+    for snapshot in range(snapshots):
+        day = (start + timedelta(days=snapshot)).isoformat()
+        with db_sqlite.connect:
+            db_sqlite.cursor.executemany(
+                "INSERT INTO prices (price_id, price, meter_price, booking_status, data_created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                ((i, base_prices[i] + snapshot * 1000, base_prices[i] // 50,
+                  'active' if (i + snapshot) % 7 else 'reserve', day) for i in range(flats)))
+
+
+def measure(function, repeat: int) -> float:
+    """ Возвращает лучшее время выполнения функции в миллисекундах. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flats', type=int, default=20000, help='количество квартир')
+    parser.add_argument('--snapshots', type=int, default=100, help='количество дат сбора цен')
+    parser.add_argument('--repeat', type=int, default=5, help='количество повторов запроса')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ['R2D2_DATABASE'] = os.path.join(tmp_dir, 'bench.sqlite3')
+        from database import database, db_sqlite
+
+        start = perf_counter()
+        fill_database(args.flats, args.snapshots)
+        print(f"Записано {args.flats * args.snapshots} цен за {perf_counter() - start:.1f} с.")
+
+        flats_filter = database.flats_filter | {'max_price': 20_000_000, 'max_settlement_date': '2025-__-__'}
+        old_sql = OLD_SQL.format(**flats_filter)
+        rows_old = len(db_sqlite.execute_sql_fetch(old_sql))
+        rows_new = len(database.get_flats_by_filter_last_price(flats_filter))
+
+        old = measure(lambda: db_sqlite.execute_sql_fetch(old_sql), args.repeat)
+        new = measure(lambda: database.get_flats_by_filter_last_price(flats_filter), args.repeat)
+        print(f"По всей истории цен:   {old:9.1f} мс, {rows_old} квартир.")
+        print(f"По таблице latest_prices: {new:6.1f} мс, {rows_new} квартир.")
+        db_sqlite.connect.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Сравнивает память и время подготовки строк для записи в базу данных:
+дата-класс квартиры с __dict__ и dataclasses.astuple (как было)
+и дата-класс services.Flat со __slots__ и Flat.row.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_records --flats 300000
+"""
+
+import argparse
+import dataclasses
+import tracemalloc
+from time import perf_counter
+
+from services import Flat
+
+DictFlat = dataclasses.make_dataclass('DictFlat', [(field.name, field.type) for field in dataclasses.fields(Flat)])
+
+
+def make_flats(cls: type, flats: int) -> list:
+    """ Возвращает список квартир указанного дата-класса. """
+    return [cls(i, i % 200, f'Москва, ЖК {i % 200}', i % 30, i % 4, 20.5 + i % 100, bool(i % 2), 'Корпус 1',
+                '2025-06-30', f'/flats/{i}', '2023-01-01') for i in range(flats)]
+
+
+def measure_memory(cls: type, flats: int) -> tuple[list, float]:
+    """ Возвращает список квартир и занятую им память в мегабайтах. """
+    tracemalloc.start()
+    result = make_flats(cls, flats)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size / 2 ** 20
+
+
+def measure(function, repeat: int) -> float:
+    """ Возвращает лучшее время выполнения функции в миллисекундах. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        best = min(best, perf_counter() - start)
+    return best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flats', type=int, default=300000, help='количество квартир')
+    parser.add_argument('--repeat', type=int, default=3, help='количество повторов')
+    args = parser.parse_args()
+
+    old_flats, old_memory = measure_memory(DictFlat, args.flats)
+    new_flats, new_memory = measure_memory(Flat, args.flats)
+    assert [dataclasses.astuple(flat) for flat in old_flats] == list(map(Flat.row, new_flats))
+
+    old = measure(lambda: [dataclasses.astuple(flat) for flat in old_flats], args.repeat)
+    new = measure(lambda: list(map(Flat.row, new_flats)), args.repeat)
+    print(f"С __dict__ и astuple: {old_memory:6.1f} Мб, строки за {old:7.1f} мс.")
+    print(f"Со __slots__ и row:   {new_memory:6.1f} Мб, строки за {new:7.1f} мс.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+Измеряет полный сбор scrapper.scrapping() с локального сервера benchmarks/replay_server.py
+без обращения к сайту застройщика: квартир и запросов в секунду, пиковую память (RSS)
+процесса сбора и его процессов разбора, время этапов из метрик сбора (services.metrics).
+
+Каждый сбор выполняется в отдельном процессе с базой данных во временном каталоге.
+Сборы идут по одной базе данных: первый записывает все квартиры, в следующих
+у каждой десятой квартиры меняется цена.
+
+Запуск из корня проекта:
+    python -m benchmarks.bench_scrapping --projects 50 --flats 500 --latency 0.02 --runs 2
+    python -m benchmarks.bench_scrapping --async-crawl --parse-workers 0
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from benchmarks.replay_server import ReplayServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_child(url: str, path: str, async_crawl: bool, parse_workers: int, requests_per_second: float) -> None:
+    """
+    Выполняет один сбор в текущем процессе (запускается из run_scrapping)
+    и выводит метрики сбора и пиковую память в формате json.
+    """
+    import settings
+    settings.PIK_PROJECTS_URL = f'{url}/projects'
+    settings.PIK_API_URL = f'{url}/v2/filter'
+    settings.ASYNC_CRAWL = async_crawl
+    settings.PARSE_WORKERS = parse_workers
+    settings.REQUESTS_PER_SECOND = settings.MAX_REQUESTS_PER_SECOND = requests_per_second
+    settings.MIN_REQUESTS_PER_SECOND = requests_per_second / 10    # при ошибках скорость снижается не ниже
+    settings.BACKOFF_BASE, settings.BACKOFF_MAX = 0.01, 0.1
+    settings.LOGGER_LEVEL = 'WARNING'
+    settings.METRICS_PATH = path
+    settings.ARCHIVE_PATH = os.path.join(path, 'archive')
+
+    import scrapper     # база данных во временном каталоге задана переменной окружения (см. run_scrapping)
+    from services.metrics import metrics
+
+    scrapper.scrapping()
+    report = metrics.report()
+    report['max_rss'] = {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                         'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    print(json.dumps(report))
+
+
+def run_scrapping(url: str, path: str, args: argparse.Namespace) -> tuple[dict, float]:
+    """ Выполняет сбор в отдельном процессе, возвращает его метрики и время в секундах. """
+    command = [sys.executable, '-m', 'benchmarks.bench_scrapping', '--child', url, path,
+               '--parse-workers', str(args.parse_workers), '--rps', str(args.rps)]
+    if args.async_crawl:
+        command.append('--async-crawl')
+    start = perf_counter()
+    # база данных открывается при импорте, поэтому путь к ней передается до запуска процесса
+    env = dict(os.environ, R2D2_DATABASE=os.path.join(path, 'bench.sqlite3'))
+    result = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    seconds = perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Сбор завершился с ошибкой:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), seconds
+
+
+def get_counter(report: dict, name: str) -> float:
+    """ Возвращает сумму значений счетчика по всем меткам. """
+    return sum(item['value'] for item in report['counters'].get(name, []))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--projects', type=int, default=20, help='количество ЖК')
+    parser.add_argument('--flats', type=int, default=300, help='среднее количество квартир в ЖК')
+    parser.add_argument('--latency', type=float, default=0.0, help='средняя задержка ответа в секундах')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов api с кодом 503')
+    parser.add_argument('--recorded', help='каталог с записанными ответами вместо синтетических')
+    parser.add_argument('--runs', type=int, default=2, help='количество сборов')
+    parser.add_argument('--async-crawl', action='store_true', help='асинхронный сбор (ASYNC_CRAWL)')
+    parser.add_argument('--parse-workers', type=int, default=2, help='процессов для разбора (PARSE_WORKERS)')
+    parser.add_argument('--rps', type=float, default=1000, help='ограничение запросов в секунду')
+    parser.add_argument('--child', nargs=2, metavar=('URL', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(*args.child, args.async_crawl, args.parse_workers, args.rps)
+
+    server = ReplayServer(0, args.projects, args.flats, args.latency, args.error_rate, args.recorded).start()
+    print(f"ЖК {args.projects}, квартир {server.total_flats}, задержка {args.latency} с, ошибок {args.error_rate:.0%}, "
+          f"{'асинхронный' if args.async_crawl else 'последовательный'} сбор, процессов разбора {args.parse_workers}.")
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for run in range(1, args.runs + 1):
+                requests = server.requests
+                report, seconds = run_scrapping(server.url, tmp_dir, args)
+                requests = server.requests - requests
+                # скорость по времени сбора, без запуска интерпретатора и импорта модулей
+                total = report['phases']['total']
+                flats = get_counter(report, 'flats_total')
+                phases = ', '.join(f"{name} {value:.2f}" for name, value in report['phases'].items())
+                print(f"Сбор {run}: {total:6.2f} с ({seconds:.2f} с с запуском), {flats / total:8.0f} квартир/с, "
+                      f"{requests / total:6.0f} запросов/с, RSS {report['max_rss']['self'] / 1024:5.0f} Мб "
+                      f"(разбор {report['max_rss']['children'] / 1024:.0f} Мб), этапы: {phases}.")
+                server.version += 1
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
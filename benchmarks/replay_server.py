@@ -0,0 +1,207 @@
+"""
+Локальный сервер, заменяющий pik.ru и api.pik.ru при воспроизведении сбора.
+
+Отдает страницу с проектами (/projects) и страницы api с квартирами (/v2/filter):
+синтетические (--projects, --flats) или записанные при DEBUG = True
+(--recorded temp: temp/main_page.html и temp/raw_flats_info_<id ЖК>_<страница>_<время>.json,
+для каждой страницы берется последний ответ). Задержка ответа (--latency)
+и доля ответов с ошибкой 503 (--error-rate) задаются параметрами.
+
+Для сбора с этого сервера в settings.py укажите
+    PIK_PROJECTS_URL = 'http://127.0.0.1:8000/projects'
+    PIK_API_URL = 'http://127.0.0.1:8000/v2/filter'
+
+Запуск из корня проекта:
+    python -m benchmarks.replay_server --port 8000 --projects 50 --flats 500 --latency 0.05
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+RECORDED_PAGE_PATTERN = re.compile(r'raw_flats_info_(\d+)_(\d+)_.*\.json$')
+
+
+class ReplayServer:
+    def __init__(self, port: int = 0, projects: int = 20, flats: int = 300, latency: float = 0.0,
+                 error_rate: float = 0.0, recorded: str = None, seed: int = 1):
+        """
+        Сервер со страницами pik.ru и api.pik.ru.
+
+        :param port: Порт, 0 - любой свободный.
+        :param projects: Количество синтетических ЖК.
+        :param flats: Среднее количество квартир в синтетическом ЖК.
+        :param latency: Средняя задержка ответа в секундах (от 0.5 до 1.5 этого значения).
+        :param error_rate: Доля ответов api с кодом 503.
+        :param recorded: Каталог с записанными ответами, None - синтетические данные.
+        :param seed: Начальное значение генератора случайных чисел.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.version = 0        # при увеличении меняются цены каждой десятой синтетической квартиры
+        self.requests = 0
+        self.errors = 0
+        self._random = Random(seed)
+        self._lock = threading.Lock()
+
+        if recorded is None:
+            self.projects = {project_id: (f'ЖК {number}', max(1, int(flats * self._random.uniform(0.5, 1.5))))
+                             for number, project_id in enumerate(range(1000, 1000 + projects))}
+            self.main_page = self._get_synthetic_main_page()
+            self.recorded_pages = None
+        else:
+            self.projects = {}
+            self.main_page = read_recorded_main_page(recorded)
+            self.recorded_pages = read_recorded_pages(recorded)
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._get_handler())
+        self._server.daemon_threads = True
+        self.port = self._server.server_port
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    @property
+    def total_flats(self) -> int:
+        """ Количество синтетических квартир во всех ЖК. """
+        return sum(count for _, count in self.projects.values())
+
+    def start(self) -> 'ReplayServer':
+        """ Запускает сервер в отдельном потоке. """
+        threading.Thread(target=self._server.serve_forever, name='replay_server', daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _get_synthetic_main_page(self) -> bytes:
+        """ Возвращает страницу с проектами, в которой список ЖК записан в __NEXT_DATA__. """
+        next_data = json.dumps({'props': {'filters': [{'value': project_id, 'text': name, 'active': False}
+                                                      for project_id, (name, _) in self.projects.items()]}},
+                               ensure_ascii=False, separators=(',', ':'))
+        return (f'<html><head><title>ПИК</title></head><body><div id="__next"></div>'
+                f'<script id="__NEXT_DATA__" type="application/json">{next_data}</script></body></html>').encode()
+
+    def _get_synthetic_page(self, project_id: int, flat_page: int, limit: int) -> bytes | None:
+        """ Возвращает страницу api с квартирами синтетического ЖК или None, если ЖК нет. """
+        if project_id not in self.projects:
+            return None
+        name, count = self.projects[project_id]
+        flats = []
+        for number in range((flat_page - 1) * limit, min(flat_page * limit, count)):
+            flat_id = project_id * 100_000 + number
+            price = 5_000_000 + number * 10_000 + (self.version * 1000 if flat_id % 10 == 0 else 0)
+            area = 20.0 + number % 80
+            flats.append({'id': flat_id, 'address': f'Москва, {name}, корпус {number % 5 + 1}',
+                          'floor': number % 25 + 1, 'rooms': number % 4, 'area': area, 'finish': number % 2 == 0,
+                          'bulk': {'name': f'Корпус {number % 5 + 1}', 'settlementDate': '2025-12-31'},
+                          'mainBenefit': {'name': 'Ипотека', 'description': 'Ставка 5%'},
+                          'price': price, 'meterPrice': int(price / area), 'bookingStatus': 'active'})
+        return json.dumps({'count': count,
+                           'blocks': [{'id': project_id, 'name': name, 'url': f'project{project_id}',
+                                       'metro': 'Метро', 'timeOnFoot': 10, 'longitude': 37.6, 'latitude': 55.7,
+                                       'flats': flats}]}, ensure_ascii=False).encode()
+
+    def _get_handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True     # иначе заголовки и тело ответа ждут подтверждения (~40 мс)
+
+            def log_message(self, *args) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                with server._lock:
+                    server.requests += 1
+                    delay = server.latency * server._random.uniform(0.5, 1.5)
+                    error = url.path != '/projects' and server._random.random() < server.error_rate
+                    if error:
+                        server.errors += 1
+                sleep(delay)
+
+                if error:
+                    self._send(503, b'')
+                elif url.path == '/projects':
+                    self._send(200, server.main_page, 'text/html; charset=utf-8')
+                elif url.path == '/v2/filter':
+                    query = parse_qs(url.query)
+                    try:
+                        project_id, flat_page = int(query['block'][0]), int(query['flatPage'][0])
+                        limit = int(query.get('flatLimit', ['50'])[0])
+                    except (KeyError, ValueError):
+                        return self._send(400, b'')
+                    if server.recorded_pages is not None:
+                        body = server.recorded_pages.get((project_id, flat_page))
+                    else:
+                        body = server._get_synthetic_page(project_id, flat_page, limit)
+                    if body is None:
+                        return self._send(404, b'')
+                    self._send(200, body)
+                else:
+                    self._send(404, b'')
+
+            def _send(self, status: int, body: bytes, content_type: str = 'application/json') -> None:
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+def read_recorded_main_page(path: str) -> bytes:
+    """ Читает записанную страницу с проектами (main_page.html). """
+    with open(os.path.join(path, 'main_page.html'), 'rb') as file:
+        return file.read()
+
+
+def read_recorded_pages(path: str) -> dict[tuple[int, int], bytes]:
+    """
+    Читает записанные ответы api, для каждой страницы ЖК - последний по времени записи.
+
+    :param path: Каталог с файлами raw_flats_info_<id ЖК>_<страница>_<время>.json.
+    :return: Словарь {(id ЖК, страница): тело ответа}.
+    """
+    pages = {}
+    for file_name in sorted(os.listdir(path)):      # время в названии файла, последние - в конце
+        match = RECORDED_PAGE_PATTERN.match(file_name)
+        if match:
+            with open(os.path.join(path, file_name), 'rb') as file:
+                pages[int(match.group(1)), int(match.group(2))] = file.read()
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8000, help='порт сервера')
+    parser.add_argument('--projects', type=int, default=20, help='количество синтетических ЖК')
+    parser.add_argument('--flats', type=int, default=300, help='среднее количество квартир в ЖК')
+    parser.add_argument('--latency', type=float, default=0.0, help='средняя задержка ответа в секундах')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='доля ответов api с кодом 503')
+    parser.add_argument('--recorded', help='каталог с записанными ответами вместо синтетических')
+    args = parser.parse_args()
+
+    server = ReplayServer(args.port, args.projects, args.flats, args.latency, args.error_rate, args.recorded)
+    print(f"Сервер запущен на {server.url}: PIK_PROJECTS_URL = '{server.url}/projects', "
+          f"PIK_API_URL = '{server.url}/v2/filter'.")
+    try:
+        server.start()
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
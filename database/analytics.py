@@ -0,0 +1,138 @@
+"""
+Модуль аналитики по истории цен (таблица prices).
+
+Все расчеты выполняются одним sql запросом с оконными функциями (LAG, LEAD, ROW_NUMBER),
+без загрузки истории цен в python и циклов по строкам.
+
+В таблице prices записываются только изменения цены или статуса бронирования,
+поэтому цена квартиры на дату - это последняя запись не позже этой даты.
+"""
+
+from datetime import date, timedelta
+
+from .db_sqlite import execute_sql_fetch
+
+# заголовки колонок результатов для excel таблиц
+PRICE_CHANGES_HEAD = ('id', 'Дата', 'Цена', 'Изменение цены', 'Цена за метр', 'Бронь', 'Предыдущая бронь')
+PRICE_DROPS_HEAD = ('id', 'ЖК', 'Город', 'Корпус', 'Количество комнат', 'Площадь', 'Этаж', 'Отделка',
+                    'Цена раньше', 'Цена сейчас', 'Снижение', 'Снижение, %', 'Бронь', 'Ссылка')
+MEDIANS_HEAD = ('Дата', 'id ЖК', 'ЖК', 'Количество комнат', 'Отделка', 'Медиана цены за метр', 'Квартир')
+BOOKING_CHURN_HEAD = ('Дата', 'Предыдущая бронь', 'Бронь', 'Квартир')
+
+# цены с предыдущей ценой и статусом бронирования той же квартиры
+PRICES_WITH_PREVIOUS = """
+    SELECT price_id, data_created, price, price - LAG(price) OVER flat AS delta, meter_price,
+           booking_status, LAG(booking_status) OVER flat AS previous_status
+    FROM prices
+    WINDOW flat AS (PARTITION BY price_id ORDER BY data_created, rowid)"""
+
+
+def _get_start_date(days: int) -> str:
+    """ Возвращает дату days дней назад в формате '%Y-%m-%d'. """
+    return (date.today() - timedelta(days=days)).isoformat()
+
+
+def get_price_changes(days: int = 30, flat_id: int = None) -> list[tuple]:
+    """
+    Возвращает изменения цен квартир относительно предыдущей записанной цены.
+
+    :param days: За сколько последних дней.
+    :param flat_id: id квартиры, None - все квартиры.
+    :return: Список кортежей (id, дата, цена, изменение цены, цена за метр, бронь, предыдущая бронь),
+             первая цена квартиры не является изменением и не возвращается.
+    """
+    sql = f"SELECT * FROM ({PRICES_WITH_PREVIOUS}) WHERE delta IS NOT NULL AND data_created >= ?"
+    params = [_get_start_date(days)]
+    if flat_id is not None:
+        sql += " AND price_id = ?"
+        params.append(flat_id)
+    return execute_sql_fetch(sql + " ORDER BY data_created, price_id", params)
+
+
+def get_price_drops(days: int = 7, limit: int = 50, booking_status: str = 'active') -> list[tuple]:
+    """
+    Возвращает квартиры с наибольшим снижением цены за последние days дней
+    (текущая цена из latest_prices против цены на дату days дней назад).
+
+    :param days: За сколько последних дней.
+    :param limit: Количество квартир.
+    :param booking_status: Статус бронирования, шаблон LIKE, '%' - любой.
+    :return: Список кортежей (см. PRICE_DROPS_HEAD), отсортированный по снижению в процентах.
+    """
+    sql = """
+        WITH previous AS (
+            SELECT price_id, price FROM (
+                SELECT price_id, price,
+                       ROW_NUMBER() OVER (PARTITION BY price_id ORDER BY data_created DESC, rowid DESC) AS number
+                FROM prices WHERE data_created <= ?)
+            WHERE number = 1)
+        SELECT flat_id, name, city, bulk, rooms, area, floor, finishing,
+               previous.price, latest_prices.price, previous.price - latest_prices.price AS drop_price,
+               round(100.0 * (previous.price - latest_prices.price) / previous.price, 2) AS drop_percent,
+               booking_status, url || url_suffix AS url_address
+        FROM latest_prices
+        JOIN previous ON previous.price_id = latest_prices.price_id
+        JOIN flats ON flats.flat_id = latest_prices.price_id
+        JOIN projects ON flats.project_id = projects.project_id
+        WHERE latest_prices.price < previous.price AND booking_status LIKE ?
+        ORDER BY drop_percent DESC LIMIT ?"""
+    return execute_sql_fetch(sql, (_get_start_date(days), booking_status, limit))
+
+
+def get_meter_price_medians(days: int = 30, step: int = 1, project_id: int = None) -> list[tuple]:
+    """
+    Возвращает медиану цены за метр по ЖК, количеству комнат и отделке на каждую дату периода.
+    Цена квартиры на дату - последняя записанная цена не позже этой даты.
+
+    :param days: За сколько последних дней.
+    :param step: Шаг между датами в днях, например 7 - по неделям.
+    :param project_id: id ЖК, None - все ЖК.
+    :return: Список кортежей (см. MEDIANS_HEAD).
+    """
+    project_condition = "AND flats.project_id = ?" if project_id is not None else ""
+    sql = f"""
+        WITH RECURSIVE days(day) AS (
+            SELECT date('now', 'localtime', ?)
+            UNION ALL
+            SELECT date(day, ?) FROM days WHERE date(day, ?) <= date('now', 'localtime')),
+        intervals AS (
+            SELECT * FROM (
+                SELECT price_id, meter_price, data_created AS valid_from,
+                       LEAD(data_created, 1, '9999-12-31') OVER (PARTITION BY price_id
+                                                                 ORDER BY data_created, rowid) AS valid_to
+                FROM prices)
+            WHERE valid_to > (SELECT min(day) FROM days)),
+        snapshot AS (
+            SELECT day, flats.project_id, rooms, finishing, meter_price,
+                   ROW_NUMBER() OVER (grp ORDER BY meter_price) AS number, COUNT(*) OVER grp AS total
+            FROM days
+            JOIN intervals ON valid_from <= day AND day < valid_to
+            JOIN flats ON flats.flat_id = intervals.price_id {project_condition}
+            WHERE meter_price IS NOT NULL
+            WINDOW grp AS (PARTITION BY day, flats.project_id, rooms, finishing))
+        SELECT day, snapshot.project_id, name, rooms, finishing, avg(meter_price), max(total)
+        FROM snapshot
+        JOIN projects ON projects.project_id = snapshot.project_id
+        WHERE number IN ((total + 1) / 2, (total + 2) / 2)
+        GROUP BY day, snapshot.project_id, rooms, finishing
+        ORDER BY snapshot.project_id, rooms, finishing, day"""
+    params = [f'-{days} days', f'+{step} days', f'+{step} days']
+    if project_id is not None:
+        params.append(project_id)
+    return execute_sql_fetch(sql, params)
+
+
+def get_booking_churn(days: int = 30) -> list[tuple]:
+    """
+    Возвращает количество смен статуса бронирования по датам.
+
+    :param days: За сколько последних дней.
+    :return: Список кортежей (дата, предыдущая бронь, бронь, количество квартир).
+    """
+    sql = f"""
+        SELECT data_created, previous_status, booking_status, count(*)
+        FROM ({PRICES_WITH_PREVIOUS})
+        WHERE previous_status IS NOT booking_status AND previous_status IS NOT NULL AND data_created >= ?
+        GROUP BY data_created, previous_status, booking_status
+        ORDER BY data_created, count(*) DESC"""
+    return execute_sql_fetch(sql, (_get_start_date(days), ))
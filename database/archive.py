@@ -0,0 +1,296 @@
+"""
+Модуль архива ответов сайта застройщика: страницы с проектами и ответы api с квартирами
+сохраняются при каждом сборе, чтобы после исправления парсера заново разобрать
+любой прошлый сбор в базу данных без повторного обращения к сайту.
+
+Ответы дописываются в сегменты ARCHIVE_PATH/<сбор>_<номер>.gz, каждый ответ - отдельный
+член gzip, поэтому сегмент целиком распаковывается gzip -d, а один ответ читается
+по смещению без распаковки остальных. Новый сегмент начинается после ARCHIVE_SEGMENT_SIZE байт.
+Расположение ответов записывается в таблицу archive_index (сбор, ЖК, страница).
+Сбор в архиве начинается с первого сохраненного ответа и заканчивается в конце
+iter_pages парсера (close), ответы 304 (ЖК не изменился) не сохраняются.
+
+Запуск из корня проекта:
+    python -m database.archive --list
+    python -m database.archive --reprocess pik_2026_10_18__02_00_00_1234
+"""
+
+import argparse
+import gzip
+import os
+import threading
+from itertools import groupby
+from operator import itemgetter
+from typing import Callable, Iterator
+
+import settings
+from .db_sqlite import execute_sql_fetch, get_connection, iter_sql_fetch
+from services import get_data_time, init_logger
+from services.metrics import metrics
+
+logger = init_logger(__name__, settings.LOGGER_LEVEL)
+
+INDEX_BATCH_SIZE = 100      # ответов, после которых расположение записывается в archive_index
+
+# поля archive_index в порядке значений в записях индекса
+INDEX_COLUMNS = ('run', 'source', 'data_created', 'kind', 'project', 'flat_page',
+                 'segment', 'position', 'size', 'raw_size')
+
+
+class ArchiveWriter:
+    def __init__(self, source: str, path: str = None, segment_size: int = None, compression_level: int = None):
+        """
+        Дописывает ответы одного сбора застройщика в сжатые сегменты.
+        Методы можно вызывать из разных потоков (асинхронный сбор идет в отдельном потоке).
+
+        :param source: Застройщик.
+        :param path: Каталог архива, по умолчанию ARCHIVE_PATH.
+        :param segment_size: Размер сегмента в байтах, по умолчанию ARCHIVE_SEGMENT_SIZE.
+        :param compression_level: Уровень сжатия gzip, по умолчанию ARCHIVE_COMPRESSION_LEVEL.
+        """
+        self.source = source
+        self.path = path or settings.ARCHIVE_PATH
+        self.segment_size = segment_size or settings.ARCHIVE_SEGMENT_SIZE
+        self.compression_level = compression_level or settings.ARCHIVE_COMPRESSION_LEVEL
+        self.run = f'{source}_{get_data_time()}_{os.getpid()}'
+        self.segment_number = 0
+        self.segment = None
+        self.file = None
+        self.index: list[tuple] = []
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def add(self, data: str, kind: str, project: str | None, flat_page: int | None, raw: bytes) -> None:
+        """
+        Сохраняет ответ в архив.
+
+        :param data: Дата сбора в формате '%Y-%m-%d'.
+        :param kind: 'projects' - страница с проектами, 'flats' - ответ api с квартирами.
+        :param project: id ЖК из списка проектов или None.
+        :param flat_page: Номер страницы или None.
+        :param raw: Тело ответа.
+        """
+        compressed = gzip.compress(raw, self.compression_level, mtime=0)    # сжатие без блокировки
+        with self._lock:
+            if self.file is None or self.file.tell() >= self.segment_size:
+                self._open_segment()
+            position = self.file.tell()
+            self.file.write(compressed)
+            self.index.append((self.run, self.source, data, kind, project, flat_page,
+                               self.segment, position, len(compressed), len(raw)))
+            if len(self.index) >= INDEX_BATCH_SIZE:
+                self._flush()
+        metrics.inc('archive_bytes_total', len(compressed), source=self.source)
+
+    def close(self) -> None:
+        """ Записывает оставшееся расположение ответов в индекс и закрывает сегмент. """
+        with self._lock:
+            self._flush()
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _open_segment(self) -> None:
+        """ Закрывает текущий сегмент и начинает следующий. """
+        self._flush()
+        if self.file is not None:
+            self.file.close()
+        self.segment_number += 1
+        self.segment = f'{self.run}_{self.segment_number}.gz'
+        self.file = open(os.path.join(self.path, self.segment), 'ab')
+
+    def _flush(self) -> None:
+        """ Передает расположение ответов в индекс (set_index_handler) после записи самих ответов в сегмент. """
+        if not self.index:
+            return
+        self.file.flush()
+        _index_handler(self.index.copy())
+        self.index.clear()
+
+
+def save_index(rows: list[tuple]) -> None:
+    """
+    Записывает расположение ответов в таблицу archive_index.
+
+    :param rows: Записи индекса, значения в порядке INDEX_COLUMNS.
+    """
+    connection = get_connection()
+    with connection:
+        connection.executemany(f"INSERT INTO archive_index ({', '.join(INDEX_COLUMNS)}) "
+                               f"VALUES ({', '.join('?' * len(INDEX_COLUMNS))})", rows)
+
+
+def _add_pending_index(rows: list[tuple]) -> None:
+    """ Откладывает записи индекса до вызова save_pending_index в потоке, который пишет в базу данных. """
+    with _pending_lock:
+        _pending_index.extend(rows)
+
+
+def save_pending_index() -> None:
+    """
+    Записывает отложенные записи индекса в archive_index. Вызывается в потоке, который пишет
+    в базу данных (в цикле iter_pages парсера): ответы могут сохраняться в архив из других потоков
+    (асинхронный сбор), а запись в базу данных из них шла бы параллельно с записью страниц.
+    """
+    with _pending_lock:
+        rows = _pending_index.copy()
+        _pending_index.clear()
+    if rows:
+        save_index(rows)
+
+
+_pending_index: list[tuple] = []
+_pending_lock = threading.Lock()
+_index_handler: Callable[[list[tuple]], None] = _add_pending_index     # получает записи индекса от ArchiveWriter
+_writers: dict[str, ArchiveWriter] = {}     # текущий сбор каждого застройщика в этом процессе
+_writers_lock = threading.Lock()
+
+
+def set_index_handler(handler: Callable[[list[tuple]], None]) -> None:
+    """
+    Задает функцию, которой передаются записи индекса вместо отложенной записи (save_pending_index).
+    Процесс сбора (scrapper._crawl_worker) передает их в процесс, который пишет в базу данных:
+    соединение с базой данных, унаследованное от родительского процесса, использовать нельзя.
+
+    :param handler: Функция, принимающая список записей индекса (значения в порядке INDEX_COLUMNS).
+    """
+    global _index_handler
+    _index_handler = handler
+
+
+def add(source: str, data: str, kind: str, project: str | None, flat_page: int | None, raw: bytes) -> None:
+    """
+    Сохраняет ответ в текущий сбор застройщика (см. ArchiveWriter.add), при первом ответе начинает сбор.
+    Ничего не делает, если архив выключен (ARCHIVE = False). Ошибка записи в архив не прерывает сбор.
+    """
+    if not settings.ARCHIVE:
+        return
+    with _writers_lock:
+        writer = _writers.get(source)
+        if writer is None:
+            writer = _writers[source] = ArchiveWriter(source)
+    try:
+        writer.add(data, kind, project, flat_page, raw)
+    except (OSError, ValueError) as ex:
+        logger.error(f"Не удалось сохранить ответ в архив: {ex!r}")
+
+
+def close(source: str) -> str | None:
+    """
+    Заканчивает текущий сбор застройщика в архиве.
+
+    :param source: Застройщик.
+    :return: Название сбора в архиве или None, если ответов не было.
+    """
+    with _writers_lock:
+        writer = _writers.pop(source, None)
+    if writer is None:
+        return None
+    try:
+        writer.close()
+    except (OSError, ValueError) as ex:
+        logger.error(f"Не удалось закрыть сбор {writer.run} в архиве: {ex!r}")
+    return writer.run
+
+
+def get_runs() -> list[tuple]:
+    """
+    Возвращает сборы в архиве.
+
+    :return: Список кортежей (сбор, застройщик, дата сбора, ответов, байт в архиве, байт без сжатия).
+    """
+    return execute_sql_fetch("SELECT run, source, min(data_created), count(*), sum(size), sum(raw_size) "
+                             "FROM archive_index GROUP BY run ORDER BY min(rowid)")
+
+
+def iter_payloads(run: str, kind: str = None, project: str = None,
+                  path: str = None) -> Iterator[tuple[str, str, str, str | None, int | None, bytes]]:
+    """
+    Возвращает ответы сбора по порядку записи, сегмент открывается один раз
+    и читается последовательно, в памяти находится один ответ.
+
+    :param run: Сбор в архиве.
+    :param kind: 'projects' или 'flats', None - все ответы.
+    :param project: id ЖК, None - все ЖК.
+    :param path: Каталог архива, по умолчанию ARCHIVE_PATH.
+    :return: Генератор кортежей (застройщик, дата сбора, тип ответа, id ЖК, страница, тело ответа).
+    """
+    conditions, params = ['run = ?'], [run]
+    if kind is not None:
+        conditions.append('kind = ?')
+        params.append(kind)
+    if project is not None:
+        conditions.append('project = ?')
+        params.append(project)
+    rows = (row for chunk in iter_sql_fetch(
+        f"SELECT segment, position, size, source, data_created, kind, project, flat_page FROM archive_index "
+        f"WHERE {' AND '.join(conditions)} ORDER BY rowid", params) for row in chunk)
+    for segment, entries in groupby(rows, key=itemgetter(0)):
+        with open(os.path.join(path or settings.ARCHIVE_PATH, segment), 'rb') as file:
+            for _, position, size, source, data, payload_kind, payload_project, flat_page in entries:
+                file.seek(position)
+                yield source, data, payload_kind, payload_project, flat_page, gzip.decompress(file.read(size))
+
+
+def _has_newer_data(run: str, source: str, data: str) -> bool:
+    """ Возвращает True, если после сбора есть более новые данные: следующий сбор застройщика в архиве
+    или цены, записанные после даты сбора. """
+    return bool(execute_sql_fetch(
+        "SELECT 1 FROM archive_index WHERE source = ? AND data_created >= ? AND rowid > "
+        "(SELECT max(rowid) FROM archive_index WHERE run = ?) LIMIT 1", (source, data, run))
+        or execute_sql_fetch("SELECT 1 FROM latest_prices WHERE data_created > ? LIMIT 1", (data, )))
+
+
+def reprocess(run: str, path: str = None) -> int:
+    """
+    Заново разбирает ответы api сбора из архива текущим парсером застройщика
+    и записывает квартиры в базу данных с датой того сбора (database.HistorySink):
+    история цен квартир сбора за его дату заменяется, последние цены, ЖК и квартиры
+    меняются, только если более новых данных нет. Записанные цены не проверяются подписками.
+    Не запускается одновременно со сбором: цены, записанные сбором в это время, тоже не проверяются подписками.
+
+    :param run: Сбор в архиве.
+    :param path: Каталог архива, по умолчанию ARCHIVE_PATH.
+    :return: Количество разобранных страниц.
+    """
+    from services.registry import get_scrapper
+    from .database import HistorySink, bump_data_version
+    from .subscriptions import evaluate_subscriptions, skip_prices
+
+    found = execute_sql_fetch("SELECT source, min(data_created) FROM archive_index WHERE run = ?", (run, ))
+    source, data = found[0]
+    if source is None:
+        logger.warning(f"Сбор {run} не найден в архиве.")
+        return 0
+
+    evaluate_subscriptions()    # цены, записанные до повторного разбора, проверяются как обычно
+    from_rowid = execute_sql_fetch("SELECT max(rowid) FROM prices")[0][0] or 0
+    pages = 0
+    with HistorySink(data, not _has_newer_data(run, source, data)) as sink:
+        for _, payload_data, _, project, flat_page, raw in iter_payloads(run, 'flats', path=path):
+            page = get_scrapper(source).parse_payload(payload_data, project, flat_page, raw)
+            if page is not None:
+                sink.add(page)
+                pages += 1
+    skip_prices(from_rowid)
+    bump_data_version()
+    logger.info(f"Сбор {run}: разобрано {pages} страниц.")
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--list', action='store_true', help='список сборов в архиве')
+    parser.add_argument('--reprocess', metavar='RUN', help='заново разобрать сбор в базу данных')
+    args = parser.parse_args()
+
+    if args.list:
+        for run, source, data, payloads, size, raw_size in get_runs():
+            print(f"{run}: {source}, {data}, ответов {payloads}, {size / 2 ** 20:.1f} Мб "
+                  f"(без сжатия {raw_size / 2 ** 20:.1f} Мб)")
+    if args.reprocess:
+        reprocess(args.reprocess)
+
+
+if __name__ == '__main__':
+    main()
@@ -39,3 +39,220 @@ create table  if not exists prices (
     data_created datetime,
     FOREIGN KEY(price_id) REFERENCES flats(flat_id)
 );
+
+-- последняя (текущая) цена каждой квартиры, обновляется триггером при записи в prices
+create table if not exists latest_prices (
+    price_id integer primary key,
+    benefit_name varchar(127),
+    benefit_description varchar(255),
+    price integer,
+    meter_price integer,
+    booking_status varchar(15),
+    data_created datetime,
+    FOREIGN KEY(price_id) REFERENCES flats(flat_id)
+);
+
+create trigger if not exists prices_update_latest_prices after insert on prices
+begin
+    insert into latest_prices (price_id, benefit_name, benefit_description, price, meter_price,
+                               booking_status, data_created)
+    values (new.price_id, new.benefit_name, new.benefit_description, new.price, new.meter_price,
+            new.booking_status, new.data_created)
+    on conflict(price_id) do update set
+        benefit_name = excluded.benefit_name,
+        benefit_description = excluded.benefit_description,
+        price = excluded.price,
+        meter_price = excluded.meter_price,
+        booking_status = excluded.booking_status,
+        data_created = excluded.data_created
+    where excluded.data_created >= latest_prices.data_created;
+end;
+
+create index if not exists prices_price_id_idx on prices (price_id, data_created);
+create index if not exists flats_project_id_idx on flats (project_id);
+create index if not exists flats_rooms_settlement_date_idx on flats (rooms, settlement_date);
+create index if not exists latest_prices_price_idx on latest_prices (price);
+
+-- состояние сбора информации, позволяет продолжить прерванный сбор
+create table if not exists crawl_runs (
+    run_id integer primary key,
+    source varchar(31),             -- застройщик
+    data_created datetime,          -- дата сбора, записывается в data_created собранных данных
+    projects text,                  -- список проектов в формате json [["id", "name"], ...]
+    started datetime,
+    finished datetime
+);
+
+create table if not exists crawl_pages (
+    run_id integer,
+    project varchar(31),            -- id ЖК из списка проектов
+    flat_page integer,
+    total_pages integer,
+    primary key (run_id, project, flat_page),
+    FOREIGN KEY(run_id) REFERENCES crawl_runs(run_id)
+);
+
+-- отпечатки ЖК с прошлого сбора, неизменившиеся ЖК собираются не полностью
+create table if not exists crawl_fingerprints (
+    source varchar(31),
+    project varchar(31),
+    flats_count integer,
+    digest varchar(40),
+    etag varchar(255),
+    last_modified varchar(63),
+    full_crawled datetime,
+    primary key (source, project)
+);
+
+-- сохраненные фильтры квартир пользователей телеграм бота
+create table if not exists subscriptions (
+    subscription_id integer primary key,
+    chat_id integer,
+    filter text,                    -- фильтр квартир в формате json (FlatsFilter)
+    last_price_rowid integer,       -- цены до этого rowid таблицы prices уже проверены
+    data_created datetime
+);
+create index if not exists subscriptions_chat_id_idx on subscriptions (chat_id);
+
+-- найденные по подпискам квартиры, еще не отправленные пользователям (sent is null)
+create table if not exists notifications (
+    notification_id integer primary key,
+    subscription_id integer,
+    chat_id integer,
+    flat_id integer,
+    price integer,
+    previous_price integer,         -- null - новая квартира
+    data_created datetime,
+    sent datetime,
+    unique (subscription_id, flat_id, price),
+    FOREIGN KEY(subscription_id) REFERENCES subscriptions(subscription_id)
+);
+create index if not exists notifications_not_sent_idx on notifications (chat_id) where sent is null;
+
+-- версия данных, увеличивается после каждого сбора, по ней сбрасывается кэш результатов телеграм бота
+create table if not exists data_version (
+    key integer primary key check (key = 0),
+    version integer not null
+);
+insert or ignore into data_version (key, version) values (0, 0);
+
+-- последний сбор каждого ЖК планировщиком (scheduler.py)
+create table if not exists project_crawls (
+    source varchar(31),
+    project varchar(31),            -- id ЖК из списка проектов
+    crawled datetime,               -- дата и время окончания сбора ЖК
+    pages integer,                  -- страниц, запрошенных при последнем сборе
+    primary key (source, project)
+);
+
+-- пространственный индекс координат ЖК для поиска квартир рядом с точкой и в прямоугольной области,
+-- обновляется триггерами при записи в projects, ЖК без координат в индекс не попадают
+create virtual table if not exists projects_rtree using rtree (
+    project_id,
+    min_latitude, max_latitude,
+    min_longitude, max_longitude
+);
+
+create trigger if not exists projects_insert_rtree after insert on projects
+when new.latitude is not null and new.longitude is not null
+begin
+    insert or replace into projects_rtree values (new.project_id, new.latitude, new.latitude,
+                                                  new.longitude, new.longitude);
+end;
+
+create trigger if not exists projects_update_rtree after update of latitude, longitude on projects
+begin
+    delete from projects_rtree where project_id = old.project_id;
+    insert into projects_rtree select new.project_id, new.latitude, new.latitude, new.longitude, new.longitude
+    where new.latitude is not null and new.longitude is not null;
+end;
+
+create trigger if not exists projects_delete_rtree after delete on projects
+begin
+    delete from projects_rtree where project_id = old.project_id;
+end;
+
+-- полнотекстовый индекс (FTS5) для поиска квартир по названию, городу и метро ЖК, адресу и ценовому предложению,
+-- поиск по префиксам слов (prefix) позволяет находить слова в разных падежах (см. database.search_flats)
+create virtual table if not exists flats_fts using fts5 (
+    project_name, project_city, project_metro, flat_address, benefit,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+);
+
+-- текст квартиры для индекса, ё заменяется на е: unicode61 убирает диакритические знаки только у латиницы
+create view if not exists flats_fts_documents as
+select flats.flat_id, flats.project_id,
+       replace(replace(coalesce(projects.name, ''), 'ё', 'е'), 'Ё', 'Е') as project_name,
+       replace(replace(coalesce(projects.city, ''), 'ё', 'е'), 'Ё', 'Е') as project_city,
+       replace(replace(coalesce(projects.metro, ''), 'ё', 'е'), 'Ё', 'Е') as project_metro,
+       replace(replace(coalesce(flats.address, ''), 'ё', 'е'), 'Ё', 'Е') as flat_address,
+       replace(replace(coalesce(latest_prices.benefit_name, '') || ' ' || coalesce(latest_prices.benefit_description, ''),
+                       'ё', 'е'), 'Ё', 'Е') as benefit
+from flats
+left join projects on projects.project_id = flats.project_id
+left join latest_prices on latest_prices.price_id = flats.flat_id;
+
+-- квартиры, изменившиеся после последнего обновления индекса, отмечаются триггерами,
+-- индекс обновляется одним запросом после записи пачки (database.refresh_search_index):
+-- запись в FTS5 из триггера на каждую строку в несколько раз медленнее;
+-- вместо insert or ignore - проверка not exists: политику конфликтов в триггере заменяет политика внешней команды
+create table if not exists flats_fts_pending (
+    flat_id integer primary key
+);
+
+create trigger if not exists flats_insert_fts after insert on flats
+begin
+    insert into flats_fts_pending (flat_id)
+    select new.flat_id where not exists (select 1 from flats_fts_pending where flat_id = new.flat_id);
+end;
+
+create trigger if not exists flats_update_fts after update of project_id, address on flats
+when old.project_id is not new.project_id or old.address is not new.address
+begin
+    insert into flats_fts_pending (flat_id)
+    select new.flat_id where not exists (select 1 from flats_fts_pending where flat_id = new.flat_id);
+end;
+
+create trigger if not exists flats_delete_fts after delete on flats
+begin
+    insert into flats_fts_pending (flat_id)
+    select old.flat_id where not exists (select 1 from flats_fts_pending where flat_id = old.flat_id);
+end;
+
+create trigger if not exists projects_update_fts after update of name, city, metro on projects
+when old.name is not new.name or old.city is not new.city or old.metro is not new.metro
+begin
+    insert into flats_fts_pending (flat_id)
+    select flat_id from flats
+    where project_id = new.project_id and flat_id not in (select flat_id from flats_fts_pending);
+end;
+
+create trigger if not exists latest_prices_insert_fts after insert on latest_prices
+begin
+    insert into flats_fts_pending (flat_id)
+    select new.price_id where not exists (select 1 from flats_fts_pending where flat_id = new.price_id);
+end;
+
+-- ценовое предложение меняется редко, квартира отмечается только при его изменении
+create trigger if not exists latest_prices_update_fts after update of benefit_name, benefit_description on latest_prices
+when old.benefit_name is not new.benefit_name or old.benefit_description is not new.benefit_description
+begin
+    insert into flats_fts_pending (flat_id)
+    select new.price_id where not exists (select 1 from flats_fts_pending where flat_id = new.price_id);
+end;
+
+-- расположение ответов сайта застройщика в сегментах архива (database/archive.py)
+create table if not exists archive_index (
+    run varchar(63),                -- сбор в архиве: <застройщик>_<время начала>_<pid>
+    source varchar(31),
+    data_created datetime,          -- дата сбора, записывается в data_created при повторном разборе
+    kind varchar(15),               -- 'projects' - страница с проектами, 'flats' - ответ api с квартирами
+    project varchar(31),            -- id ЖК из списка проектов
+    flat_page integer,
+    segment varchar(127),           -- файл сегмента в каталоге ARCHIVE_PATH
+    position integer,               -- смещение ответа (члена gzip) в сегменте
+    size integer,                   -- байт в сегменте
+    raw_size integer                -- байт без сжатия
+);
+create index if not exists archive_index_run_idx on archive_index (run, project, flat_page);
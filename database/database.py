@@ -3,14 +3,62 @@
 В текущей реализации sqlite3.
 """
 
-import dataclasses
+import json
+import re
+from datetime import date, datetime, timedelta
+from itertools import chain
+from math import asin, cos, radians, sin, sqrt
+from time import perf_counter
+from typing import Iterator
 
 from .db_sqlite import *
-from services import Project, Flat, Price, init_logger
-from settings import LOGGER_LEVEL
+from .filters import FlatsFilter
+from services import Project, Flat, Price, Page, Fingerprint, FLATS_HEAD, init_logger
+from services.metrics import metrics
+from settings import LOGGER_LEVEL, DB_CHUNK_SIZE, CHECKPOINT_MAX_AGE_DAYS
 
 logger = init_logger(__name__, LOGGER_LEVEL)
 
+# уникальное поле таблицы и поля, которые обновляются, если запись с таким значением уже есть;
+# дата первого появления (data_created) не обновляется, цены уникального поля не имеют
+UPSERT_COLUMNS = {
+    'projects': ('project_id', ('city', 'name', 'url', 'metro', 'time_to_metro',
+                                'latitude', 'longitude', 'address')),
+    'flats': ('flat_id', ('project_id', 'address', 'floor', 'rooms', 'area', 'finishing',
+                          'bulk', 'settlement_date', 'url_suffix')),
+    'prices': (None, ()),
+}
+
+# цена не записывается, если цена и статус бронирования совпадают с последней записанной ценой квартиры;
+# сравнение выполняется в базе данных, поэтому учитывает цены, записанные другими процессами
+_PRICE_PARAMS = {column: f'?{number}' for number, column in enumerate(Price.columns, start=1)}
+UNCHANGED_PRICE_CONDITION = f"EXISTS (SELECT 1 FROM latest_prices WHERE price_id = {_PRICE_PARAMS['price_id']} " \
+                            f"AND price IS {_PRICE_PARAMS['price']} " \
+                            f"AND booking_status IS {_PRICE_PARAMS['booking_status']})"
+# при повторном разборе прошлого сбора (replace_prices) цена сравнивается с историей цен на дату сбора
+HISTORY_PRICE_CONDITION = f"coalesce((SELECT price IS {_PRICE_PARAMS['price']} " \
+                          f"AND booking_status IS {_PRICE_PARAMS['booking_status']} " \
+                          f"FROM prices WHERE price_id = {_PRICE_PARAMS['price_id']} " \
+                          f"AND data_created <= {_PRICE_PARAMS['data_created']} " \
+                          f"ORDER BY data_created DESC, rowid DESC LIMIT 1), 0)"
+
+# поля квартиры в результатах запросов (до даты изменения цены)
+FLAT_COLUMNS = "flat_id, name, city, flats.address, bulk, rooms, area, floor, finishing, settlement_date, " \
+               "price, meter_price, booking_status"
+
+# заголовок таблицы квартир рядом с точкой (iter_flats_near, iter_flats_in_box)
+NEAR_FLATS_HEAD = FLATS_HEAD + ('Расстояние, км', )
+
+# окончания слов, отбрасываемые перед поиском по префиксу (search_flats): «Москве» ищется как «москв*»
+WORD_ENDINGS = sorted(('ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ой', 'ей', 'ий', 'ый', 'ая', 'яя',
+                       'ое', 'ее', 'ые', 'ие', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ую', 'юю', 'ью',
+                       'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й'), key=len, reverse=True)
+MIN_STEM_LENGTH = 3         # букв, короче окончание не отбрасывается
+WORD_PATTERN = re.compile(r'\w+')
+
+EARTH_RADIUS_KM = 6371.0
+KM_IN_DEGREE = 111.32       # км в одном градусе широты (и долготы на экваторе)
+
 flats_filter = {'city': '%Москв%',
                 'name': '%',
                 'rooms': 1,
@@ -21,26 +69,299 @@ flats_filter = {'city': '%Москв%',
                 }
 
 
-def save_to_database(table_name: str, data_to_save: list[Project | Flat | Price]) -> None:
+def save_to_database(table_name: str, data_to_save: list[Project | Flat | Price],
+                     update: bool = True) -> dict[str, int]:
     """
-    Сохраняет данные в базу данных.
+    Сохраняет данные в базу данных пачками по DB_CHUNK_SIZE записей в одной транзакции.
+    ЖК и квартиры уникальны по project_id и flat_id, для уже записанных
+    обновляются изменившиеся поля. Цены записываются только если
+    изменилась цена или статус бронирования квартиры.
 
     :param table_name: Название таблицы в базе данных.
-    :param data_to_save: Данные для сохранения в виде списка словарей {'название поля': значение}.
-    :return: None.
+    :param data_to_save: Список дата-классов для сохранения.
+    :param update: False - уже записанные ЖК и квартиры не обновляются (данные старше записанных).
+    :return: Словарь с количеством добавленных (inserted), обновленных (updated)
+             и пропущенных (skipped) записей.
     """
-    create_db()
-    for data in data_to_save:
-        try:
-            insert(table_name, dataclasses.asdict(data))
-        except sqlite3.IntegrityError:
-            # такая запись уже имеется,
-            # отсеиваем ЖК и квартиры по уникальным project_id и flat_id
-            # при этом цены уникального поля не имеют и будут записаны все
-            # дубликаты с ценой удалим вызвав функцию "db_sqlite.remove_duplicates_prices_table()"
-            pass
-        except Exception as ex:
-            logger.error(f"Ошибка при сохранении в базу данных {ex}")
+    start = perf_counter()
+    result = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    if not data_to_save:
+        return result
+
+    record = type(data_to_save[0])
+    conflict_column, update_columns = UPSERT_COLUMNS[table_name]
+    if not update:
+        update_columns = ()
+    skip_condition = UNCHANGED_PRICE_CONDITION if table_name == 'prices' else None
+    try:
+        result = insert_many(table_name, record.columns, map(record.row, data_to_save),
+                             conflict_column, update_columns, DB_CHUNK_SIZE, skip_condition)
+    except sqlite3.Error as ex:
+        logger.error(f"Ошибка при сохранении в базу данных {ex}")
+        metrics.inc('db_errors_total', table=table_name)
+
+    metrics.observe('db_write_seconds', perf_counter() - start, table=table_name)
+    for key, value in result.items():
+        metrics.inc('db_rows_total', value, table=table_name, result=key)
+    logger.debug(f"Таблица {table_name}: добавлено {result['inserted']}, обновлено {result['updated']}, "
+                f"пропущено {result['skipped']} записей.")
+    return result
+
+
+class DatabaseSink:
+    def __init__(self, run_id: int = None, buffer_size: int = DB_CHUNK_SIZE):
+        """
+        Сохраняет страницы с квартирами в базу данных по мере их сбора.
+        В памяти накапливается не больше buffer_size квартир, после чего
+        они записываются в базу данных, так что уже собранные данные
+        не теряются при аварийном завершении сбора.
+
+        :param run_id: id сбора (см. start_crawl_run), записанные страницы отмечаются
+                       как собранные, None - не отмечать.
+        :param buffer_size: Количество квартир, после которого данные записываются.
+        """
+        self.run_id = run_id
+        self.buffer_size = buffer_size
+        self.pages: list[tuple[str, int, int]] = []
+        self.projects: list[Project] = []
+        self.flats: list[Flat] = []
+        self.prices: list[Price] = []
+        self.result = {table: {'inserted': 0, 'updated': 0, 'skipped': 0} for table in ('projects', 'flats', 'prices')}
+
+    def __enter__(self) -> 'DatabaseSink':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """ Записывает оставшиеся данные и пишет в лог итог сохранения. """
+        self.flush()
+        for table, saved in self.result.items():
+            logger.info(f"Таблица {table}: добавлено {saved['inserted']}, обновлено {saved['updated']}, "
+                        f"пропущено {saved['skipped']} записей.")
+
+    def add(self, page: Page) -> None:
+        """ Добавляет страницу, при заполнении буфера записывает данные в базу данных. """
+        self.projects.extend(page.projects)
+        self.flats.extend(page.flats)
+        self.prices.extend(page.prices)
+        self.pages.append((page.project, page.flat_page, page.total_pages))
+        if len(self.flats) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """ Записывает накопленные данные в базу данных. """
+        for table, data in (('projects', self.projects), ('flats', self.flats), ('prices', self.prices)):
+            saved = save_to_database(table, data)
+            for key, value in saved.items():
+                self.result[table][key] += value
+            data.clear()
+        refresh_search_index()
+        # отмечаем страницы после записи данных: если сбор прервется между этими шагами,
+        # страницы будут собраны повторно, а повторная запись ничего не изменит
+        if self.run_id is not None and self.pages:
+            save_crawl_pages(self.run_id, self.pages)
+        self.pages.clear()
+
+
+def replace_prices(data: str, prices: list[Price]) -> dict[str, int]:
+    """
+    Заменяет историю цен квартир за дату прошлого сбора (повторный разбор сбора, см. database/archive.py):
+    цены этих квартир за эту дату удаляются, новая цена записывается, если отличается от предыдущей
+    по истории на эту дату. Последняя цена (latest_prices) пересчитывается по истории,
+    так что цены, записанные после этой даты, остаются последними.
+
+    :param data: Дата сбора в формате '%Y-%m-%d'.
+    :param prices: Цены квартир, собранные в эту дату.
+    :return: Словарь с количеством добавленных (inserted), обновленных (updated)
+             и пропущенных (skipped) записей.
+    """
+    start = perf_counter()
+    result = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    placeholders = ", ".join(_PRICE_PARAMS.values())
+    insert_sql = f"INSERT INTO prices ({', '.join(Price.columns)}) SELECT {placeholders} " \
+                 f"WHERE NOT {HISTORY_PRICE_CONDITION}"
+    latest_columns = ', '.join(Price.columns)
+    connection = get_connection()
+    try:
+        for i in range(0, len(prices), DB_CHUNK_SIZE):
+            chunk = prices[i:i + DB_CHUNK_SIZE]
+            flat_ids = json.dumps(sorted({price.price_id for price in chunk}))
+            with connection:
+                connection.execute("DELETE FROM prices WHERE data_created = ? "
+                                   "AND price_id IN (SELECT value FROM json_each(?))", (data, flat_ids))
+                inserted = connection.executemany(insert_sql, map(Price.row, chunk)).rowcount
+                # триггер prices_update_latest_prices заменяет последнюю цену ценой той же даты,
+                # поэтому последняя цена пересчитывается по истории
+                connection.execute("DELETE FROM latest_prices WHERE price_id IN (SELECT value FROM json_each(?)) "
+                                   "AND price_id NOT IN (SELECT price_id FROM prices "
+                                   "WHERE price_id IN (SELECT value FROM json_each(?)))", (flat_ids, flat_ids))
+                connection.execute(
+                    f"""INSERT INTO latest_prices ({latest_columns})
+                        SELECT {latest_columns} FROM prices WHERE rowid IN (
+                            SELECT (SELECT rowid FROM prices WHERE price_id = value
+                                    ORDER BY data_created DESC, rowid DESC LIMIT 1)
+                            FROM json_each(?)) AND true
+                        ON CONFLICT(price_id) DO UPDATE SET
+                            {', '.join(f"{column} = excluded.{column}" for column in Price.columns[1:])}
+                        WHERE {' OR '.join(f"{column} IS NOT excluded.{column}" for column in Price.columns[1:])}""",
+                    (flat_ids, ))
+            result['inserted'] += inserted
+            result['skipped'] += len(chunk) - inserted
+    except sqlite3.Error as ex:
+        logger.error(f"Ошибка при сохранении в базу данных {ex}")
+        metrics.inc('db_errors_total', table='prices')
+
+    metrics.observe('db_write_seconds', perf_counter() - start, table='prices')
+    for key, value in result.items():
+        metrics.inc('db_rows_total', value, table='prices', result=key)
+    return result
+
+
+class HistorySink(DatabaseSink):
+    def __init__(self, data: str, update: bool, buffer_size: int = DB_CHUNK_SIZE):
+        """
+        Сохраняет страницы повторно разобранного прошлого сбора (см. database/archive.py):
+        история цен за дату сбора заменяется (replace_prices), уже записанные ЖК и квартиры
+        обновляются, только если более новых данных нет.
+
+        :param data: Дата сбора в формате '%Y-%m-%d'.
+        :param update: Обновлять уже записанные ЖК и квартиры.
+        :param buffer_size: Количество квартир, после которого данные записываются.
+        """
+        super().__init__(buffer_size=buffer_size)
+        self.data = data
+        self.update = update
+
+    def flush(self) -> None:
+        """ Записывает накопленные данные в базу данных. """
+        for table, data in (('projects', self.projects), ('flats', self.flats)):
+            saved = save_to_database(table, data, self.update)
+            for key, value in saved.items():
+                self.result[table][key] += value
+            data.clear()
+        for key, value in replace_prices(self.data, self.prices).items():
+            self.result['prices'][key] += value
+        self.prices.clear()
+        refresh_search_index()
+        self.pages.clear()
+
+
+def start_crawl_run(source: str, data: str, projects: set[tuple[str, str]]) -> int:
+    """
+    Записывает начало сбора информации.
+
+    :param source: Застройщик.
+    :param data: Дата сбора в формате '%Y-%m-%d'.
+    :param projects: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...}.
+    :return: id сбора.
+    """
+    connection = get_connection()
+    with connection:
+        return connection.execute("INSERT INTO crawl_runs (source, data_created, projects, started) "
+                                  "VALUES (?, ?, ?, ?)",
+                                  (source, data, json.dumps(sorted(projects), ensure_ascii=False),
+                                   datetime.now().isoformat(sep=' ', timespec='seconds'))).lastrowid
+
+
+def get_unfinished_crawl_run(source: str) -> tuple[int, str, set[tuple[str, str]]] | None:
+    """
+    Возвращает последний незавершенный сбор информации застройщика,
+    сборы старше CHECKPOINT_MAX_AGE_DAYS дней завершаются без продолжения
+    (в журнал записывается количество несобранных ЖК): иначе недостающие страницы
+    записывались бы с датой прошлого сбора, а сбор текущего дня не выполнялся бы.
+
+    :param source: Застройщик.
+    :return: Кортеж (id сбора, дата сбора, множество проектов) или None.
+    """
+    runs = execute_sql_fetch("SELECT run_id, data_created, projects FROM crawl_runs "
+                             "WHERE source = ? AND finished IS NULL ORDER BY run_id DESC", (source, ))
+    for run_id, data, projects in runs:
+        if date.fromisoformat(data) >= date.today() - timedelta(days=CHECKPOINT_MAX_AGE_DAYS):
+            return run_id, data, {tuple(project) for project in json.loads(projects)}
+        incomplete_projects = get_incomplete_projects(run_id, {tuple(project) for project in json.loads(projects)})
+        logger.warning(f"Сбор {run_id} от {data} устарел и не будет продолжен, "
+                       f"не собрано полностью ЖК: {len(incomplete_projects)}.")
+        finish_crawl_run(run_id)
+    return None
+
+
+def finish_crawl_run(run_id: int) -> None:
+    """ Записывает окончание сбора информации. """
+    execute_sql("UPDATE crawl_runs SET finished = ? WHERE run_id = ?",
+                (datetime.now().isoformat(sep=' ', timespec='seconds'), run_id))
+
+
+def save_crawl_pages(run_id: int, pages: list[tuple[str, int, int]]) -> None:
+    """
+    Отмечает страницы как собранные.
+
+    :param run_id: id сбора.
+    :param pages: Список кортежей (id ЖК, номер страницы, всего страниц).
+    """
+    connection = get_connection()
+    with connection:
+        connection.executemany("INSERT OR IGNORE INTO crawl_pages (run_id, project, flat_page, total_pages) "
+                               "VALUES (?, ?, ?, ?)", ((run_id, *page) for page in pages))
+
+
+def get_crawl_pages(run_id: int) -> dict[str, tuple[int, set[int]]]:
+    """
+    Возвращает собранные страницы.
+
+    :param run_id: id сбора.
+    :return: Словарь {id ЖК: (всего страниц, множество собранных страниц)}.
+    """
+    result = {}
+    for project, flat_page, total_pages in execute_sql_fetch(
+            "SELECT project, flat_page, total_pages FROM crawl_pages WHERE run_id = ?", (run_id, )):
+        result.setdefault(project, (total_pages, set()))[1].add(flat_page)
+    return result
+
+
+def get_incomplete_projects(run_id: int, projects: set[tuple[str, str]]) -> set[str]:
+    """
+    Возвращает ЖК, у которых собраны не все страницы.
+
+    :param run_id: id сбора.
+    :param projects: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...}.
+    :return: Множество id ЖК.
+    """
+    completed_pages = get_crawl_pages(run_id)
+    result = set()
+    for project, _ in projects:
+        total_pages, pages = completed_pages.get(project, (None, set()))
+        if total_pages is None or len(pages) < max(total_pages, 1):
+            result.add(project)
+    return result
+
+
+def get_fingerprints(source: str) -> dict[str, Fingerprint]:
+    """
+    Возвращает отпечатки ЖК с прошлого сбора.
+
+    :param source: Застройщик.
+    :return: Словарь {id ЖК: отпечаток}.
+    """
+    return {project: Fingerprint(*fingerprint) for project, *fingerprint in execute_sql_fetch(
+        "SELECT project, flats_count, digest, etag, last_modified, full_crawled FROM crawl_fingerprints "
+        "WHERE source = ?", (source, ))}
+
+
+def save_fingerprints(source: str, fingerprints: dict[str, Fingerprint]) -> None:
+    """
+    Сохраняет отпечатки полностью собранных ЖК.
+
+    :param source: Застройщик.
+    :param fingerprints: Словарь {id ЖК: отпечаток}.
+    """
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO crawl_fingerprints (source, project, flats_count, digest, etag, last_modified, "
+            "full_crawled) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((source, project, *Fingerprint.row(fingerprint)) for project, fingerprint in fingerprints.items()))
 
 
 def get_flat(flat_id: int) -> list[tuple | None]:
@@ -50,54 +371,233 @@ def get_flat(flat_id: int) -> list[tuple | None]:
     :param flat_id: id квартиры (значение поля flat_id в базе данных).
     :return: Список кортежей или пустой список.
     """
-    sql_request = f"SELECT flat_id, name, city, flats.address, bulk, rooms, area, floor, finishing, settlement_date,\
-                        price, meter_price, booking_status, prices.data_created, benefit_name, benefit_description, " \
-                        f"url || url_suffix AS url_address \
+    sql_request = f"SELECT {FLAT_COLUMNS}, prices.data_created, benefit_name, benefit_description, \
+                        url || url_suffix AS url_address \
                     FROM flats \
                     JOIN projects ON flats.project_id = projects.project_id \
-                    JOIN prices ON flats.flat_id = prices.price_id " \
-                              + f"WHERE flats.flat_id = {flat_id} ORDER BY prices.data_created"
-    return execute_sql_fetch(sql_request)
+                    JOIN prices ON flats.flat_id = prices.price_id \
+                    WHERE flats.flat_id = ? ORDER BY prices.data_created"
+    return execute_sql_fetch(sql_request, (flat_id, ))
 
 
-def get_flats_by_filter(flats_filter: dict) -> list[tuple | None]:
+def get_flats_by_filter(flats_filter: FlatsFilter | dict) -> list[tuple | None]:
     """ Возвращает все данные (включая историю изменения цены) по квартирам из БД по заданному фильтру. """
+    if isinstance(flats_filter, dict):
+        flats_filter = FlatsFilter.from_dict(flats_filter)
+    where, params = flats_filter.compile_where()
+    sql_request = f"SELECT {FLAT_COLUMNS}, prices.data_created, benefit_name, benefit_description, \
+                        url || url_suffix AS url_address \
+                    FROM flats \
+                    JOIN projects ON flats.project_id = projects.project_id \
+                    JOIN prices ON flats.flat_id = prices.price_id \
+                    {where} ORDER BY price"
+    return execute_sql_fetch(sql_request, params)
 
-    sql_request = 'SELECT flat_id, name, city, flats.address, bulk, rooms, area, floor, finishing, settlement_date,\
-                        price, meter_price, booking_status, prices.data_created, benefit_name, benefit_description, ' \
-                        'url || url_suffix AS url_address \
-                  FROM flats \
-                  JOIN projects ON flats.project_id = projects.project_id \
-                  JOIN prices ON flats.flat_id = prices.price_id ' \
-                  f'WHERE city LIKE "{flats_filter["city"]}" ' \
-                      f'AND name LIKE "{flats_filter["name"]}" ' \
-                      f'AND rooms = {flats_filter["rooms"]} ' \
-                      f'AND price <= {flats_filter["max_price"]} ' \
-                      f'AND settlement_date <= "{flats_filter["max_settlement_date"]}" ' \
-                      f'AND finishing = {flats_filter["finishing"]} ' \
-                      f'AND booking_status LIKE "{flats_filter["booking_status"]}" ' \
-                  "ORDER BY price"
-    return execute_sql_fetch(sql_request)
-
-
-def get_flats_by_filter_last_price(flats_filter: dict) -> list[tuple | None]:
+
+def _get_flats_by_filter_last_price_sql(flats_filter: FlatsFilter | dict) -> tuple[str, list]:
+    """ Возвращает sql запрос актуальных данных по квартирам по заданному фильтру и его параметры. """
+    if isinstance(flats_filter, dict):
+        flats_filter = FlatsFilter.from_dict(flats_filter)
+    where, params = flats_filter.compile_where()
+    sql_request = f"SELECT {FLAT_COLUMNS}, latest_prices.data_created, benefit_name, benefit_description, \
+                        url || url_suffix AS url_address \
+                    FROM latest_prices \
+                    JOIN flats ON flats.flat_id = latest_prices.price_id \
+                    JOIN projects ON flats.project_id = projects.project_id \
+                    {where} ORDER BY price"
+    return sql_request, params
+
+
+def get_flats_by_filter_last_price(flats_filter: FlatsFilter | dict) -> list[tuple | None]:
     """ Возвращает актуальные (текущие) данные по квартирам из БД по заданному фильтру """
-    sql_request = 'SELECT * FROM ' \
-                  '(SELECT flat_id, name, city, flats.address, bulk, rooms, area, floor, finishing, settlement_date,\
-                            price, meter_price, booking_status, max(prices.data_created), benefit_name, ' \
-                            'benefit_description, url || url_suffix AS url_address \
-                      FROM flats \
-                      JOIN projects ON flats.project_id = projects.project_id \
-                      JOIN prices ON flats.flat_id = prices.price_id ' \
-                  f'WHERE city LIKE "{flats_filter["city"]}" ' \
-                  f'AND name LIKE "{flats_filter["name"]}" ' \
-                  f'AND rooms = {flats_filter["rooms"]} ' \
-                  f'AND price <= {flats_filter["max_price"]} ' \
-                  f'AND settlement_date <= "{flats_filter["max_settlement_date"]}" ' \
-                  f'AND finishing = {flats_filter["finishing"]} ' \
-                  'GROUP BY flat_id ORDER BY price) ' \
-                  f'WHERE booking_status LIKE "{flats_filter["booking_status"]}"'
-    return execute_sql_fetch(sql_request)
+    return execute_sql_fetch(*_get_flats_by_filter_last_price_sql(flats_filter))
+
+
+def iter_flats_by_filter_last_price(flats_filter: FlatsFilter | dict,
+                                    chunk_size: int = DB_CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Возвращает актуальные данные по квартирам по заданному фильтру по одной строке,
+    из базы данных строки читаются частями по chunk_size, весь результат в памяти не хранится.
+    """
+    sql_request, params = _get_flats_by_filter_last_price_sql(flats_filter)
+    return chain.from_iterable(iter_sql_fetch(sql_request, params, chunk_size))
+
+
+def refresh_search_index() -> None:
+    """
+    Обновляет полнотекстовый индекс (flats_fts) квартир, отмеченных триггерами в flats_fts_pending,
+    одним запросом: удаленные квартиры удаляются из индекса, остальные записываются заново.
+    Вызывается после записи ЖК, квартир и их цен, чтобы каждая квартира индексировалась один раз.
+    """
+    start = perf_counter()
+    connection = get_connection()
+    with connection:
+        connection.execute("DELETE FROM flats_fts WHERE rowid IN (SELECT flat_id FROM flats_fts_pending)")
+        connection.execute(
+            """INSERT INTO flats_fts (rowid, project_name, project_city, project_metro, flat_address, benefit)
+               SELECT flats_fts_documents.flat_id, project_name, project_city, project_metro, flat_address, benefit
+               FROM flats_fts_pending
+               JOIN flats_fts_documents ON flats_fts_documents.flat_id = flats_fts_pending.flat_id""")
+        connection.execute("DELETE FROM flats_fts_pending")
+    metrics.observe('db_write_seconds', perf_counter() - start, table='flats_fts')
+
+
+def _get_search_query(text: str) -> str | None:
+    """
+    Возвращает запрос полнотекстового поиска FTS5: все слова текста должны быть найдены,
+    у слов отбрасываются окончания и ищутся слова с таким началом.
+
+    :param text: Текст, например 'ипотека Москве'.
+    :return: Запрос, например '"ипотек"* "москв"*', или None, если в тексте нет слов.
+    """
+    terms = []
+    for word in WORD_PATTERN.findall(text.lower().replace('ё', 'е')):
+        if word.isdigit():      # номера корпусов и этажей ищутся точно
+            terms.append(f'"{word}"')
+            continue
+        for ending in WORD_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                word = word[:-len(ending)]
+                break
+        terms.append(f'"{word}"*')
+    return ' '.join(terms) or None
+
+
+def search_flats(text: str, flats_filter: FlatsFilter | dict = None,
+                 chunk_size: int = DB_CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Возвращает актуальные данные по квартирам, найденным по тексту в названии, городе и метро ЖК,
+    адресе квартиры и ценовом предложении, по полнотекстовому индексу (flats_fts) без просмотра всех квартир.
+    Наиболее подходящие квартиры первыми.
+
+    :param text: Слова для поиска, регистр и окончания слов не учитываются.
+    :param flats_filter: Фильтр квартир или None - все найденные квартиры.
+    :param chunk_size: Количество строк, читаемых из базы данных за один раз.
+    :return: Генератор кортежей (см. services.FLATS_HEAD).
+    """
+    query = _get_search_query(text)
+    if query is None:
+        return iter(())
+    if flats_filter is None:
+        flats_filter = FlatsFilter()
+    elif isinstance(flats_filter, dict):
+        flats_filter = FlatsFilter.from_dict(flats_filter)
+    conditions, params = flats_filter.compile()
+    where = ' AND '.join(('flats_fts MATCH ?', *conditions))
+    sql_request = f"SELECT {FLAT_COLUMNS}, latest_prices.data_created, benefit_name, benefit_description, \
+                        url || url_suffix AS url_address \
+                    FROM flats_fts \
+                    JOIN flats ON flats.flat_id = flats_fts.rowid \
+                    JOIN projects ON flats.project_id = projects.project_id \
+                    JOIN latest_prices ON latest_prices.price_id = flats.flat_id \
+                    WHERE {where} ORDER BY flats_fts.rank, price"
+    return chain.from_iterable(iter_sql_fetch(sql_request, (query, *params), chunk_size))
+
+
+def get_distance_km(latitude: float, longitude: float, other_latitude: float, other_longitude: float) -> float:
+    """ Возвращает расстояние между двумя точками по поверхности Земли в км (формула гаверсинусов). """
+    latitude, longitude, other_latitude, other_longitude = map(radians, (latitude, longitude,
+                                                                         other_latitude, other_longitude))
+    haversine = sin((other_latitude - latitude) / 2) ** 2 \
+        + cos(latitude) * cos(other_latitude) * sin((other_longitude - longitude) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(sqrt(haversine))
+
+
+def _get_projects_in_box(min_latitude: float, min_longitude: float,
+                         max_latitude: float, max_longitude: float) -> list[tuple[int, float, float]]:
+    """ Возвращает id и координаты ЖК в прямоугольной области по пространственному индексу (projects_rtree). """
+    return execute_sql_fetch(
+        """SELECT projects.project_id, latitude, longitude FROM projects_rtree
+           JOIN projects ON projects.project_id = projects_rtree.project_id
+           WHERE max_latitude >= ? AND min_latitude <= ? AND max_longitude >= ? AND min_longitude <= ?""",
+        (min_latitude, max_latitude, min_longitude, max_longitude))
+
+
+def _iter_flats_by_distance(distances: dict[int, float], flats_filter: FlatsFilter | dict | None,
+                            chunk_size: int) -> Iterator[tuple]:
+    """
+    Возвращает актуальные данные по квартирам ЖК distances, отсортированные по расстоянию до ЖК и цене.
+
+    :param distances: Словарь {id ЖК: расстояние в км}.
+    :param flats_filter: Фильтр квартир или None - все квартиры.
+    :param chunk_size: Количество строк, читаемых из базы данных за один раз.
+    :return: Генератор кортежей (см. NEAR_FLATS_HEAD).
+    """
+    if not distances:
+        return iter(())
+    if flats_filter is None:
+        flats_filter = FlatsFilter()
+    elif isinstance(flats_filter, dict):
+        flats_filter = FlatsFilter.from_dict(flats_filter)
+    where, params = flats_filter.compile_where()
+    values = ', '.join(['(?, ?)'] * len(distances))
+    sql_request = f"WITH distances (project_id, distance) AS (VALUES {values}) \
+                    SELECT {FLAT_COLUMNS}, latest_prices.data_created, benefit_name, benefit_description, \
+                        url || url_suffix AS url_address, round(distance, 2) \
+                    FROM distances \
+                    JOIN projects ON projects.project_id = distances.project_id \
+                    JOIN flats ON flats.project_id = projects.project_id \
+                    JOIN latest_prices ON latest_prices.price_id = flats.flat_id \
+                    {where} ORDER BY distance, price"
+    params = [*chain.from_iterable(distances.items()), *params]
+    return chain.from_iterable(iter_sql_fetch(sql_request, params, chunk_size))
+
+
+def iter_flats_near(latitude: float, longitude: float, radius_km: float,
+                    flats_filter: FlatsFilter | dict = None, chunk_size: int = DB_CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Возвращает актуальные данные по квартирам в ЖК не дальше radius_km от точки, ближайшие ЖК первыми.
+    ЖК в описанном вокруг круга квадрате выбираются по пространственному индексу,
+    точное расстояние считается только для них.
+
+    :param latitude: Широта точки.
+    :param longitude: Долгота точки.
+    :param radius_km: Радиус поиска в км.
+    :param flats_filter: Фильтр квартир или None - все квартиры.
+    :param chunk_size: Количество строк, читаемых из базы данных за один раз.
+    :return: Генератор кортежей (см. NEAR_FLATS_HEAD).
+    """
+    delta_latitude = radius_km / KM_IN_DEGREE
+    delta_longitude = radius_km / (KM_IN_DEGREE * max(cos(radians(latitude)), 0.01))
+    distances = {}
+    for project_id, project_latitude, project_longitude in _get_projects_in_box(
+            latitude - delta_latitude, longitude - delta_longitude,
+            latitude + delta_latitude, longitude + delta_longitude):
+        distance = get_distance_km(latitude, longitude, project_latitude, project_longitude)
+        if distance <= radius_km:
+            distances[project_id] = distance
+    return _iter_flats_by_distance(distances, flats_filter, chunk_size)
+
+
+def iter_flats_in_box(min_latitude: float, min_longitude: float, max_latitude: float, max_longitude: float,
+                      flats_filter: FlatsFilter | dict = None, chunk_size: int = DB_CHUNK_SIZE) -> Iterator[tuple]:
+    """
+    Возвращает актуальные данные по квартирам в ЖК внутри прямоугольной области,
+    ЖК ближе к центру области первыми.
+
+    :param min_latitude: Широта южной границы.
+    :param min_longitude: Долгота западной границы.
+    :param max_latitude: Широта северной границы.
+    :param max_longitude: Долгота восточной границы.
+    :param flats_filter: Фильтр квартир или None - все квартиры.
+    :param chunk_size: Количество строк, читаемых из базы данных за один раз.
+    :return: Генератор кортежей (см. NEAR_FLATS_HEAD), расстояние - до центра области.
+    """
+    center_latitude, center_longitude = (min_latitude + max_latitude) / 2, (min_longitude + max_longitude) / 2
+    distances = {project_id: get_distance_km(center_latitude, center_longitude, project_latitude, project_longitude)
+                 for project_id, project_latitude, project_longitude
+                 in _get_projects_in_box(min_latitude, min_longitude, max_latitude, max_longitude)}
+    return _iter_flats_by_distance(distances, flats_filter, chunk_size)
+
+
+def get_data_version() -> int:
+    """ Возвращает версию данных, она увеличивается после каждого сбора (bump_data_version). """
+    return execute_sql_fetch("SELECT version FROM data_version")[0][0]
+
+
+def bump_data_version() -> None:
+    """ Увеличивает версию данных: сохраненные результаты запросов (кэш бота) устаревают. """
+    execute_sql("UPDATE data_version SET version = version + 1")
 
 
 def get_one_field_info(table: str, field: str) -> list[tuple | None]:
@@ -120,6 +620,9 @@ def remove_duplicates_in_prices_table() -> None:
     (если цена не изменилась, равна предыдущей
     цене и не изменился статус бронирования, то
     такая запись будет удалена).
+
+    При сохранении записываются только изменившиеся цены (см. save_to_database),
+    функция нужна лишь для очистки истории, накопленной до этого.
     """
     execute_sql("""DELETE FROM prices WHERE rowid NOT IN 
                 (SELECT min(rowid) FROM prices GROUP BY price_id, price, booking_status)""")
@@ -1,35 +1,116 @@
 """
 Модуль для работы с базой данных sqlite3.
+
+База данных работает в режиме WAL: чтение не блокируется записью парсера.
+Все функции модуля работают через get_connection: поток, который подключился к базе данных,
+использует модульное соединение connect, остальные потоки (например, пул телеграм бота) - собственное.
 """
 
 import sqlite3
-from typing import Dict
+import threading
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Sequence
 import os
 
 PATH = 'db'
 DATABASE = 'db.sqlite3'
+DATABASE_ENV = 'R2D2_DATABASE'     # переменная окружения с путем к базе данных вместо db/db.sqlite3
+
+# Изменения данных в уже созданной базе данных, выполняются один раз по порядку,
+# количество выполненных хранится в PRAGMA user_version
+MIGRATIONS = (
+    # заполняем таблицу последних цен по накопленной истории цен
+    """INSERT OR REPLACE INTO latest_prices (price_id, benefit_name, benefit_description, price, meter_price,
+                                             booking_status, data_created)
+       SELECT price_id, benefit_name, benefit_description, price, meter_price, booking_status, data_created
+       FROM prices WHERE rowid IN (SELECT max(rowid) FROM prices GROUP BY price_id)""",
+    # заполняем пространственный индекс координатами уже записанных ЖК
+    """INSERT OR REPLACE INTO projects_rtree (project_id, min_latitude, max_latitude, min_longitude, max_longitude)
+       SELECT project_id, latitude, latitude, longitude, longitude FROM projects
+       WHERE latitude IS NOT NULL AND longitude IS NOT NULL""",
+    # заполняем полнотекстовый индекс уже записанными квартирами
+    """INSERT OR REPLACE INTO flats_fts (rowid, project_name, project_city, project_metro, flat_address, benefit)
+       SELECT flat_id, project_name, project_city, project_metro, flat_address, benefit FROM flats_fts_documents""",
+)
+
+BUSY_TIMEOUT = 30   # секунд ожидания, пока другое соединение завершит запись
+
+connect: sqlite3.Connection
+cursor: sqlite3.Cursor
+_path: str
+_connect_thread: int            # поток, в котором созданы connect и cursor
+_local = threading.local()      # соединения остальных потоков
+
 
-connect = sqlite3.connect(os.path.join(PATH, DATABASE))
-cursor = connect.cursor()
+def _open(path: str) -> sqlite3.Connection:
+    """ Открывает соединение с базой данных в режиме WAL. """
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    connection.execute("PRAGMA journal_mode = WAL")
+    return connection
+
+
+def connect_db(path: str = None) -> None:
+    """
+    Подключается к базе данных и создает таблицы (create_db).
+    Таблицы создаются один раз при подключении, а не перед каждым запросом:
+    скрипт создания - пишущая транзакция, которая ждала бы окончания записи парсера.
+
+    :param path: Путь к файлу базы данных, по умолчанию из переменной окружения R2D2_DATABASE
+                 или db/db.sqlite3. База данных открывается при импорте модуля, поэтому
+                 другую базу (например, в benchmarks) нужно задавать переменной окружения до импорта.
+    """
+    global connect, cursor, _path, _connect_thread
+    path = path or os.getenv(DATABASE_ENV, os.path.join(PATH, DATABASE))
+    connect = _open(path)
+    cursor = connect.cursor()
+    _path = path
+    _connect_thread = threading.get_ident()
+    create_db()
+
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Возвращает соединение с базой данных для текущего потока:
+    connect в потоке, который подключился к базе данных,
+    в остальных потоках - собственное соединение потока (открывается при первом обращении).
+    """
+    if threading.get_ident() == _connect_thread:
+        return connect
+    if getattr(_local, 'path', None) != _path:
+        _local.connect = _open(_path)
+        _local.path = _path
+    return _local.connect
 
 
 def create_db() -> None:
     """
     Создает базу данных и таблицы в ней,
     если база и таблицы уже существуют,
-    то ничего не делает.
+    то ничего не делает. Выполняет еще не
+    выполненные миграции (MIGRATIONS).
     """
-    with open('database/createdb.sql', 'r') as file:
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'createdb.sql'), 'r') as file:
         sql = file.read()
-    cursor.executescript(sql)
-    connect.commit()
+    connection = get_connection()
+    connection.executescript(sql)
+    connection.commit()
+
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+        with connection:
+            connection.execute(migration)
+            connection.execute(f"PRAGMA user_version = {number}")
+
+
+connect_db()
 
 
 def drop(*table_names: str) -> None:
     """ Очищает таблицы в базе данных. """
+    connection = get_connection()
     for table in table_names:
-        cursor.execute(f"DROP TABLE IF EXISTS {table}")
-        connect.commit()
+        connection.execute(f"DROP TABLE IF EXISTS {table}")
+        connection.commit()
 
 
 def insert(table: str, data: Dict) -> None:
@@ -45,12 +126,78 @@ def insert(table: str, data: Dict) -> None:
     columns = ', '.join(data.keys())
     values = [tuple(data.values())]
     placeholders = ", ".join("?" * len(data.keys()))
-    cursor.executemany(
+    connection = get_connection()
+    connection.executemany(
         f"INSERT INTO {table} "
         f"({columns}) "
         f"VALUES ({placeholders})",
         values)
-    connect.commit()
+    connection.commit()
+
+
+def insert_many(table: str, columns: Sequence[str], rows: Iterable[tuple],
+                conflict_column: str = None, update_columns: Sequence[str] = (),
+                chunk_size: int = 1000, skip_condition: str = None) -> dict[str, int]:
+    """
+    Добавляет записи в базу данных пачками,
+    каждая пачка записывается в одной транзакции.
+
+    При совпадении значения поля conflict_column запись не добавляется (INSERT ... ON CONFLICT),
+    а обновляются поля update_columns, если их значения изменились.
+
+    :param table: Название таблицы.
+    :param columns: Поля таблицы в порядке значений в кортежах rows.
+    :param rows: Кортежи значений для записи.
+    :param conflict_column: Уникальное поле таблицы или None, если такого поля нет.
+    :param update_columns: Поля, обновляемые у существующей записи.
+    :param chunk_size: Количество записей в одной транзакции.
+    :param skip_condition: Условие sql, при котором запись не добавляется, значения записи в нем -
+                           параметры ?1, ?2, ... в порядке columns (только для таблиц без conflict_column).
+    :return: Словарь с количеством добавленных (inserted), обновленных (updated)
+             и пропущенных (skipped) записей.
+    """
+    if skip_condition is not None:
+        placeholders = ", ".join(f"?{number}" for number in range(1, len(columns) + 1))
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) SELECT {placeholders} WHERE NOT {skip_condition}"
+    else:
+        placeholders = ", ".join("?" * len(columns))
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    if conflict_column is not None:
+        if update_columns:
+            assignments = ', '.join(f"{column} = excluded.{column}" for column in update_columns)
+            changed = ' OR '.join(f"{column} IS NOT excluded.{column}" for column in update_columns)
+            sql += f" ON CONFLICT({conflict_column}) DO UPDATE SET {assignments} WHERE {changed}"
+        else:
+            sql += f" ON CONFLICT({conflict_column}) DO NOTHING"
+        key_index = list(columns).index(conflict_column)
+
+    result = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    connection = get_connection()
+    rows = iter(rows)
+    while chunk := list(islice(rows, chunk_size)):
+        with connection:   # commit в конце пачки или rollback при ошибке
+            if conflict_column is not None:
+                keys = {row[key_index] for row in chunk}
+                new_rows = len(keys) - _count_existing(table, conflict_column, keys)
+            changes = connection.executemany(sql, chunk).rowcount     # без изменений, сделанных триггерами
+            if conflict_column is None:
+                new_rows = changes
+        result['inserted'] += new_rows
+        result['updated'] += changes - new_rows
+        result['skipped'] += len(chunk) - changes
+    return result
+
+
+def _count_existing(table: str, column: str, keys: set) -> int:
+    """ Возвращает количество уже записанных в таблицу значений keys уникального поля column. """
+    connection = get_connection()
+    keys = list(keys)
+    count = 0
+    for i in range(0, len(keys), 500):   # ограничение sqlite на количество параметров в запросе
+        part = keys[i:i + 500]
+        count += connection.execute(f"SELECT count(*) FROM {table} WHERE {column} IN ({', '.join('?' * len(part))})",
+                                    part).fetchone()[0]
+    return count
 
 
 def fetch(table: str, columns: list[str]) -> list[tuple | None]:
@@ -62,27 +209,48 @@ def fetch(table: str, columns: list[str]) -> list[tuple | None]:
     :return: Список кортежей.
     """
     columns_joined = ", ".join(columns)
-    cursor.execute(f"SELECT {columns_joined} FROM {table}")
-    return cursor.fetchall()
+    return get_connection().execute(f"SELECT {columns_joined} FROM {table}").fetchall()
 
 
-def execute_sql_fetch(sql: str) -> list[tuple | None]:
+def execute_sql_fetch(sql: str, params: Sequence = ()) -> list[tuple | None]:
     """
     Выполняет sql запрос и возвращает результат.
 
     :param sql: SQL запрос.
+    :param params: Значения параметров (?) запроса.
     :return: Список кортежей или пустой список.
     """
-    cursor.execute(sql)
-    return cursor.fetchall()
+    return get_connection().execute(sql, params).fetchall()
+
+
+def iter_sql_fetch(sql: str, params: Sequence = (), chunk_size: int = 1000) -> Iterator[list[tuple]]:
+    """
+    Выполняет sql запрос и возвращает результат частями,
+    в памяти одновременно находится не больше chunk_size строк.
+    Использует отдельный курсор, поэтому другие запросы можно выполнять между частями.
+
+    :param sql: SQL запрос.
+    :param params: Значения параметров (?) запроса.
+    :param chunk_size: Количество строк в одной части.
+    :return: Генератор списков кортежей.
+    """
+    chunk_cursor = get_connection().cursor()
+    try:
+        chunk_cursor.execute(sql, params)
+        while rows := chunk_cursor.fetchmany(chunk_size):
+            yield rows
+    finally:
+        chunk_cursor.close()
 
 
-def execute_sql(sql: str) -> None:
+def execute_sql(sql: str, params: Sequence = ()) -> None:
     """
     Выполняет sql команду.
 
     :param sql: SQL запрос.
+    :param params: Значения параметров (?) запроса.
     :return: None.
     """
-    cursor.execute(sql)
-    connect.commit()
+    connection = get_connection()
+    connection.execute(sql, params)
+    connection.commit()
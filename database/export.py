@@ -0,0 +1,166 @@
+"""
+Модуль выгрузки таблиц базы данных в колоночном формате Parquet или Arrow IPC (feather)
+для аналитики: такие файлы читаются pandas/polars/duckdb во много раз быстрее,
+чем повторные запросы к sqlite или excel таблицы.
+
+Строки читаются из базы данных частями по EXPORT_CHUNK_SIZE и сразу записываются
+в файл, поэтому память не зависит от размера таблицы. Выгружается вся история цен
+(prices) или только последние цены (latest_prices). При разбиении по дате сбора
+каждая дата записывается в отдельный каталог data_created=YYYY-MM-DD (hive partitioning).
+
+Требуется пакет pyarrow (pip install pyarrow), для работы парсера и бота он не нужен.
+
+Запуск из корня проекта:
+    python -m database.export --tables prices --latest --partition
+"""
+
+import argparse
+import os
+from itertools import groupby
+from operator import itemgetter
+
+from .db_sqlite import iter_sql_fetch
+from services import init_logger
+from settings import LOGGER_LEVEL, EXPORT_PATH, EXPORT_CHUNK_SIZE
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = init_logger(__name__, LOGGER_LEVEL)
+
+# поле таблицы: тип arrow
+SCHEMAS = {
+    'projects': {'project_id': 'int64', 'city': 'string', 'name': 'string', 'url': 'string', 'metro': 'string',
+                 'time_to_metro': 'int64', 'latitude': 'double', 'longitude': 'double', 'address': 'string',
+                 'data_created': 'date32'},
+    'flats': {'flat_id': 'int64', 'project_id': 'int64', 'address': 'string', 'floor': 'int64', 'rooms': 'int64',
+              'area': 'double', 'finishing': 'bool', 'bulk': 'string', 'settlement_date': 'string',
+              'url_suffix': 'string', 'data_created': 'date32'},
+    'prices': {'price_id': 'int64', 'benefit_name': 'string', 'benefit_description': 'string', 'price': 'int64',
+               'meter_price': 'int64', 'booking_status': 'string', 'data_created': 'date32'},
+}
+SCHEMAS['latest_prices'] = SCHEMAS['prices']
+
+# тип, в котором значение хранится в sqlite, если он отличается от типа arrow
+STORAGE_TYPES = {'date32': 'string', 'bool': 'int64'}
+
+FORMATS = {'parquet': '.parquet', 'arrow': '.arrow'}
+PARTITION_COLUMN = 'data_created'
+
+
+def _get_schema(table: str, columns: list[str]) -> 'pyarrow.Schema':
+    """ Возвращает схему arrow для полей таблицы. """
+    return pyarrow.schema([(column, pyarrow.type_for_alias(SCHEMAS[table][column])) for column in columns])
+
+
+def _to_batch(table: str, schema: 'pyarrow.Schema', rows: list[tuple]) -> 'pyarrow.RecordBatch':
+    """ Преобразует строки из базы данных в колонки arrow, лишние значения в конце строк не используются. """
+    arrays = []
+    for values, field in zip(zip(*rows), schema):
+        alias = SCHEMAS[table][field.name]
+        storage = pyarrow.type_for_alias(STORAGE_TYPES.get(alias, alias))
+        arrays.append(pyarrow.array(values, type=storage).cast(field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def _open_writer(path: str, schema: 'pyarrow.Schema', file_format: str):
+    """ Открывает файл для записи в формате parquet или arrow. """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if file_format == 'parquet':
+        return pyarrow.parquet.ParquetWriter(path, schema, compression='zstd')
+    return pyarrow.ipc.new_file(path, schema, options=pyarrow.ipc.IpcWriteOptions(compression='zstd'))
+
+
+def export_table(table: str, output: str = EXPORT_PATH, partition: bool = False, file_format: str = 'parquet',
+                 chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    Выгружает таблицу базы данных в колоночный файл.
+
+    :param table: Название таблицы: projects, flats, prices (вся история цен) или latest_prices (последние цены).
+    :param output: Каталог для выгрузки.
+    :param partition: Разбить выгрузку по дате сбора (data_created), иначе один файл.
+    :param file_format: Формат файлов: parquet или arrow.
+    :param chunk_size: Количество строк, читаемых из базы данных за один раз.
+    :return: Количество выгруженных строк.
+    """
+    if pyarrow is None:
+        raise RuntimeError("Для выгрузки требуется пакет pyarrow (pip install pyarrow).")
+    if table not in SCHEMAS:
+        raise ValueError(f"Неизвестная таблица '{table}', доступны: {', '.join(SCHEMAS)}.")
+    if file_format not in FORMATS:
+        raise ValueError(f"Неизвестный формат '{file_format}', доступны: {', '.join(FORMATS)}.")
+
+    columns = list(SCHEMAS[table])
+    if partition:   # дата сбора записывается в название каталога, а не в файл
+        columns.remove(PARTITION_COLUMN)
+    schema = _get_schema(table, columns)
+    sql = f"SELECT {', '.join(columns)}, {PARTITION_COLUMN} FROM {table}"
+    if partition:
+        sql += f" ORDER BY {PARTITION_COLUMN}"     # строки одной даты идут подряд, открыт только один файл
+    get_partition = itemgetter(len(columns))
+
+    total = 0
+    writer = current_partition = None
+    try:
+        for rows in iter_sql_fetch(sql, chunk_size=chunk_size):
+            groups = groupby(rows, key=get_partition) if partition else ((None, rows),)
+            for partition_value, group in groups:
+                if writer is None or partition_value != current_partition:
+                    if writer is not None:
+                        writer.close()
+                    current_partition = partition_value
+                    path = os.path.join(output, table + FORMATS[file_format]) if not partition else \
+                        os.path.join(output, table, f"{PARTITION_COLUMN}={partition_value}",
+                                     'part-0' + FORMATS[file_format])
+                    writer = _open_writer(path, schema, file_format)
+                group = list(group)
+                writer.write_batch(_to_batch(table, schema, group))
+                total += len(group)
+        if writer is None and not partition:    # пустая таблица, файл со схемой без строк
+            writer = _open_writer(os.path.join(output, table + FORMATS[file_format]), schema, file_format)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    logger.info(f"Таблица {table}: выгружено {total} строк в {output}.")
+    return total
+
+
+def export_snapshot(output: str = EXPORT_PATH, latest: bool = False, partition: bool = False,
+                    file_format: str = 'parquet', tables: tuple[str, ...] = ('projects', 'flats', 'prices'),
+                    chunk_size: int = EXPORT_CHUNK_SIZE) -> dict[str, int]:
+    """
+    Выгружает ЖК, квартиры и цены в колоночные файлы.
+
+    :param output: Каталог для выгрузки.
+    :param latest: Выгрузить только последние цены (latest_prices) вместо всей истории цен.
+    :param partition: Разбить выгрузку по дате сбора (data_created).
+    :param file_format: Формат файлов: parquet или arrow.
+    :param tables: Выгружаемые таблицы.
+    :param chunk_size: Количество строк, читаемых из базы данных за один раз.
+    :return: Словарь {таблица: количество выгруженных строк}.
+    """
+    return {table: export_table(table, output, partition, file_format, chunk_size)
+            for table in ('latest_prices' if latest and table == 'prices' else table for table in tables)}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default=EXPORT_PATH, help='каталог для выгрузки')
+    parser.add_argument('--tables', nargs='+', default=['projects', 'flats', 'prices'],
+                        choices=['projects', 'flats', 'prices'], help='выгружаемые таблицы')
+    parser.add_argument('--latest', action='store_true', help='только последние цены вместо всей истории')
+    parser.add_argument('--partition', action='store_true', help='разбить по дате сбора')
+    parser.add_argument('--format', default='parquet', choices=list(FORMATS), help='формат файлов')
+    parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help='строк за одно чтение')
+    args = parser.parse_args()
+
+    export_snapshot(args.output, args.latest, args.partition, args.format, tuple(args.tables), args.chunk_size)
+
+
+if __name__ == '__main__':
+    main()
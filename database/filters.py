@@ -0,0 +1,104 @@
+"""
+Модуль содержит фильтр квартир, который преобразуется
+в условия sql запроса с параметрами (?).
+
+Текст запроса зависит только от набора заданных условий,
+поэтому повторные запросы с другими значениями используют
+уже подготовленный sqlite запрос (statement cache).
+"""
+
+from dataclasses import dataclass, fields
+from functools import lru_cache
+
+# поле фильтра: условие sql
+CONDITIONS = {
+    'city': 'city LIKE ?',
+    'name': 'name LIKE ?',
+    'metro': 'metro LIKE ?',
+    'min_price': 'price >= ?',
+    'max_price': 'price <= ?',
+    'min_area': 'area >= ?',
+    'max_area': 'area <= ?',
+    'min_floor': 'floor >= ?',
+    'max_floor': 'floor <= ?',
+    'max_settlement_date': 'settlement_date <= ?',
+    'finishing': 'finishing = ?',
+    'booking_status': 'booking_status LIKE ?',
+}
+
+ANY = '%'   # шаблон LIKE, которому соответствует любое значение, условие не добавляется
+
+
+@dataclass(frozen=True)
+class FlatsFilter:                      # Фильтр квартир, None - условие не задано
+    city: str = None                    # Город, шаблон LIKE, например '%Москв%'
+    name: str = None                    # Название ЖК, шаблон LIKE
+    metro: str = None                   # Метро, шаблон LIKE
+    rooms: tuple[int, ...] = ()         # Количество комнат, одно или несколько значений
+    min_price: int = None               # Минимальная цена
+    max_price: int = None               # Максимальная цена
+    min_area: float = None              # Минимальная площадь
+    max_area: float = None              # Максимальная площадь
+    min_floor: int = None               # Минимальный этаж
+    max_floor: int = None               # Максимальный этаж
+    max_settlement_date: str = None     # Дата заселения не позже, например '2024-__-__'
+    finishing: bool = None              # Отделка
+    booking_status: str = None          # Статус бронирования, шаблон LIKE, например 'active' или '%'
+
+    @classmethod
+    def from_dict(cls, flats_filter: dict) -> 'FlatsFilter':
+        """
+        Создает фильтр из словаря, значения могут быть строками (команда телеграм бота).
+        Количество комнат можно указать через запятую, например '1,2'.
+
+        :param flats_filter: Словарь {'поле фильтра': значение}.
+        :return: Фильтр квартир.
+        """
+        values = {field.name: flats_filter.get(field.name) for field in fields(cls)}
+        rooms = values['rooms']
+        if isinstance(rooms, (str, int)):
+            rooms = str(rooms).split(',')
+        values['rooms'] = tuple(int(room) for room in rooms or ())
+        for key in ('min_price', 'max_price', 'min_floor', 'max_floor'):
+            values[key] = None if values[key] is None else int(values[key])
+        for key in ('min_area', 'max_area'):
+            values[key] = None if values[key] is None else float(values[key])
+        if values['finishing'] is not None:
+            values['finishing'] = str(values['finishing']).lower() in ('1', 'true')
+        return cls(**values)
+
+    def compile(self) -> tuple[tuple[str, ...], tuple]:
+        """
+        Возвращает условия sql с параметрами (?) и значения параметров,
+        в условия попадают только заданные поля фильтра.
+        Условия объединяются через AND, в том числе с условиями запроса, не относящимися к фильтру.
+
+        :return: Кортеж (условия sql, значения параметров).
+        """
+        used = tuple(key for key in CONDITIONS if getattr(self, key) not in (None, ANY))
+        params = tuple(getattr(self, key) for key in used) + self.rooms
+        return _compile_conditions(used, len(self.rooms)), params
+
+    def compile_where(self) -> tuple[str, tuple]:
+        """
+        Возвращает условие WHERE с параметрами (?) и значения параметров (см. compile).
+
+        :return: Кортеж (условие WHERE или пустая строка, значения параметров).
+        """
+        conditions, params = self.compile()
+        return 'WHERE ' + ' AND '.join(conditions) if conditions else '', params
+
+
+@lru_cache(maxsize=256)
+def _compile_conditions(used: tuple[str, ...], rooms: int) -> tuple[str, ...]:
+    """
+    Возвращает условия sql для набора заданных полей фильтра.
+
+    :param used: Заданные поля фильтра.
+    :param rooms: Количество значений в фильтре по количеству комнат.
+    :return: Кортеж условий, пустой, если условия не заданы.
+    """
+    conditions = tuple(CONDITIONS[key] for key in used)
+    if rooms:
+        conditions += (f"rooms IN ({', '.join('?' * rooms)})", )
+    return conditions
@@ -0,0 +1,49 @@
+"""
+Модуль данных для планировщика сбора (scheduler.py): частота изменений цен,
+количество квартир и время последнего сбора каждого ЖК.
+
+id ЖК из списка проектов совпадает с projects.project_id (для PIK - id ЖК в api).
+"""
+
+from datetime import date, datetime, timedelta
+
+from .db_sqlite import *
+
+
+def get_project_stats(source: str, days: int) -> dict[str, tuple[int, int, datetime | None, int | None]]:
+    """
+    Возвращает статистику ЖК застройщика для расчета приоритета сбора.
+
+    :param source: Застройщик.
+    :param days: За сколько последних дней считать изменения цен.
+    :return: Словарь {id ЖК: (количество квартир при последнем сборе, изменений цен за days дней,
+             время последнего сбора планировщиком или None, запрошено страниц при последнем сборе или None)}.
+    """
+    start = (date.today() - timedelta(days=days)).isoformat()
+    changes = dict(execute_sql_fetch(
+        # первая цена квартиры за период не считается изменением
+        """SELECT CAST(flats.project_id AS TEXT), count(*) - count(DISTINCT prices.price_id) FROM prices
+           JOIN flats ON flats.flat_id = prices.price_id
+           WHERE prices.data_created >= ? GROUP BY flats.project_id""", (start, )))
+    flats_count = dict(execute_sql_fetch(
+        "SELECT project, flats_count FROM crawl_fingerprints WHERE source = ?", (source, )))
+    crawls = {project: (datetime.fromisoformat(crawled), pages) for project, crawled, pages in execute_sql_fetch(
+        "SELECT project, crawled, pages FROM project_crawls WHERE source = ?", (source, ))}
+    return {project: (flats_count.get(project, 0), changes.get(project, 0), *crawls.get(project, (None, None)))
+            for project in flats_count.keys() | crawls.keys() | changes.keys()}
+
+
+def save_project_crawls(source: str, crawls: dict[str, int], crawled: datetime) -> None:
+    """
+    Записывает время сбора ЖК.
+
+    :param source: Застройщик.
+    :param crawls: Словарь {id ЖК: запрошено страниц}.
+    :param crawled: Время окончания сбора.
+    """
+    connection = get_connection()
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO project_crawls (source, project, crawled, pages) VALUES (?, ?, ?, ?)",
+            ((source, project, crawled.isoformat(sep=' ', timespec='seconds'), pages)
+             for project, pages in crawls.items()))
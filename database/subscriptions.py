@@ -0,0 +1,153 @@
+"""
+Модуль подписок пользователей телеграм бота на новые и подешевевшие квартиры.
+
+Подписка - сохраненный фильтр квартир (FlatsFilter). После каждого сбора
+(см. scrapper.scrapping) подписки проверяются только по ценам, записанным
+с прошлой проверки (rowid таблицы prices больше last_price_rowid подписки),
+поэтому время проверки зависит от количества изменений, а не от размера базы данных.
+Найденные квартиры записываются в таблицу notifications, откуда их отправляет бот.
+"""
+
+import dataclasses
+import json
+from datetime import datetime
+
+from .db_sqlite import *
+from .filters import FlatsFilter
+from services import init_logger
+from settings import LOGGER_LEVEL
+
+logger = init_logger(__name__, LOGGER_LEVEL)
+
+
+def _get_last_price_rowid() -> int:
+    """ Возвращает rowid последней записанной цены. """
+    return execute_sql_fetch("SELECT max(rowid) FROM prices")[0][0] or 0
+
+
+def _now() -> str:
+    """ Возвращает текущие дату и время в формате '%Y-%m-%d %H:%M:%S'. """
+    return datetime.now().isoformat(sep=' ', timespec='seconds')
+
+
+def add_subscription(chat_id: int, flats_filter: FlatsFilter) -> int:
+    """
+    Сохраняет подписку, проверяться будут только цены, записанные после этого.
+
+    :param chat_id: id чата пользователя.
+    :param flats_filter: Фильтр квартир.
+    :return: id подписки.
+    """
+    connection = get_connection()
+    with connection:
+        return connection.execute("INSERT INTO subscriptions (chat_id, filter, last_price_rowid, data_created) "
+                                  "VALUES (?, ?, ?, ?)",
+                                  (chat_id, json.dumps(dataclasses.asdict(flats_filter), ensure_ascii=False),
+                                   _get_last_price_rowid(), _now())).lastrowid
+
+
+def get_subscriptions(chat_id: int) -> list[tuple[int, FlatsFilter]]:
+    """
+    Возвращает подписки пользователя.
+
+    :param chat_id: id чата пользователя.
+    :return: Список кортежей (id подписки, фильтр квартир).
+    """
+    return [(subscription_id, FlatsFilter.from_dict(json.loads(flats_filter)))
+            for subscription_id, flats_filter in execute_sql_fetch(
+                "SELECT subscription_id, filter FROM subscriptions WHERE chat_id = ? ORDER BY subscription_id",
+                (chat_id, ))]
+
+
+def delete_subscription(chat_id: int, subscription_id: int) -> bool:
+    """
+    Удаляет подписку пользователя и ее неотправленные уведомления.
+
+    :param chat_id: id чата пользователя.
+    :param subscription_id: id подписки.
+    :return: True, если подписка была удалена.
+    """
+    connection = get_connection()
+    with connection:
+        deleted = connection.execute("DELETE FROM subscriptions WHERE subscription_id = ? AND chat_id = ?",
+                                     (subscription_id, chat_id)).rowcount > 0
+        if deleted:
+            connection.execute("DELETE FROM notifications WHERE subscription_id = ? AND sent IS NULL",
+                               (subscription_id, ))
+    return deleted
+
+
+def evaluate_subscriptions() -> int:
+    """
+    Проверяет подписки по ценам, записанным после предыдущей проверки,
+    и записывает новые (без предыдущей цены) и подешевевшие квартиры в уведомления.
+
+    :return: Количество новых уведомлений.
+    """
+    last_rowid = _get_last_price_rowid()
+    subscriptions = execute_sql_fetch("SELECT subscription_id, chat_id, filter, last_price_rowid FROM subscriptions "
+                                      "WHERE last_price_rowid < ?", (last_rowid, ))
+    created = 0
+    connection = get_connection()
+    with connection:
+        for subscription_id, chat_id, flats_filter, from_rowid in subscriptions:
+            conditions, params = FlatsFilter.from_dict(json.loads(flats_filter)).compile()
+            where = ' AND '.join((*conditions, 'prices.rowid > ? AND prices.rowid <= ?'))
+            created += connection.execute(
+                f"""INSERT OR IGNORE INTO notifications (subscription_id, chat_id, flat_id, price, previous_price,
+                                                         data_created)
+                    SELECT ?, ?, flat_id, price, previous_price, ? FROM (
+                        SELECT flat_id, price,
+                               (SELECT previous.price FROM prices AS previous
+                                WHERE previous.price_id = prices.price_id AND previous.rowid < prices.rowid
+                                ORDER BY previous.rowid DESC LIMIT 1) AS previous_price
+                        FROM prices
+                        JOIN flats ON flats.flat_id = prices.price_id
+                        JOIN projects ON flats.project_id = projects.project_id
+                        WHERE {where})
+                    WHERE previous_price IS NULL OR price < previous_price""",
+                (subscription_id, chat_id, _now(), *params, from_rowid, last_rowid)).rowcount
+        connection.execute("UPDATE subscriptions SET last_price_rowid = ? WHERE last_price_rowid < ?",
+                           (last_rowid, last_rowid))
+
+    logger.info(f"Проверено подписок {len(subscriptions)}, новых уведомлений {created}.")
+    return created
+
+
+def skip_prices(from_rowid: int) -> None:
+    """
+    Отмечает цены, записанные после from_rowid, проверенными без поиска по ним
+    (например, цены повторно разобранного прошлого сбора, см. database/archive.py).
+    Подписки, не проверенные до from_rowid, не меняются.
+
+    :param from_rowid: rowid таблицы prices до записи пропускаемых цен.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute("UPDATE subscriptions SET last_price_rowid = ? WHERE last_price_rowid >= ?",
+                           (_get_last_price_rowid(), from_rowid))
+
+
+def get_pending_notifications(limit: int = 100) -> list[tuple]:
+    """
+    Возвращает неотправленные уведомления.
+
+    :param limit: Максимальное количество уведомлений.
+    :return: Список кортежей (id уведомления, id чата, id подписки, id квартиры, ЖК, количество комнат,
+             площадь, этаж, цена, предыдущая цена, ссылка).
+    """
+    return execute_sql_fetch(
+        """SELECT notification_id, chat_id, subscription_id, flat_id, name, rooms, area, floor,
+                  notifications.price, previous_price, url || url_suffix AS url_address
+           FROM notifications
+           JOIN flats USING (flat_id)
+           JOIN projects ON flats.project_id = projects.project_id
+           WHERE sent IS NULL ORDER BY chat_id, notification_id LIMIT ?""", (limit, ))
+
+
+def mark_notifications_sent(notification_ids: list[int]) -> None:
+    """ Отмечает уведомления отправленными. """
+    connection = get_connection()
+    with connection:
+        connection.executemany("UPDATE notifications SET sent = ? WHERE notification_id = ?",
+                               ((_now(), notification_id) for notification_id in notification_ids))
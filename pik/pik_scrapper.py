@@ -16,46 +16,110 @@ https://api.pik.ru/v2/filter?customSort=1&type=1,2&location=2,3&block=1124&flatP
 __version__ = "v. 1.0 dated 01/11/2022"
 
 import re
+import queue
+import hashlib
+import asyncio
+import threading
+import aiohttp
 import requests
 from bs4 import BeautifulSoup
-from time import sleep
-from random import choice, randint
-from sys import getsizeof
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import date, timedelta
+from time import perf_counter
+from typing import Awaitable, Callable, ContextManager, Iterator, Mapping
 
 import settings
+from database import archive
 from services import *
+from services.fetcher import Fetcher, TokenBucket
+from services.metrics import metrics
 
-HOST = "https://www.pik.ru/projects"  # страница с проектами
+SOURCE = "pik"  # застройщик, используется для сохранения состояния сбора
+HOST = settings.PIK_PROJECTS_URL  # страница с проектами
 PROJECT_URL_PREFIX = "https://www.pik.ru/"  # для формирования url-адреса проекта
+FLATS_ON_PAGE = 50  # количество квартир на одной странице api
+STOP_CHECK_INTERVAL = 0.1  # секунд между проверками остановки асинхронного сбора (см. _iter_pages_async)
+NEXT_DATA_PATTERN = re.compile(r'<script[^>]*\bid="__NEXT_DATA__"[^>]*>(.*?)</script>', re.DOTALL)
+
+# пути к полям ЖК в ответе api, порядок полей важен
+PROJECT_PATHS = {
+    'project_id': ['blocks', 0, 'id'],
+    'name': ['blocks', 0, 'name'],
+    'url': ['blocks', 0, 'url'],
+    'metro': ['blocks', 0, 'metro'],
+    'time_to_metro': ['blocks', 0, 'timeOnFoot'],
+    'longitude': ['blocks', 0, 'longitude'],
+    'latitude': ['blocks', 0, 'latitude'],
+    'address': ['blocks', 0, 'flats', 0, 'address'],
+}
+# пути к полям квартиры и ее цены в описании квартиры, порядок полей важен
+FLAT_PATHS = {
+    'flat_id': ['id'],
+    'address': ['address'],
+    'floor': ['floor'],
+    'rooms': ['rooms'],
+    'area': ['area'],
+    'finishing': ['finish'],
+    'bulk': ['bulk', 'name'],
+    'settlement_date': ['bulk', 'settlementDate'],
+    'benefit_name': ['mainBenefit', 'name'],
+    'benefit_description': ['mainBenefit', 'description'],
+    'price': ['price'],
+    'meter_price': ['meterPrice'],
+    'booking_status': ['bookingStatus'],
+}
+_extract_projects = compile_json_extractor(PROJECT_PATHS)
+_extract_flats = compile_json_extractor(FLAT_PATHS)
 
 logger = init_logger(__name__, settings.LOGGER_LEVEL)
 logging.getLogger('urllib3').setLevel(logging.ERROR)
 
-headers = settings.HEADERS.copy()
+fetcher = Fetcher(headers=settings.HEADERS,
+                  user_agents=settings.USER_AGENTS,
+                  rate_limiter=TokenBucket(rate=settings.REQUESTS_PER_SECOND,
+                                           min_rate=settings.MIN_REQUESTS_PER_SECOND,
+                                           max_rate=settings.MAX_REQUESTS_PER_SECOND),
+                  max_retries=settings.MAX_RETRIES,
+                  backoff_base=settings.BACKOFF_BASE,
+                  backoff_max=settings.BACKOFF_MAX,
+                  timeout=settings.REQUEST_TIMEOUT,
+                  pool_size=settings.MAX_CONCURRENT_REQUESTS_PER_HOST)
 
 
-def _get_html(url: str, params: str = None) -> requests.Response | str:
+def _get_html(url: str, params: str = None, request_headers: dict = None) -> requests.Response | str:
     """
     Возвращает класс requests.Response или пустую строку.
+    Соединения переиспользуются (keep-alive), частота запросов
+    и повторные попытки регулируются fetcher'ом.
 
     :param url: URL-адрес.
     :param params: Дополнительные параметры.
+    :param request_headers: Дополнительные заголовки (для условного запроса).
     :return: :class:`Response <Response>` object или пустую строку.
     """
-    for i in range(3):  # три попытки получить страницу
-        try:
-            headers['User-Agent'] = choice(settings.USER_AGENTS)
-            print(headers)
-            rq = requests.get(url, params=params, headers=headers)
-            if rq.status_code == 200:
-                logger.debug(f"{rq.status_code}: {url}")
-                return rq
-            else:
-                logger.error(f"{rq.status_code}: {url}")
-                sleep(3)
-        except Exception as ex:
-            logger.error(f"Функция _get_html вызвала исключение {ex}")
-    return ''
+    rq = fetcher.get(url, params=params, headers=request_headers)
+    if rq is None:
+        logger.error(f"Не удалось получить страницу {url}")
+        return ''
+    return rq
+
+
+def _get_next_data(html: str) -> str:
+    """
+    Возвращает содержимое скрипта __NEXT_DATA__ (json с данными страницы).
+    Ищется регулярным выражением без построения дерева страницы,
+    BeautifulSoup используется, только если скрипт не найден.
+
+    :param html: HTML страница.
+    :return: Содержимое скрипта или пустая строка.
+    """
+    match = NEXT_DATA_PATTERN.search(html)
+    if match:
+        return match.group(1)
+    script = BeautifulSoup(html, 'lxml').find("script", id="__NEXT_DATA__")
+    return script.text if script else ''
 
 
 def _get_projects(html: str) -> set[tuple[str, str]]:
@@ -67,8 +131,7 @@ def _get_projects(html: str) -> set[tuple[str, str]]:
              ID будет использован для формирования URL запроса
              на получение информации о квартирах.
     """
-    soup = BeautifulSoup(html, 'lxml')
-    all_projects = soup.find("script", id="__NEXT_DATA__").text
+    all_projects = _get_next_data(html)
 
     # "value":149,"text":"Одинцово-1","active":false
     match = re.findall(r'"value":([\d]+),"text":"([\w -]+)","active":', all_projects)  # [("id", "name"), ...]
@@ -78,71 +141,296 @@ def _get_projects(html: str) -> set[tuple[str, str]]:
     return res
 
 
-def _get_flats_from_one_project(data: str, project: tuple) -> tuple[list[Project], list[Flat], list[Price]]:
+def _get_flats_url(project_id: str) -> str:
     """
-    Возвращает все найденные квартиры одного ЖК.
+    Возвращает URL запроса к api без номера страницы.
 
-    :param data: Текущая дата в формате '%Y-%m-%d'.
-    :param project: Кортеж с id и названием ЖК ("id", "name").
-    :return: Кортеж списков с информацией о ЖК, квартирах в нем и их цене.
+    :param project_id: id ЖК.
+    :return: URL-адрес, номер страницы добавляется в конец.
     """
-    flat_page = 1
-    url = "https://api.pik.ru/v2/filter?customSort=1&type=1,2&location=2,3&block=" \
-          + f"{project[0]}&flatLimit=50&onlyFlats=1&flatPage="
-
-    flats_info = _get_html(url=url + str(flat_page)).json()
+    return f"{settings.PIK_API_URL}?customSort=1&type=1,2&location=2,3&block=" \
+        + f"{project_id}&flatLimit={FLATS_ON_PAGE}&onlyFlats=1&flatPage="
 
-    if settings.DEBUG:
-        write_json_to_file(f'temp/raw_flats_info_{get_data_time()}', flats_info)
-    # flats_info = read_json_from_file('flats_info.json')
 
-    total_flats = flats_info.get('count', 0)
-    total_pages = total_flats // 50
-    if total_flats % 50 != 0:
+def _get_total_pages(total_flats: int) -> int:
+    """ Возвращает количество страниц api для указанного количества квартир. """
+    total_pages = total_flats // FLATS_ON_PAGE
+    if total_flats % FLATS_ON_PAGE != 0:
         total_pages += 1
+    return total_pages
 
-    logger.debug(f"ЖК '{project[1]}' всего квартир {total_flats}.")
-    logger.debug(f"На {total_pages} страницах.")
 
-    full_address = get_value_from_json(flats_info, ['blocks', 0, "flats", 0, "address"])
+def _get_project_from_page(data: str, flats_info: json) -> Project:
+    """
+    Возвращает информацию о ЖК с первой страницы api.
+
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param flats_info: json ответа api.
+    :return: Дата-класс с информацией о ЖК.
+    """
+    (project_id, name, url, metro, time_to_metro, longitude, latitude,
+     full_address), = _extract_projects([flats_info])
+    full_address = full_address or ''
     project_city = full_address.split(',')[0]
     project_address = re.sub(r'[, (]*[Кк]орп[уса]*[\d\w ,./()№]*', '', full_address)       # убираем корпуса
     project_address = re.sub(r'[, ]*[Ээ]тап[ы]*[\d .,/]+', '', project_address)            # убираем этапы
 
-    # получаем информацию о ЖК
-    result_project = [Project(
-        project_id=get_value_from_json(flats_info, ['blocks', 0, 'id']),
+    return Project(
+        project_id=project_id,
         city=project_city,
-        name=get_value_from_json(flats_info, ['blocks', 0, 'name']),
-        url=PROJECT_URL_PREFIX + get_value_from_json(flats_info, ['blocks', 0, 'url']),
-        metro=get_value_from_json(flats_info, ['blocks', 0, 'metro']),
-        time_to_metro=get_value_from_json(flats_info, ['blocks', 0, 'timeOnFoot']),
-        longitude=get_value_from_json(flats_info, ['blocks', 0, 'longitude']),
-        latitude=get_value_from_json(flats_info, ['blocks', 0, 'latitude']),
+        name=name,
+        url=PROJECT_URL_PREFIX + url,
+        metro=metro,
+        time_to_metro=time_to_metro,
+        longitude=longitude,
+        latitude=latitude,
         address=project_address,
         data_created=data
-    )]
+    )
 
-    # собираем информацию о квартирах в этом ЖК
-    flats_on_this_page = get_value_from_json(flats_info, ['blocks', 0, "flats"])  # list[dict]
-    result_flats, result_prices = _get_flats_from_page(data, result_project[0].project_id, flats_on_this_page)
 
-    for flat_page in range(2, total_pages + 1):
-        logger.debug(f"[{flat_page=}/{total_pages}]")
-        flats_info = _get_html(url=url + str(flat_page)).json()
-        if settings.DEBUG:
-            write_json_to_file(f'temp/raw_flats_info_{get_data_time()}', flats_info)
-        flats_on_this_page = get_value_from_json(flats_info, ['blocks', 0, "flats"])  # list[dict]
-        temp_flats, temp_prices = _get_flats_from_page(data, result_project[0].project_id, flats_on_this_page)
-        result_flats.extend(temp_flats)
-        result_prices.extend(temp_prices)
+def _get_page(data: str, project: str, flat_page: int, flats_info: json) -> Page:
+    """
+    Собирает информацию о квартирах на одной странице api,
+    с первой страницы берется и информация о ЖК.
+
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param project: id ЖК из списка проектов.
+    :param flat_page: Номер страницы.
+    :param flats_info: json ответа api.
+    :return: Дата-класс страницы.
+    """
+    project_id = get_value_from_json(flats_info, ['blocks', 0, 'id'])
+    flats_on_this_page = get_value_from_json(flats_info, ['blocks', 0, "flats"]) or []  # list[dict]
+    flats, prices = _get_flats_from_page(data, project_id, flats_on_this_page)
+    return Page(
+        project=project,
+        flat_page=flat_page,
+        total_pages=_get_total_pages(flats_info.get('count', 0)),
+        projects=[_get_project_from_page(data, flats_info)] if flat_page == 1 else [],
+        flats=flats,
+        prices=prices
+    )
+
+
+def _parse_page(data: str, project: str, flat_page: int, raw: bytes) -> Page | None:
+    """
+    Разбирает ответ api на одной странице. Выполняется в процессе из пула PARSE_WORKERS.
+
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param project: id ЖК из списка проектов.
+    :param flat_page: Номер страницы.
+    :param raw: Тело ответа api.
+    :return: Дата-класс страницы или None, если ответ не является json.
+    """
+    start = perf_counter()
+    flats_info = _load_json(raw, project, flat_page)
+    if not flats_info:
+        return None
+    page = _get_page(data, project, flat_page, flats_info)
+    page.parse_seconds = perf_counter() - start
+    return page
+
+
+def _parse_first_page(data: str, project: str, raw: bytes | None, validators: dict,
+                      previous: Fingerprint | None) -> Page | None:
+    """
+    Разбирает ответ api на первой странице ЖК вместе с его отпечатком.
+    Выполняется в процессе из пула PARSE_WORKERS.
+
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param project: id ЖК из списка проектов.
+    :param raw: Тело ответа api или None для ответа 304.
+    :param validators: Заголовки ETag и Last-Modified ответа api.
+    :param previous: Отпечаток ЖК с прошлого сбора.
+    :return: Дата-класс страницы или None, если ответ не является json.
+    """
+    start = perf_counter()
+    flats_info = None
+    if raw is not None:
+        flats_info = _load_json(raw, project, 1)
+        if not flats_info:
+            return None
+    page = _get_first_page(data, project, flats_info, validators, previous)
+    page.parse_seconds = perf_counter() - start
+    return page
+
+
+def _load_json(raw: bytes, project: str, flat_page: int) -> json:
+    """
+    Возвращает json из тела ответа api или пустой словарь.
+    При DEBUG ответ сохраняется в temp/raw_flats_info_<id ЖК>_<страница>_<время>.json,
+    сохраненные ответы можно воспроизвести (benchmarks/replay_server.py --recorded temp).
+    """
+    try:
+        flats_info = json.loads(raw)
+    except ValueError as ex:
+        logger.error(f"Ответ api не является json: {ex}")
+        return {}
+
+    if settings.DEBUG:
+        write_json_to_file(f'temp/raw_flats_info_{project}_{flat_page}_{get_data_time()}', flats_info)
+    # flats_info = read_json_from_file('flats_info.json')
+    return flats_info
+
+
+def _get_validators(response_headers: Mapping[str, str]) -> dict:
+    """ Возвращает заголовки ETag и Last-Modified ответа (словарь можно передать в другой процесс). """
+    return {'ETag': response_headers.get('ETag'), 'Last-Modified': response_headers.get('Last-Modified')}
+
+
+def _get_parse_pool() -> ContextManager[ProcessPoolExecutor | None]:
+    """
+    Возвращает пул процессов для разбора ответов api
+    или None (разбор в текущем процессе), если PARSE_WORKERS = 0.
+    """
+    if settings.PARSE_WORKERS > 0:
+        return ProcessPoolExecutor(max_workers=settings.PARSE_WORKERS)
+    return nullcontext()
+
+
+def _submit(pool: ProcessPoolExecutor | None, function: Callable, *args) -> Future:
+    """ Передает разбор ответа api в пул процессов или выполняет его сразу, если пула нет. """
+    if pool is not None:
+        return pool.submit(function, *args)
+    future = Future()
+    future.set_result(function(*args))
+    return future
+
+
+def _get_fingerprint(data: str, flats_info: json, response_headers: Mapping[str, str]) -> Fingerprint:
+    """
+    Возвращает отпечаток ЖК по первой странице api: количество квартир в ЖК и хэш id, цен
+    и статусов бронирования квартир первой страницы. Изменения цен на остальных страницах
+    отпечаток не отражает, поэтому ЖК собирается полностью не реже DELTA_FULL_CRAWL_DAYS (см. _is_delta_allowed).
+
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param flats_info: json первой страницы api.
+    :param response_headers: Заголовки ответа api.
+    :return: Дата-класс отпечатка.
+    """
+    flats_on_this_page = get_value_from_json(flats_info, ['blocks', 0, "flats"]) or []
+    digest = hashlib.sha1('|'.join(f"{flat.get('id')}:{flat.get('price')}:{flat.get('bookingStatus')}"
+                                   for flat in flats_on_this_page).encode()).hexdigest()
+    return Fingerprint(
+        flats_count=flats_info.get('count', 0),
+        digest=digest,
+        etag=response_headers.get('ETag'),
+        last_modified=response_headers.get('Last-Modified'),
+        full_crawled=data
+    )
+
+
+def _get_conditional_headers(data: str, previous: Fingerprint | None) -> dict:
+    """
+    Возвращает заголовки условного запроса первой страницы ЖК (If-None-Match, If-Modified-Since)
+    или пустой словарь, если ЖК нужно собрать полностью.
+
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param previous: Отпечаток ЖК с прошлого сбора.
+    """
+    if not _is_delta_allowed(data, previous):
+        return {}
+    request_headers = {}
+    if previous.etag:
+        request_headers['If-None-Match'] = previous.etag
+    if previous.last_modified:
+        request_headers['If-Modified-Since'] = previous.last_modified
+    return request_headers
+
+
+def _is_delta_allowed(data: str, previous: Fingerprint | None) -> bool:
+    """
+    Возвращает True, если у неизменившегося ЖК можно собрать только первую страницу: включен DELTA_CRAWL,
+    есть отпечаток с прошлого сбора и полный сбор был не раньше DELTA_FULL_CRAWL_DAYS дней назад.
+    Отпечаток и ETag первой страницы не отражают изменения цен на остальных страницах,
+    поэтому такие изменения попадают в базу данных с задержкой до DELTA_FULL_CRAWL_DAYS дней.
+    """
+    return settings.DELTA_CRAWL and previous is not None and \
+        date.fromisoformat(previous.full_crawled) > date.fromisoformat(data) - timedelta(days=settings.DELTA_FULL_CRAWL_DAYS)
+
+
+def _get_first_page(data: str, project: str, flats_info: json, response_headers: Mapping[str, str],
+                    previous: Fingerprint | None) -> Page:
+    """
+    Собирает первую страницу ЖК вместе с его отпечатком. Если ЖК не изменился
+    с прошлого сбора (ответ 304 или совпал отпечаток, см. _is_delta_allowed), у страницы total_pages = 1,
+    остальные страницы не запрашиваются. Квартиры первой страницы записываются как обычно
+    (неизменившиеся цены база данных пропускает), при ответе 304 страница пустая.
 
-        sleep(randint(1, 3))
-        break
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param project: id ЖК из списка проектов.
+    :param flats_info: json первой страницы api или None для ответа 304.
+    :param response_headers: Заголовки ответа api.
+    :param previous: Отпечаток ЖК с прошлого сбора.
+    :return: Дата-класс страницы.
+    """
+    if flats_info is None:     # 304 Not Modified
+        return Page(project=project, flat_page=1, total_pages=1, projects=[], flats=[], prices=[],
+                    fingerprint=previous)
+
+    page = _get_page(data, project, 1, flats_info)
+    page.fingerprint = _get_fingerprint(data, flats_info, response_headers)
+    if _is_delta_allowed(data, previous) \
+            and previous.flats_count == page.fingerprint.flats_count and previous.digest == page.fingerprint.digest:
+        page.fingerprint.full_crawled = previous.full_crawled
+        page.total_pages = 1
+    return page
+
+
+def _log_first_page(data: str, project: tuple, page: Page) -> None:
+    """ Пишет в лог количество квартир в ЖК или что ЖК не изменился. """
+    if page.fingerprint.full_crawled != data:
+        logger.debug(f"ЖК '{project[1]}' не изменился с прошлого сбора.")
+    else:
+        logger.debug(f"ЖК '{project[1]}' всего квартир {page.fingerprint.flats_count} "
+                     f"на {page.total_pages} страницах.")
 
-    logger.debug(f"Собрана информация по {len(result_flats)} квартирам.")
 
-    return result_project, result_flats, result_prices
+def _iter_project_futures(pool: ProcessPoolExecutor | None, data: str, project: tuple,
+                          completed: tuple[int, set[int]] = (None, frozenset()),
+                          previous: Fingerprint = None) -> Iterator[Future]:
+    """
+    Загружает страницы с квартирами одного ЖК и передает их на разбор в пул процессов.
+    Пока разбирается одна страница, загружается следующая.
+
+    :param pool: Пул процессов для разбора или None.
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param project: Кортеж с id и названием ЖК ("id", "name").
+    :param completed: Кортеж (всего страниц, множество уже собранных страниц), они пропускаются.
+    :param previous: Отпечаток ЖК с прошлого сбора, если ЖК не изменился, собирается только первая страница.
+    :return: Генератор Future, результат которых - страница или None.
+    """
+    url = _get_flats_url(project[0])
+    total_pages, completed_pages = completed
+
+    if 1 not in completed_pages:
+        rq = _get_html(url + '1', request_headers=_get_conditional_headers(data, previous))
+        if rq == '':
+            logger.error(f"Не удалось получить информацию о ЖК '{project[1]}'.")
+            return
+
+        if rq.status_code == 200:
+            archive.add(SOURCE, data, 'flats', project[0], 1, rq.content)
+        # количество страниц известно только после разбора первой страницы, ждем его
+        future = _submit(pool, _parse_first_page, data, project[0], rq.content if rq.status_code == 200 else None,
+                         _get_validators(rq.headers), previous)
+        page = future.result()
+        if page is None:
+            logger.error(f"Не удалось получить информацию о ЖК '{project[1]}'.")
+            return
+        total_pages = page.total_pages
+        _log_first_page(data, project, page)
+        yield future
+
+    for flat_page in range(2, total_pages + 1):
+        if flat_page in completed_pages:
+            continue
+        logger.debug(f"[{flat_page=}/{total_pages}]")
+        rq = _get_html(url + str(flat_page))
+        if rq != '':
+            archive.add(SOURCE, data, 'flats', project[0], flat_page, rq.content)
+            yield _submit(pool, _parse_page, data, project[0], flat_page, rq.content)
 
 
 def _get_flats_from_page(data: str, project_id: int, flats_on_page: json) -> tuple[list[Flat], list[Price]]:
@@ -156,62 +444,286 @@ def _get_flats_from_page(data: str, project_id: int, flats_on_page: json) -> tup
     """
     result_flats = []
     result_prices = []
-    for flat in flats_on_page:
-        result_flat = Flat(
-            flat_id=get_value_from_json(flat, ["id"]),
+    for (flat_id, address, floor, rooms, area, finishing, bulk, settlement_date,
+         benefit_name, benefit_description, price, meter_price, booking_status) in _extract_flats(flats_on_page):
+        result_flats.append(Flat(
+            flat_id=flat_id,
             project_id=project_id,
-            address=get_value_from_json(flat, ["address"]),
-            floor=get_value_from_json(flat, ["floor"]),
-            rooms=get_value_from_json(flat, ["rooms"]),
-            area=get_value_from_json(flat, ["area"]),
-            finishing=get_value_from_json(flat, ["finish"]),
-            bulk=get_value_from_json(flat, ["bulk", "name"]),
-            settlement_date=get_value_from_json(flat, ["bulk", "settlementDate"]),
-            url_suffix="/flats/" + str(get_value_from_json(flat, ["id"])),
+            address=address,
+            floor=floor,
+            rooms=rooms,
+            area=area,
+            finishing=finishing,
+            bulk=bulk,
+            settlement_date=settlement_date,
+            url_suffix="/flats/" + str(flat_id),
             data_created=data
-        )
-        result_price = Price(
-            price_id=result_flat.flat_id,
-            benefit_name=get_value_from_json(flat, ['mainBenefit', "name"]),
-            benefit_description=get_value_from_json(flat, ['mainBenefit', "description"]),
-            price=get_value_from_json(flat, ["price"]),
-            meter_price=get_value_from_json(flat, ["meterPrice"]),
-            booking_status=get_value_from_json(flat, ["bookingStatus"]),
+        ))
+        result_prices.append(Price(
+            price_id=flat_id,
+            benefit_name=benefit_name,
+            benefit_description=benefit_description,
+            price=price,
+            meter_price=meter_price,
+            booking_status=booking_status,
             data_created=data
-        )
-        result_flats.append(result_flat)
-        result_prices.append(result_price)
+        ))
     return result_flats, result_prices
 
 
-def _get_flats_from_all_projects(data: str, all_projects: set[tuple[str, str]]) -> tuple[list[Project],
-                                                                                         list[Flat], list[Price]]:
+def _iter_pages_sync(data: str, all_projects: set[tuple[str, str]],
+                     completed_pages: dict[str, tuple[int, set[int]]],
+                     fingerprints: dict[str, Fingerprint]) -> Iterator[Page]:
     """
-    Собирает информацию о квартирах во всех найденных ЖК.
+    Последовательно загружает страницы с квартирами всех найденных ЖК
+    и возвращает их в том же порядке после разбора в пуле процессов.
+    На разборе одновременно находится не больше PARSE_QUEUE_SIZE страниц.
 
     :param data: Текущая дата в формате '%Y-%m-%d'.
     :param all_projects: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...}.
-    :return: Кортеж списков с информацией о всех ЖК, квартирах в ЖК и цене квартир.
+    :param completed_pages: Уже собранные страницы {id ЖК: (всего страниц, множество страниц)}.
+    :param fingerprints: Отпечатки ЖК с прошлого сбора {id ЖК: отпечаток}.
+    :return: Генератор страниц.
     """
-    result_projects = []
-    result_flats = []
-    result_prices = []
-    current_project_number = 1
     total_projects = len(all_projects)
+    pending = deque()
+    with _get_parse_pool() as pool:
+        for current_project_number, project in enumerate(all_projects, start=1):
+            logger.debug(f"[{current_project_number}|{total_projects}] ЖК.")
+            for future in _iter_project_futures(pool, data, project,
+                                                completed_pages.get(project[0], (None, frozenset())),
+                                                fingerprints.get(project[0])):
+                pending.append(future)
+                while pending and (len(pending) > settings.PARSE_QUEUE_SIZE or pending[0].done()):
+                    if (page := pending.popleft().result()) is not None:
+                        yield page
+        while pending:
+            if (page := pending.popleft().result()) is not None:
+                yield page
+
+
+async def _parse_async(pool: ProcessPoolExecutor | None, function: Callable, *args) -> Page | None:
+    """ Разбирает ответ api в пуле процессов, не блокируя цикл событий. """
+    if pool is None:
+        return function(*args)
+    return await asyncio.get_running_loop().run_in_executor(pool, function, *args)
+
+
+async def _crawl_project_async(session: aiohttp.ClientSession, pool: ProcessPoolExecutor | None, data: str,
+                               project: tuple, put: Callable[[Page], Awaitable],
+                               completed: tuple[int, set[int]] = (None, frozenset()),
+                               previous: Fingerprint = None) -> None:
+    """
+    Асинхронно собирает страницы с квартирами одного ЖК,
+    страницы начиная со второй запрашиваются одновременно.
 
-    for project in all_projects:
-        logger.debug(f"[{current_project_number}|{total_projects}] ЖК.")
-        project, flats, prices = _get_flats_from_one_project(data, project)
-        result_projects.extend(project)
-        result_flats.extend(flats)
-        result_prices.extend(prices)
-        current_project_number += 1
-        # break
+    :param session: Сессия aiohttp.
+    :param pool: Пул процессов для разбора ответов api или None.
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param project: Кортеж с id и названием ЖК ("id", "name").
+    :param put: Корутина, которой передается каждая собранная страница.
+    :param completed: Кортеж (всего страниц, множество уже собранных страниц), они пропускаются.
+    :param previous: Отпечаток ЖК с прошлого сбора, если ЖК не изменился, собирается только первая страница.
+    """
+    url = _get_flats_url(project[0])
+    total_pages, completed_pages = completed
+
+    if 1 not in completed_pages:
+        response = await fetcher.get_async(session, url + '1', _get_conditional_headers(data, previous))
+        page = None
+        if response is not None:
+            status, response_headers, raw = response
+            if raw is not None:     # сжатие и запись в архив - вне цикла событий
+                await asyncio.to_thread(archive.add, SOURCE, data, 'flats', project[0], 1, raw)
+            page = await _parse_async(pool, _parse_first_page, data, project[0], raw,
+                                      _get_validators(response_headers), previous)
+        if page is None:
+            logger.error(f"Не удалось получить информацию о ЖК '{project[1]}'.")
+            return
+
+        total_pages = page.total_pages
+        _log_first_page(data, project, page)
+        await put(page)
+
+    async def crawl_page(flat_page: int) -> None:
+        page_response = await fetcher.get_async(session, url + str(flat_page))
+        if page_response is not None:
+            await asyncio.to_thread(archive.add, SOURCE, data, 'flats', project[0], flat_page, page_response[2])
+            flat_page_info = await _parse_async(pool, _parse_page, data, project[0], flat_page, page_response[2])
+            if flat_page_info is not None:
+                await put(flat_page_info)
+
+    await asyncio.gather(*(crawl_page(flat_page) for flat_page in range(2, total_pages + 1)
+                           if flat_page not in completed_pages))
+
+
+async def _crawl_async(data: str, all_projects: set[tuple[str, str]],
+                       completed_pages: dict[str, tuple[int, set[int]]], fingerprints: dict[str, Fingerprint],
+                       put: Callable[[Page], Awaitable]) -> None:
+    """
+    Асинхронно собирает страницы с квартирами во всех найденных ЖК.
+    Количество одновременных запросов ограничено настройками
+    MAX_CONCURRENT_REQUESTS (всего) и MAX_CONCURRENT_REQUESTS_PER_HOST (к одному хосту),
+    ответы разбираются в пуле из PARSE_WORKERS процессов.
 
-    logger.info(f"Собрана информация по {len(result_projects)} ЖК, в которых найдено {len(result_flats)} квартир.")
-    logger.debug(f'Всего {getsizeof(result_projects) + getsizeof(result_flats) + getsizeof(result_prices)} bytes.')
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param all_projects: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...}.
+    :param completed_pages: Уже собранные страницы {id ЖК: (всего страниц, множество страниц)}.
+    :param fingerprints: Отпечатки ЖК с прошлого сбора {id ЖК: отпечаток}.
+    :param put: Корутина, которой передается каждая собранная страница.
+    """
+    connector = aiohttp.TCPConnector(limit=settings.MAX_CONCURRENT_REQUESTS,
+                                     limit_per_host=settings.MAX_CONCURRENT_REQUESTS_PER_HOST)
+    timeout = aiohttp.ClientTimeout(total=settings.REQUEST_TIMEOUT)
+    with _get_parse_pool() as pool:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*(_crawl_project_async(session, pool, data, project, put,
+                                                        completed_pages.get(project[0], (None, frozenset())),
+                                                        fingerprints.get(project[0]))
+                                   for project in all_projects))
+
+
+def _iter_pages_async(data: str, all_projects: set[tuple[str, str]],
+                      completed_pages: dict[str, tuple[int, set[int]]],
+                      fingerprints: dict[str, Fingerprint]) -> Iterator[Page]:
+    """
+    Возвращает страницы с квартирами всех найденных ЖК, которые собираются асинхронно
+    в отдельном потоке. Очередь между потоками ограничена PAGES_QUEUE_SIZE страницами,
+    если страницы не успевают обрабатываться, сбор приостанавливается.
+    Если страницы перестают забирать (ошибка при записи или генератор закрыт),
+    сбор останавливается: задачи сбора отменяются, сессия aiohttp закрывается.
 
-    return result_projects, result_flats, result_prices
+    :param data: Текущая дата в формате '%Y-%m-%d'.
+    :param all_projects: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...}.
+    :param completed_pages: Уже собранные страницы {id ЖК: (всего страниц, множество страниц)}.
+    :param fingerprints: Отпечатки ЖК с прошлого сбора {id ЖК: отпечаток}.
+    :return: Генератор страниц.
+    """
+    pages = queue.Queue(maxsize=settings.PAGES_QUEUE_SIZE)
+    stop = threading.Event()    # страницы больше не забирают
+    errors = []
+
+    def put_page(page: Page | None) -> bool:
+        """ Передает страницу в очередь, возвращает False, если сбор остановлен. """
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=STOP_CHECK_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    async def put(page: Page) -> None:
+        if not await asyncio.to_thread(put_page, page):
+            raise asyncio.CancelledError
+
+    async def crawl_until_stopped() -> None:
+        task = asyncio.create_task(_crawl_async(data, all_projects, completed_pages, fingerprints, put))
+        while not task.done():
+            if stop.is_set():
+                task.cancel()
+            await asyncio.wait((task, ), timeout=STOP_CHECK_INTERVAL)
+        await task
+
+    def crawl() -> None:
+        try:
+            asyncio.run(crawl_until_stopped())
+        except asyncio.CancelledError:
+            pass
+        except Exception as ex:
+            errors.append(ex)
+        finally:
+            put_page(None)      # сбор закончен
+
+    thread = threading.Thread(target=crawl, name='async_crawl', daemon=True)
+    thread.start()
+    try:
+        while (page := pages.get()) is not None:
+            yield page
+    finally:
+        stop.set()
+        thread.join()
+    if errors:
+        raise errors[0]
+
+
+def get_all_projects(data: str = None) -> set[tuple[str, str]]:
+    """
+    Возвращает id и название всех проектов с главной страницы.
+
+    :param data: Дата сбора в формате '%Y-%m-%d' для архива ответов, по умолчанию текущая.
+    :return: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...}
+             или пустое множество, если страницу получить не удалось.
+    """
+    with metrics.phase('get_projects'):
+        html_text = _get_html(HOST)
+    if html_text == '':
+        logger.error(f"Не удалось получить главную страницу {HOST}!")
+        return set()
+    archive.add(SOURCE, data or get_data_time('%Y-%m-%d'), 'projects', None, None, html_text.content)
+    html_text = html_text.text
+
+    if settings.DEBUG:
+        with open('temp/main_page.html', 'w') as file:
+            file.write(html_text)
+    # html_text = read_from_file('index.html')
+
+    return _get_projects(html_text)
+
+
+def iter_pages(data: str = None, all_projects: set[tuple[str, str]] = None,
+               completed_pages: dict[str, tuple[int, set[int]]] = None,
+               fingerprints: dict[str, Fingerprint] = None) -> Iterator[Page]:
+    """
+    Возвращает страницы с квартирами по мере их сбора,
+    в памяти одновременно находится не больше нескольких страниц.
+
+    :param data: Дата сбора в формате '%Y-%m-%d', по умолчанию текущая.
+    :param all_projects: Множество (set) кортежей с id и названием ЖК {("id", "name"), ...},
+                         по умолчанию все проекты с главной страницы.
+    :param completed_pages: Уже собранные страницы {id ЖК: (всего страниц, множество страниц)},
+                            они не запрашиваются повторно (продолжение прерванного сбора).
+    :param fingerprints: Отпечатки ЖК с прошлого сбора {id ЖК: отпечаток}, при включенном DELTA_CRAWL
+                         у неизменившихся ЖК собирается только первая страница.
+    :return: Генератор страниц.
+    """
+    data = data or get_data_time('%Y-%m-%d')
+    if all_projects is None:
+        all_projects = get_all_projects(data)
+    completed_pages = completed_pages or {}
+    fingerprints = fingerprints or {}
+
+    logger.info(f"Начало сбора информации по {len(all_projects)} ЖК.")
+    if settings.ASYNC_CRAWL:
+        pages = _iter_pages_async(data, all_projects, completed_pages, fingerprints)
+    else:
+        pages = _iter_pages_sync(data, all_projects, completed_pages, fingerprints)
+    try:
+        for page in pages:
+            # разбор выполняется в пуле процессов, поэтому его время записывается в метрики здесь
+            metrics.observe('parse_seconds', page.parse_seconds)
+            metrics.inc('pages_total')
+            if page.fingerprint is not None and page.fingerprint.full_crawled != data:
+                metrics.inc('unchanged_projects_total')
+            metrics.inc('flats_total', len(page.flats))
+            archive.save_pending_index()
+            yield page
+    finally:
+        archive.close(SOURCE)
+        archive.save_pending_index()
+
+
+def parse_payload(data: str, project: str, flat_page: int, raw: bytes) -> Page | None:
+    """
+    Разбирает сохраненный в архиве ответ api (повторный разбор сбора, см. database/archive.py).
+
+    :param data: Дата сбора в формате '%Y-%m-%d'.
+    :param project: id ЖК из списка проектов.
+    :param flat_page: Номер страницы.
+    :param raw: Тело ответа api.
+    :return: Дата-класс страницы или None, если ответ не является json.
+    """
+    return _parse_page(data, project, flat_page, raw)
 
 
 def run() -> tuple[list[Project], list[Flat], list[Price]]:
@@ -220,23 +732,18 @@ def run() -> tuple[list[Project], list[Flat], list[Price]]:
 
     :return: Кортеж списков с информацией о всех ЖК, квартирах в ЖК и цене квартир.
     """
-    current_data = get_data_time('%Y-%m-%d')
-
-    logger.info(f"Начало сбора информации.")
+    result_projects = []
+    result_flats = []
+    result_prices = []
 
-    html_text = _get_html(HOST)  # AttributeError: 'str' object has no attribute 'text'
-    if html_text != '':
-        html_text = html_text.text
+    for page in iter_pages():
+        result_projects.extend(page.projects)
+        result_flats.extend(page.flats)
+        result_prices.extend(page.prices)
 
-        if settings.DEBUG:
-            with open('temp/main_page.html', 'w') as file:
-                file.write(html_text)
-        # html_text = read_from_file('index.html')
+    logger.info(f"Собрана информация по {len(result_projects)} ЖК, в которых найдено {len(result_flats)} квартир.")
 
-        projects = _get_projects(html_text)
-        return _get_flats_from_all_projects(current_data, projects)
-    else:
-        logger.error(f"Не удалось получить главную страницу {HOST}!")
+    return result_projects, result_flats, result_prices
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+"""
+Планировщик сбора информации по квартирам: вместо ежедневного сбора всех ЖК
+работает постоянно и каждые SCHEDULER_INTERVAL секунд собирает ЖК с наибольшим приоритетом.
+
+Приоритет ЖК - ожидаемое количество изменившихся с прошлого сбора квартир на один запрос:
+частота изменений цен ЖК за SCHEDULER_HISTORY_DAYS дней (по таблице prices),
+умноженная на время с прошлого сбора и деленная на количество страниц ЖК.
+ЖК, цены в которых меняются часто, собираются часто, распроданные и «замороженные» - редко,
+но не чаще SCHEDULER_MIN_INTERVAL и не реже SCHEDULER_MAX_INTERVAL часов.
+Новые ЖК собираются в первую очередь. На все ЖК всех застройщиков расходуется
+не больше SCHEDULER_REQUESTS_PER_HOUR запросов в час.
+
+Запуск из корня проекта:
+    python scheduler.py
+"""
+
+from datetime import datetime
+from time import monotonic, sleep
+
+import settings
+import services
+from services.registry import get_scrapper
+from database import database, schedule, subscriptions
+
+logger = services.init_logger(__name__, settings.LOGGER_LEVEL)
+
+
+def get_priority(stats: tuple[int, int, datetime | None, int | None], now: datetime) -> tuple[float, int]:
+    """
+    Возвращает приоритет сбора ЖК и ожидаемое количество запросов.
+
+    :param stats: Статистика ЖК (см. schedule.get_project_stats).
+    :param now: Текущее время.
+    :return: Кортеж (приоритет: 0 - не собирать, inf - собрать в первую очередь; количество запросов).
+    """
+    flats_count, changes, crawled, pages = stats
+    cost = pages or 1
+    if crawled is None:
+        return float('inf'), cost
+    hours = (now - crawled).total_seconds() / 3600
+    if hours < settings.SCHEDULER_MIN_INTERVAL:
+        return 0.0, cost
+    if hours >= settings.SCHEDULER_MAX_INTERVAL:
+        return float('inf'), cost
+    if not flats_count:     # распроданный ЖК собирается раз в SCHEDULER_MAX_INTERVAL часов
+        return 0.0, cost
+    rate = changes / (settings.SCHEDULER_HISTORY_DAYS * 24)     # изменений цен в час
+    return rate * hours / cost, cost
+
+
+class Scheduler:
+    def __init__(self, sources: list[str]):
+        """
+        Планировщик сбора ЖК нескольких застройщиков с общим ограничением запросов.
+
+        :param sources: Застройщики из реестра парсеров (services.registry).
+        """
+        self.sources = sources
+        self.projects: dict[str, dict[str, str]] = {}      # {застройщик: {id ЖК: название}}
+        self.projects_updated: dict[str, float] = {}
+        # доступно запросов, пополняется на SCHEDULER_REQUESTS_PER_HOUR в час, не меньше 0;
+        # после запуска доступен запас на час, иначе первый цикл ничего бы не собрал
+        self.budget = float(settings.SCHEDULER_REQUESTS_PER_HOUR)
+        self.budget_updated = monotonic()
+
+    def _update_budget(self) -> None:
+        """ Пополняет доступные запросы, накапливается не больше, чем на час. """
+        now = monotonic()
+        self.budget = min(settings.SCHEDULER_REQUESTS_PER_HOUR,
+                          self.budget + (now - self.budget_updated) * settings.SCHEDULER_REQUESTS_PER_HOUR / 3600)
+        self.budget_updated = now
+
+    def _spend(self, requests: float) -> None:
+        """ Уменьшает доступные запросы, не ниже 0. """
+        self.budget = max(0.0, self.budget - requests)
+
+    def _get_projects(self, source: str) -> dict[str, str]:
+        """ Возвращает ЖК застройщика, список обновляется раз в SCHEDULER_PROJECTS_INTERVAL часов. """
+        updated = self.projects_updated.get(source)
+        if updated is None or monotonic() - updated >= settings.SCHEDULER_PROJECTS_INTERVAL * 3600:
+            projects = get_scrapper(source).get_all_projects()
+            if projects:
+                self.projects[source] = dict(projects)
+                self.projects_updated[source] = monotonic()
+                self._spend(1)
+        return self.projects.get(source, {})
+
+    def select(self, now: datetime) -> dict[str, set[tuple[str, str]]]:
+        """
+        Выбирает ЖК для сбора в порядке убывания приоритета, пока хватает доступных запросов
+        по количеству страниц при прошлом сборе. Последний выбранный ЖК может превысить остаток
+        (доступные запросы после сбора не становятся меньше 0), так что большие ЖК не откладываются бесконечно.
+
+        :param now: Текущее время.
+        :return: Словарь {застройщик: множество кортежей (id ЖК, название)}.
+        """
+        self._update_budget()
+        candidates = []
+        for source in self.sources:
+            stats = schedule.get_project_stats(source, settings.SCHEDULER_HISTORY_DAYS)
+            for project, name in self._get_projects(source).items():
+                priority, cost = get_priority(stats.get(project, (0, 0, None, None)), now)
+                if priority > 0:
+                    candidates.append((priority, source, project, name, cost))
+
+        selected, budget = {}, self.budget
+        for priority, source, project, name, cost in sorted(candidates, key=lambda item: item[0], reverse=True):
+            if budget <= 0:
+                break
+            budget -= cost
+            selected.setdefault(source, set()).add((project, name))
+        return selected
+
+    def crawl(self, source: str, projects: set[tuple[str, str]]) -> int:
+        """
+        Собирает выбранные ЖК застройщика и записывает время их сбора.
+        Время записывается только у ЖК, у которых получены все страницы,
+        остальные будут выбраны снова в следующем цикле.
+
+        :param source: Застройщик.
+        :param projects: Множество кортежей (id ЖК, название).
+        :return: Количество полученных страниц.
+        """
+        data = services.get_data_time('%Y-%m-%d')
+        received, total_pages, new_fingerprints = {}, {}, {}
+        with database.DatabaseSink() as sink:
+            for page in get_scrapper(source).iter_pages(data, projects, {}, database.get_fingerprints(source)):
+                received[page.project] = received.get(page.project, 0) + 1
+                total_pages[page.project] = page.total_pages
+                if page.fingerprint is not None:
+                    new_fingerprints[page.project] = page.fingerprint
+                sink.add(page)
+
+        completed = {project: pages for project, pages in received.items() if pages >= total_pages[project]}
+        database.save_fingerprints(source, {project: fingerprint for project, fingerprint in new_fingerprints.items()
+                                            if project in completed})
+        schedule.save_project_crawls(source, completed, datetime.now())
+        if len(completed) < len(projects):
+            logger.warning(f"{source}: собрано {len(completed)} из {len(projects)} ЖК, "
+                           f"остальные будут собраны в следующем цикле.")
+        return sum(received.values())
+
+    def run_cycle(self) -> None:
+        """ Выбирает и собирает ЖК с наибольшим приоритетом, после сбора проверяет подписки. """
+        selected = self.select(datetime.now())
+        if not selected:
+            logger.debug(f"Нет ЖК для сбора, доступно запросов {self.budget:.0f}.")
+            return
+
+        pages = 0
+        for source, projects in selected.items():
+            logger.info(f"{source}: сбор {len(projects)} ЖК.")
+            try:
+                pages += self.crawl(source, projects)
+            except Exception:   # ошибка одного застройщика не останавливает сбор остальных
+                logger.exception(f"Сбор {source} завершился ошибкой.")
+        self._spend(pages)
+        database.bump_data_version()
+        subscriptions.evaluate_subscriptions()
+        logger.info(f"Собрано {sum(map(len, selected.values()))} ЖК, {pages} страниц, "
+                    f"осталось запросов {self.budget:.0f}.")
+
+    def run(self) -> None:
+        """ Запускает циклы сбора каждые SCHEDULER_INTERVAL секунд. """
+        logger.info(f"Планировщик сбора {', '.join(self.sources)} запущен.")
+        while True:
+            started = monotonic()
+            self.run_cycle()
+            sleep(max(0.0, settings.SCHEDULER_INTERVAL - (monotonic() - started)))
+
+
+if __name__ == '__main__':
+    Scheduler(list(settings.SCRAPPERS)).run()
@@ -3,16 +3,211 @@
 результат сохраняет в базу данных.
 """
 
-from pik import pik_scrapper
-from database import database
+import multiprocessing
+import queue
+
+import settings
+import services
+from services.metrics import metrics
+from services.registry import get_scrapper
+from database import archive, database, subscriptions
+
+logger = services.init_logger(__name__, settings.LOGGER_LEVEL)
+
+
+class CrawlRun:
+    def __init__(self, source: str):
+        """
+        Состояние сбора одного застройщика в процессе, который пишет в базу данных.
+        Если предыдущий сбор был прерван в тот же день (CHECKPOINT_MAX_AGE_DAYS), продолжает его
+        с той же датой сбора и тем же списком ЖК, уже собранные страницы не запрашиваются.
+
+        :param source: Застройщик.
+        """
+        self.source = source
+        self.sink: database.DatabaseSink | None = None
+        self.new_fingerprints = {}
+        self.fingerprints = database.get_fingerprints(source)
+        run = database.get_unfinished_crawl_run(source)
+        if run is None:
+            self.run_id = self.projects = None     # список ЖК получит парсер
+            self.data = services.get_data_time('%Y-%m-%d')
+            self.completed_pages = {}
+        else:
+            self.run_id, self.data, self.projects = run
+            self.completed_pages = database.get_crawl_pages(self.run_id)
+            logger.info(f"Продолжение сбора {source} {self.run_id} от {self.data}, уже собрано "
+                        f"{sum(len(pages) for _, pages in self.completed_pages.values())} страниц.")
+            self.sink = database.DatabaseSink(self.run_id)
+
+    def start(self, projects: set[tuple[str, str]]) -> bool:
+        """ Записывает начало нового сбора, возвращает False, если ЖК не найдены. """
+        if not projects:
+            return False
+        self.projects = projects
+        self.run_id = database.start_crawl_run(self.source, self.data, projects)
+        self.sink = database.DatabaseSink(self.run_id)
+        return True
+
+    def add(self, page: services.Page) -> None:
+        """ Сохраняет страницу, при заполнении буфера данные записываются в базу данных. """
+        if page.fingerprint is not None:
+            self.new_fingerprints[page.project] = page.fingerprint
+        self.sink.add(page)
+
+    def finish(self) -> None:
+        """ Записывает оставшиеся данные и отпечатки ЖК, завершает сбор, если собраны все страницы. """
+        if self.sink is None:
+            return
+        self.sink.close()
+        # отпечаток сохраняем только у полностью собранных ЖК, иначе при следующем сборе
+        # недостающие страницы могут быть пропущены
+        incomplete_projects = database.get_incomplete_projects(self.run_id, self.projects)
+        database.save_fingerprints(self.source, {project: fingerprint
+                                                 for project, fingerprint in self.new_fingerprints.items()
+                                                 if project not in incomplete_projects})
+        if not incomplete_projects:
+            database.finish_crawl_run(self.run_id)
+        else:
+            logger.warning(f"Сбор {self.source} {self.run_id} от {self.data} собран не полностью, "
+                           f"будет продолжен при следующем запуске в тот же день.")
+
+
+def scrapping_with_checkpoints(source: str = 'pik'):
+    """
+    Собирает информацию одного застройщика в текущем процессе с сохранением
+    состояния после каждой записанной страницы (см. CrawlRun).
+    У неизменившихся с прошлого сбора ЖК запрашивается только первая страница (DELTA_CRAWL).
+
+    :param source: Застройщик из реестра парсеров (services.registry).
+    """
+    scrapper = get_scrapper(source)
+    run = CrawlRun(source)
+    if run.sink is None and not run.start(scrapper.get_all_projects(run.data)):
+        return
+
+    pages = scrapper.iter_pages(run.data, run.projects, run.completed_pages, run.fingerprints)
+    # сбор и запись идут вперемешку, время ожидания страниц и время записи считаем отдельно
+    while True:
+        with metrics.phase('crawl'):
+            page = next(pages, None)
+        if page is None:
+            break
+        with metrics.phase('save'):
+            run.add(page)
+    with metrics.phase('save'):
+        run.finish()
+
+
+def _crawl_worker(source: str, data: str, projects: set[tuple[str, str]] | None,
+                  completed_pages: dict[str, tuple[int, set[int]]], fingerprints: dict[str, services.Fingerprint],
+                  pages_queue: multiprocessing.Queue) -> None:
+    """
+    Собирает информацию одного застройщика в отдельном процессе и передает
+    сообщения (застройщик, вид, значение) в очередь процесса, который пишет в базу данных:
+    'projects' - найденные ЖК (только для нового сбора), 'page' - страница,
+    'archive' - записи индекса архива ответов (database/archive.py),
+    'done' - метрики процесса, всегда последнее сообщение.
+    """
+    metrics.reset()
+    archive.set_index_handler(lambda rows: pages_queue.put((source, 'archive', rows)))
+    try:
+        scrapper = get_scrapper(source)
+        if projects is None:
+            projects = scrapper.get_all_projects(data)
+            pages_queue.put((source, 'projects', projects))
+        if projects:
+            for page in scrapper.iter_pages(data, projects, completed_pages, fingerprints):
+                pages_queue.put((source, 'page', page))
+    except Exception:
+        logger.exception(f"Сбор {source} завершился ошибкой, будет продолжен при следующем запуске.")
+    finally:
+        pages_queue.put((source, 'done', metrics.get_state()))
+
+
+def scrapping_parallel(sources: list[str]) -> None:
+    """
+    Собирает информацию нескольких застройщиков одновременно, каждого в отдельном процессе
+    (не больше SCRAPPER_WORKERS одновременно). Страницы передаются через очередь
+    (не больше PAGES_QUEUE_SIZE страниц) в текущий процесс, который один пишет в базу данных
+    пачками по DB_CHUNK_SIZE квартир, так что запись в sqlite идет последовательно.
+
+    :param sources: Застройщики из реестра парсеров (services.registry).
+    """
+    context = multiprocessing.get_context()
+    pages_queue = context.Queue(maxsize=settings.PAGES_QUEUE_SIZE)
+    runs = {source: CrawlRun(source) for source in sources}
+    pending = list(sources)
+    workers = {}
+
+    while pending or workers:
+        while pending and len(workers) < settings.SCRAPPER_WORKERS:
+            run = runs[pending.pop(0)]
+            workers[run.source] = context.Process(
+                target=_crawl_worker, name=f'crawl_{run.source}',
+                args=(run.source, run.data, run.projects, run.completed_pages, run.fingerprints, pages_queue))
+            workers[run.source].start()
+
+        try:
+            with metrics.phase('crawl'):
+                source, kind, value = pages_queue.get(timeout=1)
+        except queue.Empty:
+            for source, worker in list(workers.items()):
+                if not worker.is_alive():      # процесс завершился, не отправив 'done'
+                    logger.error(f"Процесс сбора {source} аварийно завершился с кодом {worker.exitcode}.")
+                    del workers[source]
+                    with metrics.phase('save'):
+                        runs[source].finish()
+            continue
+
+        run = runs[source]
+        with metrics.phase('save'):
+            if kind == 'projects':
+                run.start(value)
+            elif kind == 'page':
+                run.add(value)
+            elif kind == 'archive':
+                archive.save_index(value)
+            elif kind == 'done':
+                metrics.merge(value, phase_prefix=f'{source}.')
+                workers.pop(source).join()
+                run.finish()
 
 
 def scrapping():
-    projects, flats, prices = pik_scrapper.run()
-    database.save_to_database('projects', projects)
-    database.save_to_database('flats', flats)
-    database.save_to_database('prices', prices)
-    database.remove_duplicates_in_prices_table()
+    """
+    Собирает информацию застройщиков SCRAPPERS и сохраняет ее в базу данных.
+    Метрики сбора записываются в отчеты в каталоге METRICS_PATH.
+    """
+    metrics.reset()
+    sources = list(settings.SCRAPPERS)
+    try:
+        with metrics.phase('total'):
+            if not settings.STREAM_TO_DATABASE:
+                for source in sources:
+                    with metrics.phase('crawl'):
+                        projects, flats, prices = get_scrapper(source).run()
+                    with metrics.phase('save'):
+                        database.save_to_database('projects', projects)
+                        database.save_to_database('flats', flats)
+                        database.save_to_database('prices', prices)
+                        database.refresh_search_index()
+            elif len(sources) > 1 and settings.SCRAPPER_WORKERS > 1:
+                scrapping_parallel(sources)
+            else:
+                for source in sources:
+                    try:
+                        scrapping_with_checkpoints(source)
+                    except Exception:   # ошибка одного застройщика не останавливает сбор остальных
+                        logger.exception(f"Сбор {source} завершился ошибкой, будет продолжен при следующем запуске.")
+            database.bump_data_version()
+            # проверяем подписки пользователей только по записанным за этот сбор ценам
+            with metrics.phase('subscriptions'):
+                subscriptions.evaluate_subscriptions()
+    finally:
+        if settings.METRICS_PATH:
+            json_path, _ = metrics.write_reports(settings.METRICS_PATH)
+            logger.info(f"Метрики сбора записаны в {json_path}, этапы: {metrics.report()['phases']}.")
 
 
 if __name__ == '__main__':
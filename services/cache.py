@@ -0,0 +1,128 @@
+"""
+Модуль содержит LRU кэш результатов с ограничением количества записей и их общего размера.
+
+Записи кэша действительны для одной версии данных (например, до следующего сбора),
+при смене версии кэш очищается. При удалении записи вызывается on_evict,
+например для удаления созданного для нее файла. Значение, полученное с pin=True,
+не передается в on_evict до вызова release, даже если запись за это время вытеснена:
+так файл ответа не удаляется, пока он отправляется пользователю.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUCache:
+    def __init__(self, max_entries: int, max_size: int, on_evict: Callable[[Any], None] = None):
+        """
+        LRU кэш, безопасный для использования из нескольких потоков.
+
+        :param max_entries: Максимальное количество записей.
+        :param max_size: Максимальный общий размер записей (в единицах, переданных в put, например в байтах).
+        :param on_evict: Функция, которой передается значение удаляемой записи.
+        """
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.version = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._pins: dict[Hashable, int] = {}        # {значение: количество pin без release}
+        self._evicted: set[Hashable] = set()        # вытесненные значения, on_evict которых ждет release
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def set_version(self, version: Hashable) -> None:
+        """ Задает версию данных, при ее изменении все записи удаляются. """
+        with self._lock:
+            if version != self.version:
+                self._clear()
+                self.version = version
+
+    def get(self, key: Hashable, default: Any = None, pin: bool = False) -> Any:
+        """
+        Возвращает значение записи и отмечает ее как последнюю использованную.
+
+        :param key: Ключ записи.
+        :param default: Значение, если записи нет.
+        :param pin: Не передавать значение в on_evict до вызова release.
+        """
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            value = self._entries[key][0]
+            if pin:
+                self._pin(value)
+            return value
+
+    def put(self, key: Hashable, value: Any, size: int = 1, pin: bool = False) -> bool:
+        """
+        Добавляет запись, при превышении ограничений удаляет давно не использованные записи.
+        Запись больше max_size не добавляется, on_evict для нее не вызывается:
+        значение остается у вызывающего, и он сам освобождает его ресурсы.
+
+        :param key: Ключ записи.
+        :param value: Значение.
+        :param size: Размер записи.
+        :param pin: Не передавать значение в on_evict до вызова release (только для добавленной записи).
+        :return: True - запись добавлена, False - не добавлена.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            if size > self.max_size or self.max_entries <= 0:
+                return False
+            if pin:
+                self._pin(value)
+            self._entries[key] = (value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_size:
+                self._evict(next(iter(self._entries)))
+            return True
+
+    def release(self, value: Hashable) -> bool:
+        """
+        Снимает pin значения, если запись уже вытеснена, передает значение в on_evict.
+
+        :param value: Значение, полученное из get или put с pin=True.
+        :return: False - значение не было закреплено (например, не добавлено в кэш).
+        """
+        with self._lock:
+            if value not in self._pins:
+                return False
+            pins = self._pins.pop(value) - 1
+            if pins > 0:
+                self._pins[value] = pins
+            elif value in self._evicted:
+                self._evicted.discard(value)
+                if self.on_evict is not None:
+                    self.on_evict(value)
+            return True
+
+    def _pin(self, value: Hashable) -> None:
+        self._pins[value] = self._pins.get(value, 0) + 1
+
+    def clear(self) -> None:
+        """ Удаляет все записи. """
+        with self._lock:
+            self._clear()
+
+    def _clear(self) -> None:
+        while self._entries:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: Hashable) -> None:
+        value, size = self._entries.pop(key)
+        self.size -= size
+        if value in self._pins:
+            self._evicted.add(value)
+        elif self.on_evict is not None:
+            self.on_evict(value)
@@ -1,13 +1,30 @@
 """
 Модуль содержит дата-классы представления собранных данных
 и класс для преобразования дата-класса в json объект.
+
+ЖК, квартиры и цены собираются сотнями тысяч, поэтому их дата-классы
+без __dict__ (__slots__) и умеют возвращать кортеж значений
+в порядке колонок таблицы (Flat.row(flat)) для записи в базу данных.
 """
 
-from dataclasses import dataclass, is_dataclass, asdict
+from dataclasses import dataclass, fields, is_dataclass, asdict
 from json import JSONEncoder
+from operator import attrgetter
 
 
-@dataclass
+def record(cls):
+    """
+    Декоратор дата-класса записи таблицы базы данных: создает дата-класс со __slots__,
+    добавляет кортеж названий полей (колонок) columns и функцию row(obj),
+    возвращающую кортеж значений полей в том же порядке.
+    """
+    cls = dataclass(slots=True)(cls)
+    cls.columns = tuple(field.name for field in fields(cls))
+    cls.row = staticmethod(attrgetter(*cls.columns))
+    return cls
+
+
+@record
 class Project:                  # Информация о ЖК
     project_id: int             # id ЖК
     city: str                   # Город в котором находится ЖК
@@ -21,7 +38,7 @@ class Project:                  # Информация о ЖК
     data_created: str           # дата сбора данных о ЖК с сайта
 
 
-@dataclass
+@record
 class Flat:                     # Информация о квартире
     flat_id: int                # id квартиры
     project_id: int             # id ЖК, которому принадлежит квартира
@@ -36,7 +53,7 @@ class Flat:                     # Информация о квартире
     data_created: str           # дата сбора данных о квартире с сайта
 
 
-@dataclass
+@record
 class Price:                    # Информация о цене
     price_id: int               # id квартиры, которой принадлежит данная цена
     benefit_name: str           # Название ценового предложения
@@ -47,12 +64,35 @@ class Price:                    # Информация о цене
     data_created: str           # дата сбора данных о цене с сайта
 
 
+@record
+class Fingerprint:              # Отпечаток первой страницы api ЖК, по нему определяется, изменился ли ЖК
+    flats_count: int            # Количество квартир в ЖК
+    digest: str                 # Хэш id, цен и статусов бронирования квартир первой страницы
+    etag: str                   # Заголовок ETag ответа api
+    last_modified: str          # Заголовок Last-Modified ответа api
+    full_crawled: str           # Дата последнего сбора всех страниц ЖК
+
+
+@dataclass
+class Page:                     # Одна страница api с квартирами ЖК
+    project: str                # id ЖК из списка проектов, по которому запрошена страница
+    flat_page: int              # Номер страницы
+    total_pages: int            # Всего страниц у ЖК, которые нужно собрать
+    projects: list[Project]     # Информация о ЖК (только на первой странице)
+    flats: list[Flat]           # Квартиры на странице
+    prices: list[Price]         # Цены квартир на странице
+    fingerprint: Fingerprint = None     # Отпечаток ЖК (только на первой странице)
+    parse_seconds: float = 0.0          # Время разбора ответа api (для метрик сбора)
+
+
 class JsonDataclassEncoder(JSONEncoder):
     """
     Используется для преобразования дата-класса в json объект.
     Пример json.dumps(dataclass, ensure_ascii=False, cls=JsonDataclassEncoder).
     """
     def default(self, obj):
+        if hasattr(obj, 'row'):
+            return dict(zip(obj.columns, obj.row(obj)))
         if is_dataclass(obj):
             return asdict(obj)
         return super().default(obj)
@@ -0,0 +1,246 @@
+"""
+Модуль загрузки страниц.
+
+Содержит ограничитель частоты запросов (token bucket), который
+замедляется при ответах 429/5xx и заголовке Retry-After, и класс Fetcher
+с общим пулом keep-alive соединений и экспоненциальной задержкой
+со случайным разбросом (jitter) между повторными попытками.
+Время ответов, коды ответов, загруженные байты и повторные попытки
+записываются в метрики сбора (services.metrics).
+"""
+
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from random import choice, uniform
+from time import monotonic, perf_counter, sleep
+from typing import Mapping
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from settings import LOGGER_LEVEL
+from .logger import init_logger
+from .metrics import metrics, SIZE_BUCKETS
+
+logger = init_logger(__name__, LOGGER_LEVEL)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)  # ответы, после которых имеет смысл повторить запрос
+
+
+class TokenBucket:
+    def __init__(self, rate: float, min_rate: float, max_rate: float, capacity: float = 1):
+        """
+        Адаптивный ограничитель частоты запросов.
+        Скорость уменьшается вдвое при каждом ответе 429/5xx
+        и плавно восстанавливается после успешных запросов.
+
+        :param rate: Начальная скорость, запросов в секунду.
+        :param min_rate: Минимальная скорость, запросов в секунду.
+        :param max_rate: Максимальная скорость, запросов в секунду.
+        :param capacity: Максимальное количество накопленных токенов (размер всплеска).
+        """
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Забирает один токен и возвращает время ожидания
+        в секундах, по истечении которого можно выполнить запрос.
+        """
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._blocked_until - now)
+
+    def slow_down(self, retry_after: float | None = None) -> None:
+        """
+        Уменьшает скорость запросов.
+
+        :param retry_after: Пауза в секундах из заголовка Retry-After,
+                            до ее окончания запросы не выполняются.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self._blocked_until = max(self._blocked_until, monotonic() + retry_after)
+
+    def speed_up(self) -> None:
+        """ Плавно увеличивает скорость запросов после успешного ответа. """
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.min_rate / 10)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Возвращает задержку перед повторной попыткой,
+    экспоненциальная задержка с полным случайным разбросом (full jitter).
+
+    :param attempt: Номер попытки, начиная с 0.
+    :param base: Базовая задержка в секундах.
+    :param cap: Максимальная задержка в секундах.
+    :return: Задержка в секундах.
+    """
+    return uniform(0, min(cap, base * 2 ** attempt))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Разбирает заголовок Retry-After (количество секунд или HTTP-дата).
+
+    :param value: Значение заголовка.
+    :return: Пауза в секундах или None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _observe_response(status: int, seconds: float, size: int) -> None:
+    """ Записывает в метрики время, код и размер ответа. """
+    metrics.observe('http_request_seconds', seconds)
+    metrics.observe('http_response_bytes', size, SIZE_BUCKETS)
+    metrics.inc('http_responses_total', status=status)
+    metrics.inc('http_downloaded_bytes_total', size)
+
+
+def _observe_error(ex: Exception, seconds: float) -> None:
+    """ Записывает в метрики время и тип исключения запроса. """
+    metrics.observe('http_request_seconds', seconds)
+    metrics.inc('http_errors_total', error=type(ex).__name__)
+
+
+class Fetcher:
+    def __init__(self, headers: dict, user_agents: list[str], rate_limiter: TokenBucket,
+                 max_retries: int, backoff_base: float, backoff_max: float,
+                 timeout: float, pool_size: int):
+        """
+        Загружает страницы через общий пул keep-alive соединений.
+
+        :param headers: Заголовки запросов.
+        :param user_agents: Список User-Agent, для сессии выбирается один.
+        :param rate_limiter: Ограничитель частоты запросов.
+        :param max_retries: Количество повторных попыток.
+        :param backoff_base: Базовая задержка между попытками в секундах.
+        :param backoff_max: Максимальная задержка между попытками в секундах.
+        :param timeout: Таймаут запроса в секундах.
+        :param pool_size: Размер пула соединений к одному хосту.
+        """
+        self.headers = headers | {'User-Agent': choice(user_agents)}
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _retry_delay(self, attempt: int, status: int | None, retry_after: str | None) -> float | None:
+        """
+        Возвращает задержку перед следующей попыткой
+        или None, если повторять запрос не нужно.
+
+        :param attempt: Номер текущей попытки, начиная с 0.
+        :param status: Код ответа или None, если запрос завершился исключением.
+        :param retry_after: Значение заголовка Retry-After.
+        """
+        if attempt >= self.max_retries or (status is not None and status not in RETRY_STATUSES):
+            return None
+        metrics.inc('http_retries_total')
+        delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+        if status is not None:
+            pause = parse_retry_after(retry_after)
+            self.rate_limiter.slow_down(pause)
+            delay = max(delay, pause or 0)
+        return delay
+
+    def get(self, url: str, params: dict | str = None, headers: dict = None) -> requests.Response | None:
+        """
+        Выполняет GET запрос с повторными попытками.
+
+        :param url: URL-адрес.
+        :param params: Дополнительные параметры.
+        :param headers: Дополнительные заголовки, например для условного запроса (If-None-Match).
+        :return: :class:`Response <Response>` object (с кодом 200 или 304) или None.
+        """
+        for attempt in range(self.max_retries + 1):
+            sleep(self.rate_limiter.reserve())
+            status = retry_after = None
+            start = perf_counter()
+            try:
+                rq = self.session.get(url, params=params, headers=headers, timeout=self.timeout)
+                status, retry_after = rq.status_code, rq.headers.get('Retry-After')
+                _observe_response(status, perf_counter() - start, len(rq.content))
+                if status in (200, 304):
+                    logger.debug(f"{status}: {url}")
+                    self.rate_limiter.speed_up()
+                    return rq
+                logger.error(f"{status}: {url}")
+            except requests.RequestException as ex:
+                _observe_error(ex, perf_counter() - start)
+                logger.error(f"Запрос {url} вызвал исключение {ex}")
+
+            delay = self._retry_delay(attempt, status, retry_after)
+            if delay is None:
+                break
+            sleep(delay)
+        return None
+
+    async def get_async(self, session: aiohttp.ClientSession, url: str,
+                        headers: dict = None) -> tuple[int, Mapping[str, str], bytes | None] | None:
+        """
+        Асинхронно выполняет GET запрос с повторными попытками,
+        использует тот же ограничитель частоты запросов.
+
+        :param session: Сессия aiohttp.
+        :param url: URL-адрес.
+        :param headers: Дополнительные заголовки, например для условного запроса (If-None-Match).
+        :return: Кортеж (код ответа 200 или 304, заголовки ответа, тело ответа или None для 304)
+                 или None.
+        """
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.rate_limiter.reserve())
+            status = retry_after = None
+            start = perf_counter()
+            try:
+                async with session.get(url, headers=self.headers | (headers or {})) as rq:
+                    status, retry_after = rq.status, rq.headers.get('Retry-After')
+                    if status in (200, 304):
+                        logger.debug(f"{status}: {url}")
+                        self.rate_limiter.speed_up()
+                        body = await rq.read() if status == 200 else None
+                        _observe_response(status, perf_counter() - start, len(body or b''))
+                        return status, rq.headers, body
+                    _observe_response(status, perf_counter() - start, 0)
+                    logger.error(f"{status}: {url}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                _observe_error(ex, perf_counter() - start)
+                logger.error(f"Запрос {url} вызвал исключение {ex!r}")
+
+            delay = self._retry_delay(attempt, status, retry_after)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        return None
@@ -0,0 +1,233 @@
+"""
+Модуль метрик сбора: счетчики и гистограммы времени и размера.
+
+Метрики собираются в общем объекте metrics из всех потоков (асинхронный сбор
+работает в отдельном потоке) и после сбора записываются в отчет в формате json
+и в текстовом формате Prometheus (файл можно отдавать через textfile collector
+node_exporter). По отчету видно, на что уходит время сбора: загрузку страниц,
+их разбор или запись в базу данных.
+
+Пример:
+    with metrics.timer('db_write_seconds', table='prices'):
+        ...
+    metrics.inc('db_rows_total', 1000, table='prices', result='inserted')
+"""
+
+import json
+import os
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+from typing import Iterator
+
+__all__ = ['Metrics', 'metrics']
+
+PREFIX = 'flatscrapper_'    # префикс названий метрик в формате Prometheus
+
+# верхние границы интервалов гистограмм
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        """ Гистограмма: количество значений в интервалах, их сумма, минимум и максимум. """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # последний интервал - больше всех границ (+Inf)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> float | None:
+        """ Возвращает оценку квантиля: верхнюю границу интервала, в который он попадает. """
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def merge(self, other: 'Histogram') -> None:
+        """ Добавляет значения другой гистограммы с теми же интервалами. """
+        self.counts = [count + other_count for count, other_count in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def to_dict(self) -> dict:
+        return {'count': self.count, 'sum': round(self.sum, 6), 'min': self.min, 'max': self.max,
+                'avg': round(self.sum / self.count, 6) if self.count else None,
+                'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+
+class Metrics:
+    def __init__(self):
+        """ Набор метрик, безопасный для использования из нескольких потоков. """
+        self.started = datetime.now()
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.phases: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reset(self) -> None:
+        """ Удаляет все значения, например перед следующим сбором. """
+        with self._lock:
+            self.started = datetime.now()
+            self.counters.clear()
+            self.histograms.clear()
+            self.phases.clear()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """ Увеличивает счетчик name с метками labels на value. """
+        key = _get_key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple[float, ...] = TIME_BUCKETS, **labels) -> None:
+        """ Добавляет значение в гистограмму name с метками labels. """
+        key = _get_key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """ Добавляет время выполнения блока with в секундах в гистограмму name. """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """ Записывает время выполнения этапа сбора в секундах, повторные вызовы суммируются. """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0.0) + perf_counter() - start
+
+    def get_state(self) -> tuple[dict, dict, dict]:
+        """ Возвращает копию значений (счетчики, гистограммы, этапы) для передачи в другой процесс. """
+        with self._lock:
+            return dict(self.counters), dict(self.histograms), dict(self.phases)
+
+    def merge(self, state: tuple[dict, dict, dict], phase_prefix: str = '') -> None:
+        """
+        Добавляет значения, собранные в другом процессе (см. get_state).
+
+        :param state: Кортеж (счетчики, гистограммы, этапы).
+        :param phase_prefix: Префикс названий этапов, например застройщик.
+        """
+        counters, histograms, phases = state
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, histogram in histograms.items():
+                if key in self.histograms:
+                    self.histograms[key].merge(histogram)
+                else:
+                    self.histograms[key] = histogram
+            for name, seconds in phases.items():
+                self.phases[phase_prefix + name] = self.phases.get(phase_prefix + name, 0.0) + seconds
+
+    def report(self) -> dict:
+        """ Возвращает отчет со всеми метриками в виде словаря (для записи в json). """
+        with self._lock:
+            counters, histograms = {}, {}
+            for (name, labels), value in sorted(self.counters.items()):
+                counters.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+            for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                histograms.setdefault(name, []).append({'labels': dict(labels)} | histogram.to_dict())
+            return {'started': self.started.isoformat(sep=' ', timespec='seconds'),
+                    'finished': datetime.now().isoformat(sep=' ', timespec='seconds'),
+                    'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                    'counters': counters,
+                    'histograms': histograms}
+
+    def to_prometheus(self) -> str:
+        """ Возвращает метрики в текстовом формате Prometheus. """
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                lines.extend(f"{PREFIX}{name}{_format_labels(labels)} {value}"
+                             for (counter, labels), value in sorted(self.counters.items()) if counter == name)
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for (histogram_name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+                    if histogram_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, '+Inf'), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', str(bound)), ))} "
+                                     f"{cumulative}")
+                    lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {histogram.count}")
+            if self.phases:
+                lines.append(f"# TYPE {PREFIX}phase_seconds gauge")
+                lines.extend(f'{PREFIX}phase_seconds{{phase="{phase}"}} {seconds}'
+                             for phase, seconds in self.phases.items())
+            lines.append(f"# TYPE {PREFIX}run_started_timestamp_seconds gauge")
+            lines.append(f"{PREFIX}run_started_timestamp_seconds {self.started.timestamp()}")
+        return '\n'.join(lines) + '\n'
+
+    def write_reports(self, path: str) -> tuple[str, str]:
+        """
+        Записывает отчет в формате json (отдельный файл для каждого сбора)
+        и в формате Prometheus (файл metrics.prom перезаписывается).
+
+        :param path: Каталог для отчетов.
+        :return: Кортеж (путь к json отчету, путь к файлу Prometheus).
+        """
+        os.makedirs(path, exist_ok=True)
+        json_path = os.path.join(path, f"metrics_{self.started.strftime('%Y_%m_%d__%H_%M_%S')}.json")
+        with open(json_path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, ensure_ascii=False, indent=4)
+
+        # запись во временный файл и переименование, чтобы не прочитали наполовину записанный файл
+        prometheus_path = os.path.join(path, 'metrics.prom')
+        with open(prometheus_path + '.part', 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.replace(prometheus_path + '.part', prometheus_path)
+        return json_path, prometheus_path
+
+
+def _get_key(name: str, labels: dict) -> tuple[str, Labels]:
+    """ Возвращает ключ метрики: название и отсортированные метки. """
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    """ Возвращает метки в формате Prometheus: {name="value",...}. """
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+
+metrics = Metrics()     # метрики текущего сбора
@@ -0,0 +1,66 @@
+"""
+Модуль реестра парсеров застройщиков.
+
+Парсер - модуль с названием застройщика SOURCE и функциями get_all_projects, iter_pages, parse_payload и run
+(интерфейс Scrapper, пример - pik.pik_scrapper). Модули импортируются при первом обращении,
+поэтому парсеры выключенных застройщиков (settings.SCRAPPERS) не загружаются.
+
+Новый застройщик добавляется в SCRAPPERS или функцией register:
+    register('samolet', 'samolet.samolet_scrapper')
+"""
+
+import importlib
+from typing import Iterator, Protocol
+
+from .data_classes import Project, Flat, Price, Page, Fingerprint
+
+__all__ = ['Scrapper', 'SCRAPPERS', 'register', 'get_scrapper']
+
+
+class Scrapper(Protocol):
+    SOURCE: str     # застройщик, используется для сохранения состояния сбора
+
+    def get_all_projects(self, data: str = None) -> set[tuple[str, str]]:
+        """ Возвращает id и название всех ЖК застройщика (data - дата сбора) или пустое множество при ошибке. """
+
+    def iter_pages(self, data: str = None, all_projects: set[tuple[str, str]] = None,
+                   completed_pages: dict[str, tuple[int, set[int]]] = None,
+                   fingerprints: dict[str, Fingerprint] = None) -> Iterator[Page]:
+        """ Возвращает страницы с квартирами по мере их сбора (см. pik_scrapper.iter_pages). """
+
+    def parse_payload(self, data: str, project: str, flat_page: int, raw: bytes) -> Page | None:
+        """ Разбирает сохраненный в архиве ответ со страницей квартир (см. database/archive.py). """
+
+    def run(self) -> tuple[list[Project], list[Flat], list[Price]]:
+        """ Собирает всю информацию и возвращает списки ЖК, квартир и цен. """
+
+
+# застройщик: модуль парсера
+SCRAPPERS: dict[str, str] = {
+    'pik': 'pik.pik_scrapper',
+}
+
+
+def register(source: str, module: str) -> None:
+    """
+    Добавляет парсер застройщика в реестр.
+
+    :param source: Застройщик, должен совпадать с SOURCE модуля.
+    :param module: Путь к модулю парсера, например 'pik.pik_scrapper'.
+    """
+    SCRAPPERS[source] = module
+
+
+def get_scrapper(source: str) -> Scrapper:
+    """
+    Возвращает модуль парсера застройщика.
+
+    :param source: Застройщик.
+    :return: Модуль с интерфейсом Scrapper.
+    """
+    if source not in SCRAPPERS:
+        raise ValueError(f"Неизвестный застройщик '{source}', доступны: {', '.join(SCRAPPERS)}.")
+    scrapper = importlib.import_module(SCRAPPERS[source])
+    if getattr(scrapper, 'SOURCE', None) != source:
+        raise ValueError(f"Модуль {SCRAPPERS[source]} не является парсером застройщика '{source}'.")
+    return scrapper
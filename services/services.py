@@ -4,10 +4,14 @@
 и/или разгружают основной код.
 """
 
+import csv
+import gzip
 import json
+import os
 import xlsxwriter
 from datetime import datetime
-from typing import Any, Union
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator, Union
 
 from .data_classes import JsonDataclassEncoder
 
@@ -42,20 +46,63 @@ def get_value_from_json(json_data: Union[list, dict], keys: list) -> Any:
                 return None
 
 
-def save_to_excel_file(data: list[tuple], file_name: str) -> None:
+def compile_json_extractor(paths: dict[str, list]) -> Callable[[list], list[tuple]]:
+    """
+    Компилирует набор путей к значениям json в функцию, которая за один проход
+    преобразует список объектов json в список кортежей значений (в порядке полей paths).
+    Как и get_value_from_json, при отсутствии ключа в dict или IndexError для list возвращает None,
+    но не строит списки ключей и не вызывает себя рекурсивно для каждого значения.
+
+    Пример:
+        extract = compile_json_extractor({'price': ['price'], 'bulk': ['bulk', 'name']})
+        extract([{'price': 100, 'bulk': {'name': 'Корпус 1'}}, {}])  # [(100, 'Корпус 1'), (None, None)]
+
+    :param paths: Словарь {'название поля': список ключей, по которым лежит значение}.
+                  Ключи - строки (для dict) или целые числа (для list).
+    :return: Функция, принимающая список объектов json.
+    """
+    lines = ['def extract(items):',
+             '    result = []',
+             '    append = result.append',
+             '    for item in items:']
+    for number, (field, keys) in enumerate(paths.items()):
+        if not keys or not all(isinstance(key, (str, int)) for key in keys):
+            raise ValueError(f"Некорректный путь к полю '{field}': {keys!r}")
+        lines += ['        try:',
+                  f"            v{number} = item{''.join(f'[{key!r}]' for key in keys)}",
+                  '        except (KeyError, IndexError, TypeError):',
+                  f'            v{number} = None']
+    lines += [f"        append(({''.join(f'v{number}, ' for number in range(len(paths)))}))",
+              '    return result']
+
+    namespace = {}
+    exec(compile('\n'.join(lines), f'<json extractor {", ".join(paths)}>', 'exec'), namespace)
+    return namespace['extract']
+
+
+FLATS_HEAD = ('id', 'ЖК', 'Город', 'Адрес', 'Корпус', 'Количество комнат', 'Площадь', 'Этаж', 'Отделка', 'Заселение',
+              'Цена', 'Цена за метр', 'Бронь', 'Дата изменения цены', 'Ценовое предложение', 'Описание предложения',
+              'Ссылка')
+
+
+def save_to_excel_file(data: Iterable[tuple], file_name: str, head: tuple[str, ...] = FLATS_HEAD) -> int:
     """
     Сохраняет полученную из базы данных информацию в excel таблицу.
+    Строки записываются по мере получения (режим constant_memory xlsxwriter),
+    поэтому data может быть генератором строк из курсора базы данных любого размера.
+    Файл сначала пишется во временный и переименовывается после записи.
 
-    :param data: Информация из базы данных.
+    :param data: Информация из базы данных (список или генератор кортежей).
     :param file_name: Путь и имя excel файла (расширение будет добавлено автоматически).
-    :return: None.
+    :param head: Заголовок таблицы, по умолчанию для информации о квартирах.
+    :return: Количество записанных строк без заголовка.
     """
-    head = ('id', 'ЖК', 'Город', 'Адрес', 'Корпус', 'Количество комнат', 'Площадь', 'Этаж', 'Отделка', 'Заселение',
-            'Цена', 'Цена за метр', 'Бронь', 'Дата изменения цены', 'Ценовое предложение', 'Описание предложения',
-            'Ссылка')
+    temp_file_name = file_name + '.xlsx.part'
 
     # Создает Excel file и добавляет лист (worksheet).
-    workbook = xlsxwriter.Workbook(file_name + '.xlsx')
+    # ссылки записываются как строки: гиперссылки xlsxwriter хранит в памяти до закрытия файла,
+    # и excel допускает не больше 65 530 гиперссылок на листе
+    workbook = xlsxwriter.Workbook(temp_file_name, {'constant_memory': True, 'strings_to_urls': False})
     worksheet = workbook.add_worksheet()
 
     # Добавляем формат шрифта для выделения заголовка таблицы
@@ -64,11 +111,43 @@ def save_to_excel_file(data: list[tuple], file_name: str) -> None:
     worksheet.write_row(0, 0, head, bold)
 
     # Пишем остальные данные обычным шрифтом
-    row = 1
-    for item in data:
+    row = 0
+    for row, item in enumerate(data, start=1):
         worksheet.write_row(row, 0, item)
-        row += 1
     workbook.close()
+    os.replace(temp_file_name, file_name + '.xlsx')
+    return row
+
+
+def save_to_csv_file(data: Iterable[tuple], file_name: str, head: tuple[str, ...] = FLATS_HEAD) -> int:
+    """
+    Сохраняет полученную из базы данных информацию в сжатый csv файл (.csv.gz),
+    строки записываются по мере получения. Для больших выборок файл
+    создается быстрее и занимает меньше места, чем excel таблица.
+
+    :param data: Информация из базы данных (список или генератор кортежей).
+    :param file_name: Путь и имя файла (расширение будет добавлено автоматически).
+    :param head: Заголовок таблицы, по умолчанию для информации о квартирах.
+    :return: Количество записанных строк без заголовка.
+    """
+    temp_file_name = file_name + '.csv.gz.part'
+    rows = 0
+    # utf-8-sig - чтобы excel правильно определил кодировку при открытии
+    with gzip.open(temp_file_name, 'wt', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(head)
+        for chunk in batched(data, 1000):
+            writer.writerows(chunk)
+            rows += len(chunk)
+    os.replace(temp_file_name, file_name + '.csv.gz')
+    return rows
+
+
+def batched(data: Iterable, size: int) -> Iterator[list]:
+    """ Возвращает данные частями по size элементов. """
+    iterator = iter(data)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
 
 
 def get_data_time(fmt: str = '%Y_%m_%d__%H_%M_%S') -> str:
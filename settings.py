@@ -19,3 +19,59 @@ USER_AGENTS = ['Mozilla/5.0 (Windows NT 5.1) AppleWebKit/537.36 (KHTML, like Gec
 HEADERS = {
     'User-Agent': '',
     'Accept': '*/*'}
+
+# адреса сайта застройщика, для воспроизведения сбора без сайта заменяются
+# на адрес локального сервера (benchmarks/replay_server.py)
+PIK_PROJECTS_URL = 'https://www.pik.ru/projects'    # страница с проектами
+PIK_API_URL = 'https://api.pik.ru/v2/filter'        # api с квартирами
+
+SCRAPPERS = ('pik', )                   # застройщики, информация которых собирается (services/registry.py)
+SCRAPPER_WORKERS = 4                    # процессов для одновременного сбора нескольких застройщиков, 1 - по очереди
+
+# Асинхронный сбор информации (asyncio + aiohttp), страницы запрашиваются одновременно
+ASYNC_CRAWL = False
+MAX_CONCURRENT_REQUESTS = 10            # одновременных запросов всего
+MAX_CONCURRENT_REQUESTS_PER_HOST = 4    # одновременных запросов к одному хосту
+REQUEST_TIMEOUT = 60                    # секунд на один запрос
+PAGES_QUEUE_SIZE = 20                   # собранных, но еще не сохраненных страниц
+PARSE_WORKERS = 2                       # процессов для разбора ответов api, 0 - разбор в основном процессе
+PARSE_QUEUE_SIZE = 10                   # страниц, ожидающих разбора
+
+# Загрузка страниц: пул соединений, ограничение частоты запросов и повторные попытки
+REQUESTS_PER_SECOND = 1.0               # начальная скорость запросов
+MIN_REQUESTS_PER_SECOND = 0.1           # скорость снижается до нее при ответах 429/5xx
+MAX_REQUESTS_PER_SECOND = 5.0           # и восстанавливается не выше этой
+MAX_RETRIES = 5                         # повторных попыток
+BACKOFF_BASE = 1.0                      # секунд, базовая задержка между попытками
+BACKOFF_MAX = 60.0                      # секунд, максимальная задержка между попытками
+
+DB_CHUNK_SIZE = 1000                    # записей в одной транзакции при сохранении в базу данных
+
+STREAM_TO_DATABASE = True               # сохранять квартиры в базу данных по мере сбора, а не после него
+CHECKPOINT_MAX_AGE_DAYS = 0             # прерванный сбор старше этого количества дней не продолжается (0 - только сегодняшний)
+DELTA_CRAWL = False                     # у неизменившихся с прошлого сбора ЖК (по отпечатку первой страницы) запрашивать только первую страницу
+DELTA_FULL_CRAWL_DAYS = 7               # но не реже, чем раз в столько дней собирать ЖК полностью: изменения цен на остальных страницах видны с этой задержкой
+METRICS_PATH = 'logs/metrics'           # каталог для отчетов с метриками сбора (json и Prometheus), None - не записывать
+ARCHIVE = True                          # сохранять ответы сайта застройщика в сжатый архив для повторного разбора
+ARCHIVE_PATH = 'archive'                # каталог сегментов архива (database/archive.py)
+ARCHIVE_SEGMENT_SIZE = 64 * 2 ** 20     # байт, после которых начинается новый сегмент
+ARCHIVE_COMPRESSION_LEVEL = 6           # уровень сжатия gzip: 1 - быстрее, 9 - меньше
+
+# Планировщик сбора (scheduler.py): ЖК собираются по приоритету вместо ежедневного сбора всех ЖК
+SCHEDULER_INTERVAL = 600                # секунд между циклами сбора
+SCHEDULER_REQUESTS_PER_HOUR = 600       # запросов в час ко всем застройщикам
+SCHEDULER_MIN_INTERVAL = 1              # часов, ЖК собирается не чаще
+SCHEDULER_MAX_INTERVAL = 72             # часов, ЖК собирается не реже
+SCHEDULER_HISTORY_DAYS = 14             # дней истории цен для расчета частоты изменений ЖК
+SCHEDULER_PROJECTS_INTERVAL = 24        # часов между обновлениями списка ЖК
+
+EXPORT_PATH = 'export'                  # каталог для выгрузки таблиц в колоночном формате (database/export.py)
+EXPORT_CHUNK_SIZE = 100_000             # строк, читаемых из базы данных за один раз при выгрузке
+
+NOTIFICATIONS_INTERVAL = 60             # секунд между проверками неотправленных уведомлений телеграм ботом
+BOT_DB_WORKERS = 4                      # потоков телеграм бота для запросов к базе данных и создания файлов
+BOT_MAX_PENDING_COMMANDS = 16           # команд в обработке, при превышении бот просит повторить позже
+BOT_CACHE_ENTRIES = 256                 # ответов телеграм бота в кэше (до следующего сбора)
+BOT_CACHE_SIZE = 200 * 2 ** 20          # байт, общий размер ответов и excel файлов в кэше
+NEAR_RADIUS_KM = 3                      # км, радиус поиска квартир рядом с отправленной телеграм боту геопозицией
+REPORT_FORMAT = 'xlsx'                  # формат файлов телеграм бота по умолчанию: 'xlsx' или 'csv' (csv.gz, быстрее и меньше)
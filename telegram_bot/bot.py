@@ -7,24 +7,44 @@
 Город - для получения списка доступных городов.
 Квартиры "Название города" или "%" для выбора всех городов
         "Название ЖК или %" "Количество комнат" "Максимальная цена"
-        "Год заселения" "Отделка (0 или 1)" "Бронь (active или %)".
+        "Год заселения" "Отделка (0 или 1)" "Бронь (active или %)" ["Формат (xlsx или csv)"].
         Например: Квартиры %Москв% % 1 10000000 2024 1 active.
+        Формат csv (сжатый csv.gz) создается быстрее и занимает меньше места для больших выборок.
 Квартира id - для получения информации по выбранной квартире, включая статистику изменения цены
         (id квартиры можно узнать из предыдущей команды "Квартиры ...").
+Снижение "Дней" ["Количество"] - квартиры с наибольшим снижением цены за указанное количество дней.
+Медиана "id ЖК" ["Дней"] - медиана цены за метр по количеству комнат и отделке на каждую дату.
+Бронь ["Дней"] - смены статуса бронирования по датам.
+Изменения "Дней" ["id квартиры"] - изменения цен всех квартир или одной квартиры за указанное количество дней.
+Рядом "Широта" "Долгота" ["Радиус, км"] - свободные квартиры в ЖК рядом с точкой, ближайшие первыми,
+        также обрабатывается отправленная боту геопозиция.
+Область "Мин. широта" "Мин. долгота" "Макс. широта" "Макс. долгота" - свободные квартиры в ЖК внутри области.
+Поиск "Слова" - свободные квартиры по словам в названии, городе и метро ЖК, адресе и ценовом предложении,
+        окончания слов не учитываются. Например: Поиск Кузьминки ипотека.
+Подписка "параметры как у команды Квартиры" - присылать новые и подешевевшие квартиры после каждого сбора.
+Подписки - список подписок.
+Отписка id - удалить подписку.
 """
 
 import os
+import html
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
+from operator import itemgetter
 
 from aiogram import Bot, types
 from aiogram.dispatcher import Dispatcher
 from aiogram.utils import executor
+from aiogram.utils.exceptions import BotBlocked, ChatNotFound, TelegramAPIError, UserDeactivated
 
-from settings import LOGGER_LEVEL
+from settings import LOGGER_LEVEL, NOTIFICATIONS_INTERVAL, BOT_DB_WORKERS, BOT_MAX_PENDING_COMMANDS
 import services.logger
+from database import subscriptions
 
 from .middlewares import AccessMiddleware
-from .commands import parse_command
+from .commands import get_answer, release_answer
 
 
 bot_logger = services.logger.init_logger(__name__, LOGGER_LEVEL)
@@ -35,10 +55,36 @@ dp = Dispatcher(bot)                                # handler
 dp.middleware.setup(AccessMiddleware((int(os.getenv('ACCESS_ID')), )))  # фильтр по токену tulpe[int]
 
 hello_msg = """<b>Привет!</b>\n<b>Набери:</b>\n<b>квартира</b> "id" - для получения статистики по выбранной квартире;
-<b>квартиры</b> "Город или %" "Название ЖК или %" "Количество комнат" "Максимальная цена" "Год заселения" "Отделка (0 или 1)" "Бронь (active или %)"
+<b>квартиры</b> "Город или %" "Название ЖК или %" "Количество комнат" "Максимальная цена" "Год заселения" "Отделка (0 или 1)" "Бронь (active или %)" ["Формат (xlsx или csv)"]
 Например: <i>Квартиры %Москв% % 1 10000000 2024 1 active</i>
 <b>Город</b> - для получения списка доступных городов;
-<b>ЖК</b> - для получения списка доступных ЖК."""
+<b>ЖК</b> - для получения списка доступных ЖК;
+<b>снижение</b> "Дней" ["Количество"] - квартиры с наибольшим снижением цены;
+<b>медиана</b> "id ЖК" ["Дней"] - медиана цены за метр по комнатам и отделке;
+<b>бронь</b> ["Дней"] - смены статуса бронирования;
+<b>изменения</b> "Дней" ["id квартиры"] - изменения цен квартир;
+<b>рядом</b> "Широта" "Долгота" ["Радиус, км"] или отправьте геопозицию - свободные квартиры рядом;
+<b>область</b> "Мин. широта" "Мин. долгота" "Макс. широта" "Макс. долгота" - свободные квартиры в области;
+<b>поиск</b> "Слова" - свободные квартиры по названию, городу и метро ЖК, адресу и ценовому предложению;
+<b>подписка</b> с параметрами как у команды <b>квартиры</b> - присылать новые и подешевевшие квартиры;
+<b>подписки</b> - список подписок, <b>отписка</b> "id" - удалить подписку."""
+
+NOTIFICATIONS_IN_MESSAGE = 20   # квартир в одном сообщении с уведомлениями
+LOCATION_PRECISION = 4          # знаков координат геопозиции (~10 м), близкие геопозиции используют кэш ответов
+
+# запросы к базе данных и создание excel файлов выполняются в пуле потоков, чтобы не блокировать бота,
+# у каждого потока свое соединение с базой данных (см. db_sqlite.get_connection)
+db_executor = ThreadPoolExecutor(max_workers=BOT_DB_WORKERS, thread_name_prefix='bot_db')
+db_semaphore = asyncio.Semaphore(BOT_MAX_PENDING_COMMANDS)
+
+# задача отправки уведомлений: цикл событий хранит только слабую ссылку на задачу
+notifications_task: asyncio.Task | None = None
+
+
+async def run_in_db_pool(function, *args):
+    """ Выполняет функцию в пуле потоков базы данных, одновременно не больше BOT_MAX_PENDING_COMMANDS. """
+    async with db_semaphore:
+        return await asyncio.get_running_loop().run_in_executor(db_executor, function, *args)
 
 
 @dp.message_handler(commands=['start', 'help', 'Start', 'Help'])
@@ -50,23 +96,94 @@ async def start_command(message: types.Message):
 async def execute_the_command(message: types.Message):
     command = message.text.split(" ")
     bot_logger.info(f"{message.from_user.id}: {command}")
+    await _answer_command(message, command)
+
 
-    answer = parse_command(command)
-    if isinstance(answer, str):
-        await message.answer(parse_command(command))
-    elif isinstance(answer, tuple):
-        if answer[0] == 'send_file':
-            with open(answer[1] + '.xlsx', 'rb') as file:
-                await bot.send_document(message.chat.id, document=file)
-                os.remove(answer[1] + '.xlsx')
-        elif answer[0] == 'unknown command':
-            await message.answer("<b>Команда не распознана.</b>\n" + hello_msg,
-                                 parse_mode=types.ParseMode.HTML)
+@dp.message_handler(content_types=types.ContentType.LOCATION)
+async def search_near_location(message: types.Message):
+    """ Отправленная геопозиция обрабатывается как команда "рядом широта долгота". """
+    command = ['рядом', str(round(message.location.latitude, LOCATION_PRECISION)),
+               str(round(message.location.longitude, LOCATION_PRECISION))]
+    bot_logger.info(f"{message.from_user.id}: {command}")
+    await _answer_command(message, command)
+
+
+async def _answer_command(message: types.Message, command: list[str]):
+    """ Отправляет пользователю ответ на команду: сообщение или файл. """
+    if db_semaphore.locked():
+        await message.answer("Бот занят, повторите команду позже.")
+        return
+    answer = await run_in_db_pool(get_answer, command, message.chat.id)
+    try:
+        if isinstance(answer, str):
+            await message.answer(answer)
+        elif isinstance(answer, tuple):
+            if answer[0] == 'send_file':
+                # файл хранится в кэше ответов до следующего сбора и не удаляется, пока он отправляется
+                with open(answer[1], 'rb') as file:      # файл передается частями, без чтения в память
+                    await bot.send_document(message.chat.id, document=file)
+            elif answer[0] == 'unknown command':
+                await message.answer("<b>Команда не распознана.</b>\n" + hello_msg,
+                                     parse_mode=types.ParseMode.HTML)
+    finally:
+        release_answer(answer)
+
+
+def _format_price(price: int | None) -> str:
+    """ Возвращает цену с пробелами между разрядами. """
+    return '-' if price is None else f'{price:,}'.replace(',', ' ')
+
+
+def _format_notification(notification: tuple) -> str:
+    """ Возвращает описание найденной по подписке квартиры. """
+    _, _, subscription_id, flat_id, name, rooms, area, floor, price, previous_price, url = notification
+    change = 'новая' if previous_price is None else f'было {_format_price(previous_price)}'
+    return f'<b>{html.escape(name or "")}</b>, комнат {rooms}, {area} м², этаж {floor}: <b>{_format_price(price)}</b> ({change}), ' \
+           f'подписка {subscription_id}\n{url}'
+
+
+async def send_notifications():
+    """ Отправляет пользователям найденные по подпискам квартиры, проверяет их каждые NOTIFICATIONS_INTERVAL секунд. """
+    while True:
+        try:
+            await _send_pending_notifications()
+        except Exception as ex:
+            bot_logger.error(f"Ошибка при отправке уведомлений: {ex!r}")
+        await asyncio.sleep(NOTIFICATIONS_INTERVAL)
+
+
+async def _send_pending_notifications():
+    """ Отправляет неотправленные уведомления, по NOTIFICATIONS_IN_MESSAGE квартир в сообщении. """
+    for chat_id, notifications in groupby(await run_in_db_pool(subscriptions.get_pending_notifications),
+                                          key=itemgetter(1)):
+        notifications = list(notifications)
+        for start in range(0, len(notifications), NOTIFICATIONS_IN_MESSAGE):
+            part = notifications[start:start + NOTIFICATIONS_IN_MESSAGE]
+            try:
+                await bot.send_message(chat_id, '\n\n'.join(map(_format_notification, part)),
+                                       parse_mode=types.ParseMode.HTML, disable_web_page_preview=True)
+            except (BotBlocked, ChatNotFound, UserDeactivated) as ex:
+                # чат недоступен, уведомления не будут доставлены и не должны копиться
+                bot_logger.warning(f"Уведомления в чат {chat_id} не отправлены: {ex}")
+            except TelegramAPIError as ex:
+                bot_logger.error(f"Не удалось отправить уведомления в чат {chat_id}: {ex}")
+                break
+            await run_in_db_pool(subscriptions.mark_notifications_sent, [notification[0] for notification in part])
+
+
+async def on_startup(_):
+    global notifications_task
+    notifications_task = asyncio.create_task(send_notifications())
+
+
+async def on_shutdown(_):
+    if notifications_task is not None:
+        notifications_task.cancel()
 
 
 def run():
     """Запускает телеграм бота. """
-    executor.start_polling(dp)
+    executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
 
 
 if __name__ == '__main__':
@@ -2,22 +2,148 @@
 Модуль для обработки команд пользователя.
 """
 
+import dataclasses
+import os
+from datetime import date
+from itertools import count
+from typing import Iterable
+
 import services
-from database import database
+from services.cache import LRUCache
+from database import database, analytics, subscriptions
+from settings import BOT_CACHE_ENTRIES, BOT_CACHE_SIZE, REPORT_FORMAT, NEAR_RADIUS_KM
 
 
 PATH_FOR_FILES = 'temp/'
+ANALYTICS_COMMANDS = ('снижение', 'медиана', 'бронь', 'изменения')
+SUBSCRIPTION_COMMANDS = ('подписка', 'подписки', 'отписка')
+GEO_COMMANDS = ('рядом', 'область')
+REPORT_WRITERS = {'xlsx': services.save_to_excel_file, 'csv': services.save_to_csv_file}
+REPORT_EXTENSIONS = {'xlsx': '.xlsx', 'csv': '.csv.gz'}
+MAX_MESSAGE_LENGTH = 4096     # символов в сообщении телеграм, более длинный ответ отправляется файлом
+
+
+_file_numbers = count()     # номер в названии файла, чтобы одновременные запросы не перезаписали файлы друг друга
+
+
+def _remove_file(answer: str | tuple) -> None:
+    """ Удаляет файл ответа, вытесненного из кэша. """
+    if isinstance(answer, tuple) and answer[0] == 'send_file' and os.path.exists(answer[1]):
+        os.remove(answer[1])
+
+
+def _get_answer_size(answer: str | tuple) -> int:
+    """ Возвращает размер ответа в байтах (для файла - размер файла). """
+    if isinstance(answer, tuple):
+        return os.path.getsize(answer[1])
+    return len(answer.encode())
+
+
+# ответы на команды до следующего сбора, включая созданные файлы отчетов
+results_cache = LRUCache(BOT_CACHE_ENTRIES, BOT_CACHE_SIZE, on_evict=_remove_file)
+
+
+def _get_file_name(name: str) -> str:
+    """ Возвращает уникальное название файла ответа без расширения. """
+    return f'{PATH_FOR_FILES}{name}__{services.get_data_time()}_{next(_file_numbers)}'
+
+
+def _save_report(rows: Iterable[tuple], name: str, head: tuple[str, ...] = services.FLATS_HEAD,
+                 report_format: str = REPORT_FORMAT) -> tuple | None:
+    """
+    Записывает строки в файл отчета по мере чтения из базы данных.
+
+    :param rows: Строки отчета (список или генератор).
+    :param name: Название файла без расширения.
+    :param head: Заголовок таблицы.
+    :param report_format: Формат файла: 'xlsx' или 'csv' (csv.gz).
+    :return: Кортеж ('send_file', <путь к файлу>) или None, если строк нет (файл удаляется).
+    """
+    file_name = _get_file_name(name)
+    path = file_name + REPORT_EXTENSIONS[report_format]
+    if REPORT_WRITERS[report_format](rows, file_name, head) > 0:
+        return 'send_file', path
+    os.remove(path)
+    return None
+
+
+def _get_report_format(args: list[str]) -> str | None:
+    """ Возвращает формат отчета из необязательного последнего параметра команды, None - неизвестный формат. """
+    if not args:
+        return REPORT_FORMAT
+    report_format = args[0].lower()
+    return report_format if len(args) == 1 and report_format in REPORT_WRITERS else None
+
+
+def _get_cache_key(command: list[str]) -> tuple:
+    """
+    Возвращает ключ кэша команды: название команды без учета регистра и ее параметры,
+    у команды "Квартиры" - фильтр квартир, так что одинаковые фильтры, записанные по-разному, совпадают.
+    Аналитика зависит от текущей даты, поэтому она тоже входит в ключ.
+    """
+    cmd = command[0].lower()
+    if cmd == 'квартиры' and len(command) in (8, 9):
+        try:
+            return cmd, _get_flats_filter(command[1:8]), _get_report_format(command[8:])
+        except ValueError:
+            pass
+    return date.today().isoformat(), cmd, *command[1:]
+
+
+def get_answer(command: list[str], chat_id: int = None) -> str | tuple:
+    """
+    Возвращает ответ на команду пользователя (см. parse_command).
+    Ответы на команды чтения хранятся в кэше до следующего сбора (версия данных database.get_data_version),
+    файлы ответов удаляются при вытеснении из кэша. После отправки ответа нужно вызвать release_answer:
+    до этого файл ответа не удаляется, даже если он вытеснен из кэша.
+
+    :param command: Команда пользователя.
+    :param chat_id: id чата пользователя, нужен для команд подписок.
+    :return: Строка или кортеж.
+    """
+    if command[0].lower() in SUBSCRIPTION_COMMANDS:
+        return parse_command(command, chat_id)
+
+    results_cache.set_version(database.get_data_version())
+    key = _get_cache_key(command)
+    answer = results_cache.get(key, pin=True)
+    if answer is None:
+        answer = parse_command(command, chat_id)
+        if isinstance(answer, str) or (isinstance(answer, tuple) and answer[0] == 'send_file'):
+            results_cache.put(key, answer, _get_answer_size(answer), pin=True)
+    return answer
+
+
+def release_answer(answer: str | tuple) -> None:
+    """
+    Освобождает отправленный ответ get_answer: файл ответа, вытесненного из кэша
+    или не поместившегося в него, удаляется.
+    """
+    if not results_cache.release(answer):
+        _remove_file(answer)
 
 
-def parse_command(command: list[str]) -> str | tuple:
+def parse_command(command: list[str], chat_id: int = None) -> str | tuple:
     """
     Обрабатывает команды пользователя и возвращает результат:
-    строку с ответом, кортеж ('send_file', <название файла>)
+    строку с ответом, кортеж ('send_file', <путь к файлу>)
     или кортеж ('unknown command', ).
 
     :param command: Команда пользователя.
+    :param chat_id: id чата пользователя, нужен для команд подписок.
     :return: Строка или кортеж.
     """
+    if command[0].lower() in ANALYTICS_COMMANDS:
+        return parse_analytics_command(command)
+    if command[0].lower() in SUBSCRIPTION_COMMANDS and chat_id is not None:
+        return parse_subscription_command(command, chat_id)
+    if command[0].lower() in GEO_COMMANDS:
+        return parse_geo_command(command)
+    if command[0].lower() == 'поиск' and len(command) > 1:
+        # поиск по полнотекстовому индексу, ближе всего к запросу - первыми
+        flats = database.search_flats(' '.join(command[1:]), database.FlatsFilter(booking_status='active'))
+        return _save_report(flats, 'Поиск') or f"Свободные квартиры по запросу '{' '.join(command[1:])}' не найдены."
+
     if len(command) == 1:
         cmd = command[0].lower()
         db_info = ()
@@ -35,23 +161,131 @@ def parse_command(command: list[str]) -> str | tuple:
         if command[0].lower() == 'квартира':
             db_info = database.get_flat(int(command[1]))
             if len(db_info) > 0:
-                file_name = f'{PATH_FOR_FILES}Квартира_id{int(command[1])}__{services.get_data_time()}'
-                services.save_to_excel_file(db_info, file_name)
-                return 'send_file', file_name
+                return _save_report(db_info, f'Квартира_id{int(command[1])}')
             else:
                 return f'Квартира с id {command[1]} не найдена.'
 
-    elif len(command) == 8 and command[0].lower() == "квартиры":
-        keys = database.flats_filter.keys()
-        command[5] = command[5] + '-__-__'      # приводит дату к виду '2024-__-__'
-        flats_filter = dict(zip(keys, command[1:]))
-        print(f"{flats_filter=}")
-        db_info = database.get_flats_by_filter_last_price(flats_filter)
-        if len(db_info) > 0:
-            file_name = f'{PATH_FOR_FILES}Квартиры__{services.get_data_time()}'
-            services.save_to_excel_file(db_info, file_name)
-            return 'send_file', file_name
-        else:
-            return f'Квартиры по указанному фильтру не найдены.'
+    elif len(command) in (8, 9) and command[0].lower() == "квартиры" \
+            and (report_format := _get_report_format(command[8:])) is not None:
+        # строки читаются из базы данных частями и сразу пишутся в файл,
+        # память не зависит от количества найденных квартир
+        flats = database.iter_flats_by_filter_last_price(_get_flats_filter(command[1:8]))
+        return _save_report(flats, 'Квартиры', report_format=report_format) \
+            or 'Квартиры по указанному фильтру не найдены.'
     else:
         return 'unknown command',
+
+
+def _get_flats_filter(args: list[str]) -> database.FlatsFilter:
+    """
+    Возвращает фильтр квартир из параметров команды "Квартиры"
+    (город, ЖК, количество комнат, максимальная цена, год заселения, отделка, бронь).
+    """
+    args = list(args)
+    args[4] = args[4] + '-__-__'      # приводит дату к виду '2024-__-__'
+    return database.FlatsFilter.from_dict(dict(zip(database.flats_filter.keys(), args)))
+
+
+def _describe_flats_filter(flats_filter: database.FlatsFilter) -> str:
+    """ Возвращает описание заданных полей фильтра квартир. """
+    return ', '.join(f"{key}={value}" for key, value in dataclasses.asdict(flats_filter).items() if value not in (None, ()))
+
+
+def parse_analytics_command(command: list[str]) -> str | tuple:
+    """
+    Обрабатывает команды аналитики по истории цен:
+    снижение "дней" ["количество"] - квартиры с наибольшим снижением цены;
+    медиана "id ЖК" ["дней"] - медиана цены за метр по комнатам и отделке;
+    бронь ["дней"] - смены статуса бронирования (файлом, если не помещаются в сообщение);
+    изменения "дней" ["id квартиры"] - изменения цен всех квартир или одной квартиры.
+
+    :param command: Команда пользователя.
+    :return: Строка, кортеж ('send_file', <путь к файлу>) или кортеж ('unknown command', ).
+    """
+    cmd = command[0].lower()
+    if not all(arg.isdigit() for arg in command[1:]):
+        return 'unknown command',
+    args = [int(arg) for arg in command[1:]]
+
+    if cmd == 'снижение' and len(args) in (1, 2):
+        db_info = analytics.get_price_drops(*args)
+        name = f'Снижение_цен_{args[0]}_дней'
+        head = analytics.PRICE_DROPS_HEAD
+    elif cmd == 'медиана' and len(args) in (1, 2):
+        db_info = analytics.get_meter_price_medians(*args[1:], project_id=args[0])
+        name = f'Медиана_ЖК_id{args[0]}'
+        head = analytics.MEDIANS_HEAD
+    elif cmd == 'бронь' and len(args) <= 1:
+        db_info = analytics.get_booking_churn(*args)
+        answer = '\n'.join(f"{data}: {previous_status} → {booking_status} {count}"
+                           for data, previous_status, booking_status, count in db_info)
+        if len(answer) <= MAX_MESSAGE_LENGTH:
+            return answer or 'Статус бронирования не менялся.'
+        name = 'Смены_брони'
+        head = analytics.BOOKING_CHURN_HEAD
+    elif cmd == 'изменения' and len(args) in (1, 2):
+        db_info = analytics.get_price_changes(*args)
+        name = f'Изменения_цен_{args[0]}_дней' + (f'_id{args[1]}' if len(args) == 2 else '')
+        head = analytics.PRICE_CHANGES_HEAD
+    else:
+        return 'unknown command',
+
+    return _save_report(db_info, name, head) or 'Нет данных за указанный период.'
+
+
+def parse_geo_command(command: list[str]) -> str | tuple:
+    """
+    Обрабатывает команды поиска свободных квартир по координатам ЖК:
+    рядом "широта" "долгота" ["радиус, км"] - квартиры в ЖК не дальше радиуса от точки
+    (по умолчанию NEAR_RADIUS_KM, также обрабатывается отправленная боту геопозиция);
+    область "мин. широта" "мин. долгота" "макс. широта" "макс. долгота" - квартиры в ЖК внутри области.
+    Ближайшие ЖК - первыми.
+
+    :param command: Команда пользователя.
+    :return: Строка, кортеж ('send_file', <путь к файлу>) или кортеж ('unknown command', ).
+    """
+    cmd = command[0].lower()
+    try:
+        args = [float(arg.replace(',', '.')) for arg in command[1:]]
+    except ValueError:
+        return 'unknown command',
+    active = database.FlatsFilter(booking_status='active')
+
+    if cmd == 'рядом' and len(args) in (2, 3) and -90 <= args[0] <= 90 and (len(args) == 2 or args[2] > 0):
+        latitude, longitude, radius_km = *args[:2], args[2] if len(args) == 3 else NEAR_RADIUS_KM
+        flats = database.iter_flats_near(latitude, longitude, radius_km, active)
+        return _save_report(flats, 'Квартиры_рядом', database.NEAR_FLATS_HEAD) \
+            or f'Свободных квартир в радиусе {radius_km:g} км не найдено.'
+    elif cmd == 'область' and len(args) == 4 and args[0] <= args[2] and args[1] <= args[3]:
+        flats = database.iter_flats_in_box(*args, active)
+        return _save_report(flats, 'Квартиры_в_области', database.NEAR_FLATS_HEAD) \
+            or 'Свободных квартир в указанной области не найдено.'
+    return 'unknown command',
+
+
+def parse_subscription_command(command: list[str], chat_id: int) -> str | tuple:
+    """
+    Обрабатывает команды подписок на новые и подешевевшие квартиры:
+    подписка "параметры как у команды Квартиры" - сохранить фильтр;
+    подписки - список подписок;
+    отписка "id подписки" - удалить подписку.
+
+    :param command: Команда пользователя.
+    :param chat_id: id чата пользователя.
+    :return: Строка или кортеж ('unknown command', ).
+    """
+    cmd = command[0].lower()
+    if cmd == 'подписка' and len(command) == 8:
+        subscription_id = subscriptions.add_subscription(chat_id, _get_flats_filter(command[1:]))
+        return f'Подписка {subscription_id} сохранена, новые и подешевевшие квартиры придут после следующего сбора.'
+    elif cmd == 'подписки' and len(command) == 1:
+        user_subscriptions = subscriptions.get_subscriptions(chat_id)
+        if not user_subscriptions:
+            return 'Подписок нет.'
+        return '\n'.join(f"{subscription_id}: {_describe_flats_filter(flats_filter)}"
+                         for subscription_id, flats_filter in user_subscriptions)
+    elif cmd == 'отписка' and len(command) == 2 and command[1].isdigit():
+        if subscriptions.delete_subscription(chat_id, int(command[1])):
+            return f'Подписка {command[1]} удалена.'
+        return f'Подписка {command[1]} не найдена.'
+    return 'unknown command',